@@ -138,6 +138,9 @@ while True:
 
         samples = rec.get_samples()
 
+        # persist dialog memory in time while nobody talks to us
+        kernal.idle()
+
         audio, finalize = vad.process_audio(samples)
         if not audio:
             continue
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*- 
 
 #
-# Copyright 2017 Guenter Bartsch, Heiko Schaefer
+# Copyright 2018 Guenter Bartsch
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
@@ -18,41 +18,36 @@
 #
 
 #
-# benchmark prolog compiler+runtime through kernal
+# benchmark skill compilation (AIKernal.compile_skill)
+#
+# uses zamiaai.ini from the current directory, so run this from a
+# scratch dir if you do not want your db to be touched.
 #
 
 import sys
-import logging
-import codecs
-import cProfile, pstats
-from time import time
-
-from sqlalchemy.orm import sessionmaker
-import model
 
-from zamiaprolog.logicdb       import LogicDB
-from aiprolog.runtime          import AIPrologRuntime, USER_PREFIX
+from zamiaai.ai_kernal import AIKernal
 
-from zamiaprolog.logic         import Predicate
-from zamiaprolog.errors        import PrologError, PrologRuntimeError
-from ai_kernal                 import AIKernal
-from nltools                   import misc
+from bench_utils       import bench_option_parser, setup_logging, BenchRunner
 
-def _bench_fn():
+DEFAULT_SKILLS = [ 'humans', 'mathematics', 'bio' ]
 
-    kernal.compile_module_multi (['humans'], run_trace=False, print_utterances=False)
+parser = bench_option_parser("usage: %prog [options] [skill ...]")
+(options, args) = parser.parse_args()
+setup_logging(options)
 
+skills = args if args else DEFAULT_SKILLS
 
-logging.basicConfig(level=logging.INFO)
-# logging.basicConfig(level=logging.DEBUG)
-# logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+kernal = AIKernal.from_ini_file()
 
-kernal = AIKernal()
+for skill in skills:
+    kernal.load_skill(skill)
 
+runner = BenchRunner('compile', options)
 
-cProfile.run('_bench_fn()', 'mestats')
+for skill in skills:
+    # one compile run is expensive enough already
+    runner.bench('compile_skill.%s' % skill, lambda skill=skill: kernal.compile_skill(skill), min_rounds=1, min_time=0.0)
 
-p = pstats.Stats('mestats')
-# p.strip_dirs().sort_stats(-1).print_stats()
-p.sort_stats('cumulative').print_stats(10)
+sys.exit(runner.finish())
 
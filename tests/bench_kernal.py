@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*- 
 
 #
-# Copyright 2017 Guenter Bartsch, Heiko Schaefer
+# Copyright 2018 Guenter Bartsch
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
@@ -18,62 +18,131 @@
 #
 
 #
-# benchmark prolog runtime through the kernal
+# benchmark the serving path: process_input, AIContext.ner, dialog memory
+# and (optionally) NLPModel.predict
+#
+# uses zamiaai.ini from the current directory, the humans skill has to be
+# compiled already (or use -c).
 #
 
 import sys
 import logging
-import codecs
-import cProfile, pstats
-from time import time
 
-from sqlalchemy.orm import sessionmaker
-import model
+from zamiaai.ai_kernal import AIKernal
+from zamiaai.ner_index import NERIndex
+
+from bench_utils       import bench_option_parser, setup_logging, BenchRunner
+
+BENCH_SKILL = 'humans'
+BENCH_USER  = u'bench_user'
+BENCH_REALM = u'bench_realm'
+BENCH_LANG  = 'en'
+
+INP_EXACT    = u'do you know angela merkel'
+INP_NER      = u'where was angela merkel born'
+INP_FALLBACK = u'the quick brown fox jumps over the lazy dog'
+
+MEM_OPS      = 100
+
+parser = bench_option_parser()
+parser.add_option ("-c", "--compile", action="store_true", dest="compile",
+                   help="compile the %s skill first" % BENCH_SKILL)
+parser.add_option ("-n", "--nlp", action="store_true", dest="nlp",
+                   help="benchmark NLPModel.predict as well (needs a trained model)")
+(options, args) = parser.parse_args()
+setup_logging(options)
+
+kernal = AIKernal.from_ini_file()
+
+if options.compile:
+    kernal.compile_skill_multi([BENCH_SKILL])
+
+for skill in kernal.all_skills:
+    kernal.consult_skill(skill)
+
+if not kernal.dte.lookup_data_train(INP_EXACT, BENCH_LANG):
+    logging.error('no training data for "%s" found, compile the %s skill first (-c).' % (INP_EXACT, BENCH_SKILL))
+    sys.exit(2)
 
-from zamiaprolog.logicdb       import LogicDB
-from aiprolog.runtime          import AIPrologRuntime, USER_PREFIX
-from aiprolog.parser           import AIPrologParser
-from aiprolog.nlp_macro_engine import NLPMacroEngine
+def _ctx():
+    ctx = kernal.create_context(user=BENCH_USER, realm=BENCH_REALM)
+    ctx.lang = BENCH_LANG
+    return ctx
 
-from zamiaprolog.logic         import Predicate
-from zamiaprolog.errors        import PrologError, PrologRuntimeError
-from ai_kernal                 import AIKernal
-from nltools                   import misc
+ctx    = _ctx()
+runner = BenchRunner('kernal', options)
 
-def _bench_fn():
+#
+# process_input
+#
+
+runner.bench('process_input.exact',    lambda: kernal.process_input(ctx, INP_EXACT))
+runner.bench('process_input.ner',      lambda: kernal.process_input(ctx, INP_NER))
+runner.bench('process_input.fallback', lambda: kernal.process_input(ctx, INP_FALLBACK))
+
+#
+# NER
+#
 
-    user_uri = USER_PREFIX + 'benchmark'
+# the NER index is shared by all contexts and ner() results are cached per turn:
+# warm scores against loaded tables with the turn cache cleared, cold loads
+# the tables into a fresh index first
 
-    start_time = time()
+def _ner_warm():
+    ctx.turn_cache.ner.clear()
+    ctx.ner(BENCH_LANG, 'human', 3, 5)
 
-    abufs = kernal.process_input(line, 'en', user_uri, test_mode=True, trace=False)
+def _ner_cold():
+    ner_index = kernal.ner_index
+    kernal.ner_index = NERIndex(ner_index.session, bundle=ner_index.bundle)
+    try:
+        c = _ctx()
+        c.set_inp(INP_NER)
+        c.ner(BENCH_LANG, 'human', 3, 5)
+    finally:
+        kernal.ner_index = ner_index
 
-    logging.info ('process_input took %fs' % (time()-start_time))
+ctx.set_inp(INP_NER)
+runner.bench('ner.warm', _ner_warm)
+runner.bench('ner.cold', _ner_cold)
 
-    for abuf in abufs:
-        logging.debug ("abuf: %s" % repr(abuf))
+#
+# dialog memory
+#
 
+def _mem_set():
+    for i in range(MEM_OPS):
+        kernal.mem_set(BENCH_REALM, 'k%d' % (i % 10), u'v%d' % i)
 
-logging.basicConfig(level=logging.INFO)
-# logging.basicConfig(level=logging.DEBUG)
-# logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+def _mem_get():
+    for i in range(MEM_OPS):
+        kernal.mem_get(BENCH_REALM, 'k%d' % (i % 10))
 
-kernal = AIKernal()
+def _mem_push():
+    for i in range(MEM_OPS):
+        kernal.mem_push(BENCH_REALM, 'k%d' % (i % 10), u'v%d' % i)
 
-line = u'exp do you know obama'
+def _mem_get_multi():
+    for i in range(MEM_OPS):
+        kernal.mem_get_multi(BENCH_REALM, 'k%d' % (i % 10))
 
-# MODEL = 'models/200ksteps_2_1024_de.ini'
+runner.bench('mem.set',       _mem_set,       ops=MEM_OPS)
+runner.bench('mem.get',       _mem_get,       ops=MEM_OPS)
+runner.bench('mem.push',      _mem_push,      ops=MEM_OPS)
+runner.bench('mem.get_multi', _mem_get_multi, ops=MEM_OPS)
+runner.bench('mem.persist',   kernal.prolog_persist)
 
-for mn2 in kernal.all_modules:
-    kernal.load_module (mn2)
+kernal.mem_clear(BENCH_REALM)
+kernal.mem_clear(BENCH_USER)
+kernal.mem_flush()
 
-kernal.init_module ('exp', run_trace=False)
-# kernal.setup_tf_model(True, True, MODEL)
+#
+# neural net
+#
 
-                
-cProfile.run('_bench_fn()', 'mestats')
+if options.nlp:
+    kernal.setup_nlp_model()
+    runner.bench('nlp.predict', lambda: kernal.nlp_model.predict(INP_FALLBACK))
 
-p = pstats.Stats('mestats')
-# p.strip_dirs().sort_stats(-1).print_stats()
-p.sort_stats('cumulative').print_stats(10)
+sys.exit(runner.finish())
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# benchmark macro expansion (DataEngine._expand_macros) on synthetic patterns
+#
+
+import sys
+
+from sqlalchemy.orm      import sessionmaker
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine
+
+from bench_utils         import bench_option_parser, setup_logging, BenchRunner
+
+BENCH_SKILL = 'bench'
+
+def _implicit_pattern(n_groups, n_alts):
+    """ n_groups implicit macros with n_alts alternatives each -> n_alts**n_groups expansions """
+    group = u'(' + u'|'.join([ u'w%d' % i for i in range(n_alts) ]) + u')'
+    return u'foo ' + u' '.join([ group ] * n_groups) + u' bar'
+
+parser = bench_option_parser()
+(options, args) = parser.parse_args()
+setup_logging(options)
+
+engine  = model.data_engine_setup('sqlite://', echo=False)
+session = sessionmaker(bind=engine)()
+dte     = DataEngine(session)
+
+dte.prepare_compilation(BENCH_SKILL)
+
+# named macros of various sizes
+
+for n in [10, 100, 1000]:
+    for i in range(n):
+        dte.macro('en', 'names_%d' % n, {'W': u'first%d last%d' % (i, i), 'L': u'label%d' % i})
+dte.commit()
+
+runner = BenchRunner('macros', options)
+
+for n_groups, n_alts in [ (1, 2), (3, 4), (4, 6), (6, 4) ]:
+    txt = _implicit_pattern(n_groups, n_alts)
+    runner.bench('expand.implicit_%dx%d' % (n_groups, n_alts), lambda txt=txt: list(dte._expand_macros('en', txt)))
+
+for n in [10, 100, 1000]:
+    txt = u'do you know {names_%d:W} (really|at all)?' % n
+    runner.bench('expand.named_%d' % n, lambda txt=txt: list(dte._expand_macros('en', txt)))
+
+# same macro used twice: both invocations bind the same alternative
+
+txt = u'is {names_100:W} (nicer|smarter) than {names_100:W}?'
+runner.bench('expand.named_reused_100', lambda txt=txt: list(dte._expand_macros('en', txt)))
+
+sys.exit(runner.finish())
+
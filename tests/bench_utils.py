@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# shared benchmark runner
+#
+# each bench_*.py script registers its benchmarks with a BenchRunner which
+# times them, writes the results as JSON and compares them against a
+# baseline written by an earlier run:
+#
+#   python tests/bench_macros.py -o baseline.json
+#   ... change code ...
+#   python tests/bench_macros.py -b baseline.json
+#
+# the exit code is 1 if any benchmark got slower than the threshold allows.
+#
+
+import sys
+import json
+import time
+import logging
+import platform
+
+from timeit   import default_timer
+from optparse import OptionParser
+
+DEFAULT_THRESHOLD  = 0.2  # relative slowdown of the median that counts as regression
+DEFAULT_MIN_TIME   = 1.0  # seconds to spend per benchmark
+DEFAULT_MIN_ROUNDS = 5
+
+def bench_option_parser(usage="usage: %prog [options]"):
+
+    """ option parser with the options every benchmark script supports, add script specific ones on top """
+
+    parser = OptionParser(usage)
+
+    parser.add_option ("-b", "--baseline", dest="baseline", type="string",
+                       help="compare results against this JSON file written by an earlier run")
+    parser.add_option ("-k", "--filter", dest="filter", type="string",
+                       help="run only benchmarks whose name contains this string")
+    parser.add_option ("-m", "--min-time", dest="min_time", type="float", default=DEFAULT_MIN_TIME,
+                       help="seconds to spend per benchmark, default: %f" % DEFAULT_MIN_TIME)
+    parser.add_option ("-o", "--output", dest="output", type="string",
+                       help="write results to this JSON file")
+    parser.add_option ("-t", "--threshold", dest="threshold", type="float", default=DEFAULT_THRESHOLD,
+                       help="relative slowdown that counts as regression, default: %f" % DEFAULT_THRESHOLD)
+    parser.add_option ("-v", "--verbose", action="store_true", dest="verbose",
+                       help="verbose output")
+
+    return parser
+
+def setup_logging(options):
+
+    if options.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+
+class BenchRunner(object):
+
+    def __init__(self, suite, options):
+
+        self.suite   = suite
+        self.options = options
+        self.results = {} # name -> stats dict, times in seconds per op
+
+    def bench(self, name, fn, ops=1, min_rounds=DEFAULT_MIN_ROUNDS, min_time=None):
+
+        """ time fn() until min_time has passed and at least min_rounds rounds were run.
+            ops is the number of operations a single fn() call performs. """
+
+        if self.options.filter and not self.options.filter in name:
+            return
+
+        if min_time is None:
+            min_time = self.options.min_time
+
+        logging.info('%s: %s ...' % (self.suite, name))
+
+        times      = []
+        start_time = default_timer()
+
+        while len(times) < min_rounds or default_timer() - start_time < min_time:
+
+            t = default_timer()
+            fn()
+            times.append((default_timer() - t) / ops)
+
+        times.sort()
+
+        self.results[name] = { 'rounds' : len(times),
+                               'ops'    : ops,
+                               'min'    : times[0],
+                               'median' : times[len(times) // 2],
+                               'mean'   : sum(times) / len(times),
+                               'max'    : times[-1] }
+
+    def _compare(self, baseline):
+
+        """ log comparison table, return list of regressed benchmark names """
+
+        regressions = []
+
+        logging.info('%-40s %12s %12s %8s' % ('benchmark', 'median (ms)', 'base (ms)', 'change'))
+
+        for name in sorted(self.results):
+
+            median = self.results[name]['median']
+
+            if not name in baseline:
+                logging.info('%-40s %12.3f %12s %8s' % (name, median * 1000.0, '-', '-'))
+                continue
+
+            base   = baseline[name]['median']
+            change = (median - base) / base if base > 0.0 else 0.0
+
+            flag = ''
+            if change > self.options.threshold:
+                flag = ' REGRESSION'
+                regressions.append(name)
+
+            logging.info('%-40s %12.3f %12.3f %+7.1f%%%s' % (name, median * 1000.0, base * 1000.0, change * 100.0, flag))
+
+        return regressions
+
+    def finish(self):
+
+        """ write results, compare against baseline, return exit code """
+
+        res = { 'suite'   : self.suite,
+                'ts'      : time.time(),
+                'python'  : platform.python_version(),
+                'results' : self.results }
+
+        if self.options.output:
+            with open(self.options.output, 'w') as f:
+                f.write(json.dumps(res, indent=2, sort_keys=True))
+            logging.info('%s written.' % self.options.output)
+
+        baseline = {}
+        if self.options.baseline:
+            with open(self.options.baseline, 'r') as f:
+                baseline = json.loads(f.read())['results']
+
+        regressions = self._compare(baseline)
+
+        if regressions:
+            logging.error('%d regression(s) > %.0f%%: %s' % (len(regressions), self.options.threshold * 100.0, ', '.join(regressions)))
+            return 1
+
+        return 0
+
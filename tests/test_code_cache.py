@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+
+from zamiaai.code_cache import CodeCache
+
+CODE = { 'a': ('_resp', 'def _resp(c):\n    c.append(u"a")\n'),
+         'b': ('_resp', 'def _resp(c, x):\n    c.append(x)\n'),
+         'c': ('foo',   'def foo(c):\n    c.append(BAR)\n') }
+
+class FakeDataEngine(object):
+
+    def __init__(self):
+        self.lookups = 0
+
+    def lookup_code(self, md5s):
+        self.lookups += 1
+        return CODE[md5s]
+
+class TestCodeCache (unittest.TestCase):
+
+    def setUp(self):
+        self.dte   = FakeDataEngine()
+        self.cache = CodeCache(self.dte, {'BAR': u'bar'}, max_size=2)
+
+    def test_compile_once(self):
+
+        res = []
+        self.cache.lookup('a')(res)
+        self.cache.lookup('a')(res)
+        self.cache.lookup('b')(res, u'x')
+
+        self.assertEqual (res, [u'a', u'a', u'x'])
+        self.assertEqual (self.dte.lookups, 2)
+        self.assertEqual (self.cache.get_stats(), (1, 2, 2))
+
+    def test_namespace(self):
+
+        res = []
+        self.cache.lookup('c')(res)
+        self.assertEqual (res, [u'bar'])
+
+    def test_lru(self):
+
+        self.cache.lookup('a')
+        self.cache.lookup('b')
+        self.cache.lookup('a')
+        self.cache.lookup('c') # evicts b
+
+        self.assertEqual (list(self.cache.fns.keys()), ['a', 'c'])
+
+        self.cache.lookup('b')
+        self.assertEqual (self.dte.lookups, 4)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
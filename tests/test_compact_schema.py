@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import logging
+import tempfile
+import shutil
+import json
+import codecs
+
+from sqlalchemy.orm         import sessionmaker
+
+from zamiaai                import model
+from zamiaai                import compact_schema
+from zamiaai.data_engine    import DataEngine
+
+class TestCompactSchema (unittest.TestCase):
+
+    def setUp(self):
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+
+        self.tmpdir  = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _compile(self, skill_name, compact):
+
+        dte = DataEngine(self.session, batch_size=2)
+        dte.set_compact_schema(compact)
+
+        # named macros are global, every skill gets its own
+
+        rooms = '%s_rooms' % skill_name
+
+        dte.prepare_compilation(skill_name)
+        dte.macro('en', rooms, {'LABEL': u'living room'})
+        dte.macro('en', rooms, {'LABEL': u'kitchen'})
+        dte.dt('en', u'(switch|turn) on the light in the {%s:LABEL}' % rooms, u'ok', ['%s_0_start' % rooms, '%s_0_end' % rooms])
+        dte.dt('de', u'hallo (computer|)', u'hallo')
+        dte.publish()
+
+        return dte
+
+    def test_lookup(self):
+
+        wide    = self._compile('wide', False)
+        compact = self._compile('compact', True)
+
+        self.assertEqual (self.session.query(model.TrainingData).count(), 6)
+        self.assertEqual (self.session.query(model.CompactTrainingData).count(), 6)
+        self.assertEqual (self.session.query(model.TDArgs).count(), 3)
+
+        res = compact.lookup_data_train(u'turn on the light in the living room', 'en')
+        self.assertEqual (sorted([ (r[0], r[1], r[3]) for r in res ]),
+                          [ ('en', u'turn on the light in the living room', [6, 8]) ] * 2)
+
+        # wide + compact rows, code de-duplicated across both
+        self.assertEqual (len(compact_schema.lookup(self.session, 'de', u'hallo')), 1)
+        self.assertEqual (compact_schema.lookup(self.session, 'en', u'hallo'), [])
+        self.assertEqual (compact_schema.count_training_data(self.session, lang='de'), 4)
+
+    def test_migrate(self):
+
+        self._compile('test', False)
+
+        before = sorted([ tuple(r) for r in compact_schema.iter_training_data(self.session) ])
+
+        self.assertEqual (compact_schema.migrate(self.session), 6)
+        self.assertEqual (self.session.query(model.TrainingData).count(), 0)
+        self.assertEqual (sorted([ tuple(r) for r in compact_schema.iter_training_data(self.session) ]), before)
+
+        self.assertEqual (compact_schema.migrate(self.session, reverse=True), 6)
+        self.assertEqual (self.session.query(model.CompactTrainingData).count(), 0)
+        self.assertEqual (self.session.query(model.TDArgs).count(), 0)
+        self.assertEqual (sorted([ tuple(r) for r in compact_schema.iter_training_data(self.session) ]), before)
+
+    def test_gc(self):
+
+        self._compile('keep', True)
+
+        counts = lambda: [ self.session.query(cls).count() for cls in [model.TDArgs, model.TDLocation, model.TDSkill, model.TDLang] ]
+        before = counts()
+
+        dte = DataEngine(self.session)
+        dte.set_compact_schema(True)
+        dte.prepare_compilation('gone')
+        dte.dt('en', u'good bye', u'bye', ['gone'])
+        dte.publish()
+
+        self.assertEqual (counts(), [ before[0]+1, before[1]+1, before[2]+1, before[3] ])
+
+        # recompiled without any data: gone's dictionary entries are dropped along with its old generation
+
+        dte.prepare_compilation('gone')
+        dte.publish()
+        dte.gc_generations()
+
+        self.assertEqual (counts(), before)
+
+        # dictionaries are reloaded, new rows get valid ids
+
+        self._compile('gone', True)
+        self.assertEqual (compact_schema.count_training_data(self.session), 12)
+        self.assertEqual (len(compact_schema.lookup(self.session, 'de', u'hallo computer')), 2)
+
+    def test_export(self):
+
+        self._compile('test', True)
+
+        fn = os.path.join(self.tmpdir, 'td.jsonl')
+        self.assertEqual (compact_schema.export_jsonl(self.session, fn, lang='de'), 2)
+
+        with codecs.open(fn, 'r', 'utf8') as f:
+            rows = [ json.loads(line) for line in f ]
+
+        self.assertEqual (sorted([ r['inp'] for r in rows ]), [u'hallo', u'hallo computer'])
+        self.assertEqual (rows[0]['skill'], 'test')
+        self.assertEqual (rows[0]['args'], None)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+import shutil
+import tempfile
+
+from sqlalchemy          import create_engine, text
+from sqlalchemy.orm      import sessionmaker
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine
+from zamiaai.code_cache  import CodeCache
+
+def _test_action(c):
+    c.append(u'greeted')
+
+class TestDataEngine (unittest.TestCase):
+
+    def setUp(self):
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+        self.dte     = DataEngine(self.session)
+
+        self.dte.prepare_compilation('test')
+        self.dte.macro('en', 'rooms', {'LABEL': u'living room', 'PL': u'in the'})
+        self.dte.macro('en', 'rooms', {'LABEL': u'kitchen',     'PL': u'in the'})
+        self.dte.commit()
+
+    def test_implicit_macros(self):
+
+        res = [ u' '.join(d) for d, mpos in self.dte._expand_macros('en', u'foo (a|b|c) (d|) bar') ]
+
+        self.assertEqual (len(res), 6)
+        self.assertTrue (u'foo a d bar' in res)
+        self.assertTrue (u'foo c bar' in res)
+
+    def test_named_macro_positions(self):
+
+        res = {}
+        for d, mpos in self.dte._expand_macros('en', u'lights {rooms:PL} {rooms:LABEL} (please|)'):
+            res[u' '.join(d)] = mpos
+
+        self.assertEqual (len(res), 4)
+
+        # both invocations of the same macro bind the same alternative
+        mpos = res[u'lights in the living room please']
+        self.assertEqual (mpos['rooms_1_start'], 3)
+        self.assertEqual (mpos['rooms_1_end'],   5)
+        self.assertEqual (mpos['rooms_1_label'], [u'living', u'room'])
+        self.assertEqual (mpos['rooms_0_label'], u'living room')
+
+    def test_bulk_write(self):
+
+        dte = DataEngine(self.session, batch_size=3)
+        dte.prepare_compilation('bulk')
+
+        dte.macro('en', 'colors', {'W': u'red'})
+        dte.macro('en', 'colors', {'W': u'green'})
+
+        # pending macros have to be visible to the expander before any commit
+        dte.dt('en', u'(a|b|c|d) {colors:W}', u'hello')
+        dte.ner('en', 'color', 'red', u'Red')
+        dte.commit()
+
+        self.assertEqual (self.session.query(model.TrainingData).filter(model.TrainingData.skill=='bulk').count(), 8)
+        self.assertEqual (len(dte.lookup_data_train(u'd green', 'en')), 1)
+        self.assertEqual (dte.lookup_ner('en', 'color'), [('red', u'red')])
+
+    def test_macro_cache(self):
+
+        self.assertEqual (len(self.dte.lookup_named_macro('en', 'rooms')), 2)
+
+        self.dte.macro('en', 'rooms', {'LABEL': u'garage', 'PL': u'in the'})
+        self.assertEqual (len(self.dte.lookup_named_macro('en', 'rooms')), 3)
+
+        md5s = self.dte.store_code(u'def _resp(c):\n    pass\n', '_resp')
+        self.assertEqual (self.dte.store_code(u'def _resp(c):\n    pass\n', '_resp'), md5s)
+        self.assertEqual (self.dte.lookup_code(md5s)[0], '_resp')
+
+    def test_expansion_cap(self):
+
+        pattern = u'(a|b|c) (d|e|f|g) {rooms:LABEL} (x|y|z)'
+
+        self.assertEqual (self.dte._count_expansions('en', pattern), 72)
+
+        res = list(self.dte._sample_expansions('en', pattern, 10))
+        self.assertEqual (len(res), 10)
+        self.assertEqual (res, list(self.dte._sample_expansions('en', pattern, 10)))
+
+        # every alternative is covered even if the sample is smaller than the biggest macro
+        words = set()
+        for d, mpos in self.dte._sample_expansions('en', pattern, 1):
+            words.update(d)
+        for w in [u'a', u'b', u'c', u'd', u'e', u'f', u'g', u'kitchen', u'living', u'x', u'y', u'z']:
+            self.assertTrue (w in words)
+
+    def test_generations(self):
+
+        dte    = DataEngine(self.session)
+        reader = DataEngine(self.session)
+
+        dte.prepare_compilation('gen')
+        dte.dt('en', u'hello (a|b)', u'hello')
+        dte.publish()
+
+        # recompilation is invisible to readers until published
+
+        dte.prepare_compilation('gen')
+        dte.dt('en', u'hello c', u'hello')
+        dte.commit()
+
+        self.assertEqual (len(reader.lookup_data_train(u'hello a', 'en')), 1)
+        self.assertEqual (len(reader.lookup_data_train(u'hello c', 'en')), 0)
+
+        dte.publish()
+
+        self.assertEqual (len(reader.lookup_data_train(u'hello a', 'en')), 0)
+        self.assertEqual (len(reader.lookup_data_train(u'hello c', 'en')), 1)
+
+        # the superseded generation is removed by the gc only
+
+        self.assertEqual (self.session.query(model.TrainingData).filter(model.TrainingData.skill=='gen').count(), 3)
+        self.assertEqual (dte.gc_generations(), 1)
+        self.assertEqual (self.session.query(model.TrainingData).filter(model.TrainingData.skill=='gen').count(), 1)
+
+    def test_migrate(self):
+
+        # db created before skill generations were introduced
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_url = 'sqlite:///%s/old.db' % tmpdir
+
+            engine = create_engine(db_url)
+            with engine.begin() as conn:
+                conn.execute(text('CREATE TABLE training_data (id INTEGER PRIMARY KEY, lang VARCHAR(2), skill VARCHAR(255), '
+                                  'inp TEXT, md5s VARCHAR(32), args VARCHAR(255), loc_fn VARCHAR(255), loc_line INTEGER)'))
+                conn.execute(text('CREATE TABLE test_case (id INTEGER PRIMARY KEY, lang VARCHAR(2), skill VARCHAR(255), name VARCHAR(255), '
+                                  'prep_code TEXT, prep_fn VARCHAR(255), rounds TEXT, loc_fn VARCHAR(255), loc_line INTEGER)'))
+                conn.execute(text('CREATE TABLE ner_data (id INTEGER PRIMARY KEY, lang VARCHAR(2), skill VARCHAR(255), '
+                                  'cls VARCHAR(255), entity VARCHAR(255), label VARCHAR(255))'))
+                conn.execute(text('CREATE TABLE named_macro (id INTEGER PRIMARY KEY, lang VARCHAR(2), skill VARCHAR(255), '
+                                  'name VARCHAR(255), soln TEXT)'))
+                conn.execute(text("INSERT INTO training_data (lang, skill, inp, md5s, args) VALUES ('en', 'old', 'hello old', 'md5', 'null')"))
+                conn.execute(text("INSERT INTO ner_data (lang, skill, cls, entity, label) VALUES ('en', 'other', 'human', 'alice', 'alice')"))
+            engine.dispose()
+
+            engine  = model.data_engine_setup(db_url, echo=False)
+            session = sessionmaker(bind=engine)()
+            dte     = DataEngine(session)
+
+            self.assertEqual (sorted(model.published_generations(session).keys()), ['old', 'other'])
+            self.assertEqual (len(dte.lookup_data_train(u'hello old', 'en')), 1)
+            self.assertEqual (dte.lookup_ner('en', 'human'), [('alice', u'alice')])
+
+            # once migrated, setup leaves the db alone
+
+            session.close()
+            engine.dispose()
+            engine  = model.data_engine_setup(db_url, echo=False)
+            session = sessionmaker(bind=engine)()
+            self.assertEqual (session.query(model.Generation).count(), 2)
+            session.close()
+            engine.dispose()
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_recompile_named_macros(self):
+
+        dte = DataEngine(self.session)
+
+        # while recompiling, the skill's published macros must not show up next to the new ones
+
+        for i in range(2):
+            dte.prepare_compilation('humans')
+            dte.macro('en', 'known_humans', {'W': u'alice'})
+            dte.dt('en', u'who is {known_humans:W}', u'no idea')
+            dte.ner('en', 'human', u'alice', u'Alice')
+
+            self.assertEqual (len(dte.lookup_named_macro('en', 'known_humans')), 1)
+            self.assertEqual (len(dte.lookup_data_train(u'who is alice', 'en')), 1)
+            self.assertEqual (len(dte.lookup_data_train_code(u'who is alice', 'en')), 1)
+            self.assertEqual (len(dte.lookup_ner('en', 'human')), 1)
+
+            dte.publish()
+
+        self.assertEqual (len(dte.lookup_data_train(u'who is alice', 'en')), 1)
+
+    def test_lookup_code(self):
+
+        dte = DataEngine(self.session)
+
+        dte.prepare_compilation('code')
+        dte.dt('en', u'hello (a|b)', u'hello')
+        dte.publish()
+
+        res = dte.lookup_data_train_code(u'hello b', 'en')
+        self.assertEqual (len(res), 1)
+
+        lang, inp, md5s, args, loc_fn, loc_line, code_fn, code = res[0]
+        self.assertEqual ((lang, inp, md5s, args, loc_fn, loc_line), dte.lookup_data_train(u'hello b', 'en')[0])
+        self.assertEqual ((code_fn, code), dte.lookup_code(md5s))
+
+        self.assertEqual (dte.lookup_data_train_code(u'hello c', 'en'), [])
+
+        # first response stored after the known codes got (re-)loaded from a non-empty code table
+
+        dte = DataEngine(self.session)
+        dte.prepare_compilation('code2')
+        dte.dt('en', u'good bye', u'bye')
+        dte.publish()
+
+        res = dte.lookup_data_train_code(u'good bye', 'en')
+        self.assertTrue (u'"bye"' in res[0][7])
+
+    def test_gc_test_actions(self):
+
+        dte = DataEngine(self.session)
+
+        for i in range(2):
+            dte.prepare_compilation('greetings')
+            dte.dt('en', u'hello', u'hi')
+            dte.ts('en', 't0000_hello', [(u'hello', u'hi', _test_action)])
+            dte.publish()
+
+        dte.prepare_compilation('other')
+        dte.dt('en', u'good bye', u'bye')
+        dte.publish()
+
+        dte.clean('other')
+        self.assertEqual (dte.gc_generations(), 1)
+
+        # the test action still runs
+
+        tests = dte.lookup_tests('greetings')
+        self.assertEqual (len(tests), 1)
+
+        res = []
+        CodeCache(dte, {}).lookup(tests[0][4][0][2])(res)
+        self.assertEqual (res, [u'greeted'])
+
+    def test_unknown_macro(self):
+
+        with self.assertRaises(Exception):
+            list(self.dte._expand_macros('en', u'hello {nosuchmacro:W}'))
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
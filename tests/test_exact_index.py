@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+
+from sqlalchemy.orm         import sessionmaker
+
+from zamiaai                import model
+from zamiaai.data_engine    import DataEngine
+from zamiaai.exact_index    import ExactMatchIndex
+
+class TestExactMatchIndex (unittest.TestCase):
+
+    def setUp(self):
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+        self.dte     = DataEngine(self.session)
+
+        self._compile(u'hello')
+
+    def _compile(self, resp):
+
+        self.dte.prepare_compilation('test')
+        self.dte.macro('en', 'rooms', {'LABEL': u'kitchen'})
+        self.dte.macro('en', 'rooms', {'LABEL': u'living room'})
+        self.dte.dt('en', u'hello (computer|)', resp)
+        self.dte.dt('en', u'hello computer', u'hi')
+        self.dte.dt('en', u'light in the {rooms:LABEL}', u'ok', ['rooms_0_start', 'rooms_0_end'])
+        self.dte.publish()
+
+    def test_lookup(self):
+
+        idx = ExactMatchIndex(self.session)
+
+        for inp in [ u'hello', u'hello computer', u'light in the living room', u'nothing' ]:
+            self.assertEqual (idx.lookup('en', inp), self.dte.lookup_data_train(inp, 'en'))
+
+        self.assertEqual (len(idx.lookup('en', u'hello computer')), 2)
+        self.assertEqual (len(idx.lookup('en', u'light in the living room')), 1)
+        self.assertEqual (idx.lookup('de', u'hello'), [])
+
+    def test_lookup_code(self):
+
+        idx = ExactMatchIndex(self.session)
+
+        for lang, inp, md5s, args, loc_fn, loc_line in idx.lookup('en', u'hello computer'):
+            self.assertEqual (idx.lookup_code(md5s), self.dte.lookup_code(md5s))
+
+        self.assertEqual (idx.lookup_code('nosuchcode'), None)
+        self.assertEqual (idx.lookup_ner('en', 'human'), None)
+
+    def test_refresh(self):
+
+        idx = ExactMatchIndex(self.session)
+        md5s = idx.lookup('en', u'hello')[0][2]
+
+        self._compile(u'good day')
+
+        self.assertEqual (idx.lookup('en', u'hello')[0][2], md5s)
+        idx.refresh()
+        self.assertNotEqual (idx.lookup('en', u'hello')[0][2], md5s)
+        self.assertEqual (len(idx.lookup('en', u'hello computer')), 2)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import logging
+import tempfile
+import shutil
+import types
+
+from sqlalchemy.orm      import sessionmaker
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine
+from zamiaai.skill_tests import SkillTestResult
+from zamiaai             import ai_kernal
+from zamiaai.ai_kernal   import AIKernal
+
+class TestSkillFingerprint (unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+
+        engine = model.data_engine_setup('sqlite://', echo=False)
+
+        # no prolog needed for fingerprints, skip the constructor
+
+        self.kernal = AIKernal.__new__(AIKernal)
+        self.kernal.session           = sessionmaker(bind=engine)()
+        self.kernal.dte               = DataEngine(self.kernal.session)
+        self.kernal.skills            = {}
+        self.kernal.skill_paths       = {}
+        self.kernal.dt_max_expansions = 0
+        self.kernal.pattern_mode      = False
+
+        self._add_skill('names', u'names = 1\n')
+        self._add_skill('greet', u'greet = 1\n', ['names'])
+
+        # tests are run by a stub, prolog is never touched
+
+        self.pyxsb_command = ai_kernal.pyxsb_command
+        ai_kernal.pyxsb_command = lambda cmd: None
+
+        self.kernal.consult_skill = lambda skill_name: None
+        self.kernal.run_test      = self._run_test
+        self.tests_run            = []
+
+    def tearDown(self):
+        ai_kernal.pyxsb_command = self.pyxsb_command
+        shutil.rmtree(self.tmpdir)
+
+    def _run_test(self, skill_name, tc):
+
+        t_name, lang, prep_code, prep_fn, rounds, loc_fn, loc_line = tc
+        self.tests_run.append(t_name)
+
+        return SkillTestResult(skill_name, t_name, lang, loc_fn, loc_line, 0.0, None, len(rounds))
+
+    def _add_skill(self, skill_name, src, depends=[]):
+
+        skill_dir = os.path.join(self.tmpdir, skill_name)
+        if not os.path.isdir(skill_dir):
+            os.makedirs(skill_dir)
+        with open(os.path.join(skill_dir, '__init__.py'), 'w') as f:
+            f.write(src)
+
+        m = types.ModuleType(skill_name)
+        m.DEPENDS = depends
+
+        self.kernal.skills[skill_name]      = m
+        self.kernal.skill_paths[skill_name] = skill_dir
+
+    def _compile(self, skill_name, get_data):
+
+        """ what AIKernal.compile_skill does around get_data() """
+
+        dte = self.kernal.dte
+        dte.prepare_compilation(skill_name)
+        get_data(dte)
+        dte.commit()
+        self.kernal._store_fingerprint(skill_name)
+        dte.publish()
+
+    def _compile_names(self, names):
+
+        def get_data(dte):
+            for name in names:
+                dte.macro('en', 'names', {'W': name})
+
+        self._compile('names', get_data)
+
+    def _compile_greet(self):
+
+        def get_data(dte):
+            dte.dt('en', u'(hi|hello) {names:W}', u'hi')
+            dte.ts('en', 't0000_hi',    [(u'hi alice', u'hi')])
+            dte.ts('en', 't0001_hello', [(u'hello alice', u'hi')])
+
+        self._compile('greet', get_data)
+
+    def test_up_to_date(self):
+
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        self.assertTrue (self.kernal.skill_up_to_date('names'))
+        self.assertTrue (self.kernal.skill_up_to_date('greet'))
+
+    def test_sources(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        self._add_skill('greet', u'greet = 2\n')
+
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+        self.assertTrue (self.kernal.skill_up_to_date('names'))
+
+    def test_macros(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        self._compile_names([u'alice', u'bob'])
+
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+
+    def test_missing_macro(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        # the implicit (hi|hello) macro would be shadowed by a named one
+
+        self.kernal.dte.prepare_compilation('names')
+        self.kernal.dte.macro('en', 'names',   {'W': u'alice'})
+        self.kernal.dte.macro('en', 'MACRO_0', {'W': u'hey'})
+        self.kernal.dte.publish()
+
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+
+    def test_options(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        self.kernal.dt_max_expansions = 100
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+
+        # skill overrides the kernal's setting
+
+        self.kernal.skills['greet'].MAX_EXPANSIONS = 0
+        self.assertTrue (self.kernal.skill_up_to_date('greet'))
+
+        self.kernal.pattern_mode = True
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+        self.kernal.skills['greet'].PATTERN_MODE = False
+        self.assertTrue (self.kernal.skill_up_to_date('greet'))
+
+        self.kernal.dte.set_compact_schema(True)
+        self.assertFalse (self.kernal.skill_up_to_date('greet'))
+
+    def test_test_keys(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        tests = [ ('greet', tc) for tc in self.kernal.dte.lookup_tests('greet') ]
+        keys  = self.kernal._test_keys(tests)
+
+        self.assertEqual (len(set(keys)), 2)
+        self.assertEqual (self.kernal._test_keys(tests), keys)
+
+        # sources are hashed as they are now, not as they were at compile time
+
+        self._add_skill('greet', u'greet = 2\n', ['names'])
+        keys2 = self.kernal._test_keys(tests)
+        self.assertNotEqual (keys2[0], keys[0])
+
+        # so are the macros of dependencies
+
+        self._compile_names([u'alice', u'bob'])
+        self.assertNotEqual (self.kernal._test_keys(tests)[0], keys2[0])
+
+    def test_changed_only(self):
+
+        self._compile_names([u'alice'])
+        self._compile_greet()
+
+        self.assertEqual (self.kernal.run_tests_multi(['greet'], changed_only=True), (2, 0))
+        self.assertEqual (self.tests_run, ['t0000_hi', 't0001_hello'])
+
+        self.assertEqual (self.kernal.run_tests_multi(['greet'], changed_only=True), (0, 0))
+
+        # a test that is not part of the cache yet runs again
+
+        self.kernal.session.query(model.CachedTestResult).filter(model.CachedTestResult.name=='t0001_hello').delete()
+        self.tests_run = []
+        self.assertEqual (self.kernal.run_tests_multi(['greet'], changed_only=True), (1, 0))
+        self.assertEqual (self.tests_run, ['t0001_hello'])
+
+        # edited, not yet recompiled sources invalidate all of the skill's tests
+
+        self._add_skill('names', u'names = 2\n')
+        self.tests_run = []
+        self.assertEqual (self.kernal.run_tests_multi(['greet'], changed_only=True), (2, 0))
+
+        # without changed_only everything runs
+
+        self.tests_run = []
+        self.assertEqual (self.kernal.run_tests_multi(['greet']), (2, 0))
+        self.assertEqual (len(self.tests_run), 2)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+import time
+
+from zamiaai.latency import TurnRecord, LatencyHistogram, STAGE_CODE, STAGE_SELECT, STAGE_PERSIST, TOTAL
+
+class TestLatency (unittest.TestCase):
+
+    def test_nested_stages(self):
+
+        rec = TurnRecord(u'user', u'realm', u'hello')
+
+        rec.start(STAGE_SELECT)
+        rec.start(STAGE_PERSIST)
+        time.sleep(0.02)
+        rec.stop()
+        rec.stop()
+
+        rec.start(STAGE_CODE)
+        rec.prolog(0.001)
+        rec.prolog_command(0.002)
+        rec.finish()
+
+        # nested stage time is not counted twice
+        self.assertGreaterEqual (rec.stages[STAGE_PERSIST], 0.02)
+        self.assertLess (rec.stages[STAGE_SELECT], 0.02)
+        self.assertTrue (STAGE_CODE in rec.stages)
+        self.assertEqual (rec.prolog_queries, 1)
+        self.assertEqual (rec.prolog_commands, 1)
+        self.assertAlmostEqual (rec.prolog_time, 0.003)
+        self.assertGreaterEqual (rec.total, sum(rec.stages.values()))
+
+    def test_histogram(self):
+
+        h = LatencyHistogram()
+        for i in range(100):
+            h.add(TOTAL, (i+1) / 1000.0)
+
+        self.assertAlmostEqual (h.percentile(TOTAL, 50), 0.050, delta=0.003)
+        self.assertAlmostEqual (h.percentile(TOTAL, 99), 0.099, delta=0.005)
+        self.assertEqual (h.percentile(TOTAL, 100), 0.1)
+        self.assertEqual (len(h.table()), 2)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import unittest
+import logging
+
+from sqlalchemy.orm      import sessionmaker
+from pyxsb               import json_to_xsb, xsb_to_json, XSBAtom
+
+from zamiaai             import ai_kernal
+from zamiaai             import model
+from zamiaai.ai_kernal   import AIKernal
+from zamiaai.mem_store   import MemStore
+
+class LogRecorder(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, level=logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class FakeContext(object):
+
+    def __init__(self):
+        self.user  = 'user'
+        self.realm = 'realm'
+
+class TestMemPersist (unittest.TestCase):
+
+    def setUp(self):
+
+        # no prolog, no skills: just what memory persistence touches
+
+        engine = model.data_engine_setup('sqlite://', echo=False)
+
+        self.kernal = AIKernal.__new__(AIKernal)
+        self.kernal.session            = sessionmaker(bind=engine)()
+        self.kernal.turn               = None
+        self.kernal.turn_cache         = None
+        self.kernal.mem_store          = MemStore()
+        self.kernal.mem_paging         = False
+        self.kernal.mem_persist        = ai_kernal.MEM_PERSIST_TURN
+        self.kernal.mem_flush_interval = 1000.0
+        self.kernal.mem_flush_batch    = 1000
+        self.kernal.mem_last_flush     = time.time()
+
+        self.commands = []
+
+        self.pyxsb_command = ai_kernal.pyxsb_command
+        self.batch_size    = ai_kernal.MEM_RESTORE_BATCH
+        ai_kernal.pyxsb_command = self.commands.append
+
+    def tearDown(self):
+        ai_kernal.pyxsb_command     = self.pyxsb_command
+        ai_kernal.MEM_RESTORE_BATCH = self.batch_size
+
+    def _add_rows(self, realm, n, v='v'):
+        for i in range(n):
+            self.kernal.session.add(model.Mem(realm=realm, k='k%d' % i, v=xsb_to_json(XSBAtom(v)), score=1.0))
+        self.kernal.session.commit()
+
+    def _db(self):
+        return sorted([ (m.realm, m.k, json_to_xsb(m.v).name, m.score) for m in self.kernal.session.query(model.Mem) ])
+
+    def test_flush(self):
+
+        k = self.kernal
+
+        k.mem_set ('user',  'name',   'alice')
+        k.mem_push('user',  'f1ent',  'a')
+        k.mem_push('user',  'f1ent',  'b')
+        k.mem_set ('realm', 'action', 'foo')
+
+        k.mem_flush()
+
+        self.assertEqual (self._db(), [ ('realm', 'action', 'foo',   1.0),
+                                        ('user',  'f1ent',  'a',     0.5),
+                                        ('user',  'f1ent',  'b',     1.0),
+                                        ('user',  'name',   'alice', 1.0) ])
+        self.assertEqual (k.mem_store.dirty, set())
+
+        # changed keys are replaced, deleted keys and cleared realms removed
+
+        k.mem_set  ('user', 'name',  'bob')
+        k.mem_set  ('user', 'f1ent', None)
+        k.mem_clear('realm')
+
+        k.mem_flush()
+
+        self.assertEqual (self._db(), [ ('user', 'name', 'bob', 1.0) ])
+
+    def test_flush_batch(self):
+
+        k = self.kernal
+        k.mem_flush_batch = 2
+
+        commits = []
+        commit  = k.session.commit
+        def count_commit():
+            commits.append(1)
+            commit()
+        k.session.commit = count_commit
+
+        for i in range(5):
+            k.mem_set('user', 'k%d' % i, 'v%d' % i)
+
+        k.mem_flush()
+
+        self.assertEqual (len(self._db()), 5)
+        self.assertEqual (len(commits), 3)
+
+    def test_persist_turn(self):
+
+        self.kernal.mem_set('user', 'name', 'alice')
+        self.kernal.prolog_persist()
+
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+    def test_persist_periodic_batch(self):
+
+        k = self.kernal
+        k.mem_persist     = ai_kernal.MEM_PERSIST_PERIODIC
+        k.mem_flush_batch = 2
+
+        k.mem_set('user', 'name', 'alice')
+        k.prolog_persist()
+        self.assertEqual (self._db(), [])
+
+        k.mem_set('user', 'age', '42')
+        k.prolog_persist()
+        self.assertEqual (len(self._db()), 2)
+
+    def test_persist_periodic_interval(self):
+
+        k = self.kernal
+        k.mem_persist        = ai_kernal.MEM_PERSIST_PERIODIC
+        k.mem_flush_interval = 5.0
+
+        k.mem_set('user', 'name', 'alice')
+        k.prolog_persist()
+        self.assertEqual (self._db(), [])
+
+        k.mem_last_flush -= 10.0
+        k.prolog_persist()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+        # interval starts over after a flush
+
+        k.mem_set('user', 'name', 'bob')
+        k.prolog_persist()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+    def test_persist_periodic_idle(self):
+
+        k = self.kernal
+        k.mem_persist        = ai_kernal.MEM_PERSIST_PERIODIC
+        k.mem_flush_interval = 5.0
+
+        k.mem_set('user', 'name', 'alice')
+        k.prolog_persist()
+
+        # no further turns: idle() keeps the interval
+
+        k.idle()
+        self.assertEqual (self._db(), [])
+
+        k.mem_last_flush -= 10.0
+        k.idle()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+        # other policies leave idle kernals alone
+
+        k.mem_persist = ai_kernal.MEM_PERSIST_SHUTDOWN
+        k.mem_set('user', 'name', 'bob')
+        k.mem_last_flush -= 10.0
+        k.idle()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+    def test_persist_shutdown(self):
+
+        k = self.kernal
+        k.mem_persist = ai_kernal.MEM_PERSIST_SHUTDOWN
+
+        k.mem_set('user', 'name', 'alice')
+        k.prolog_persist()
+        self.assertEqual (self._db(), [])
+
+        k.shutdown()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+    def test_turn_fails(self):
+
+        k = self.kernal
+        k.mem_persist = ai_kernal.MEM_PERSIST_PERIODIC
+
+        # pending from an earlier turn
+
+        k.mem_set('user', 'name', 'alice')
+        k.prolog_persist()
+
+        def fail(ctx, inp_raw, run_trace, do_eliza):
+            k.mem_set(ctx.realm, 'action', 'foo')
+            raise Exception ('failed')
+
+        k.check_generations = lambda: None
+        k._process_input    = fail
+
+        with self.assertRaises(Exception):
+            k.process_input(FakeContext(), u'hello')
+
+        self.assertEqual (self._db(), [])
+
+        k.shutdown()
+
+        self.assertEqual (self._db(), [ ('realm', 'action', 'foo',   1.0),
+                                        ('user',  'name',   'alice', 1.0) ])
+
+    def test_flush_fails(self):
+
+        k = self.kernal
+
+        k.mem_set('user', 'name', 'alice')
+
+        def fail(*args, **kwargs):
+            raise Exception ('db gone')
+
+        k.session.execute = fail
+
+        with self.assertRaises(Exception):
+            k.mem_flush()
+
+        del k.session.execute
+
+        # not lost, written by the next flush
+
+        k.mem_flush()
+        self.assertEqual (self._db(), [ ('user', 'name', 'alice', 1.0) ])
+
+    def test_restore_batches(self):
+
+        k = self.kernal
+        k.mem_store.set_mirror()
+
+        ai_kernal.MEM_RESTORE_BATCH = 3
+
+        self._add_rows('user',  7)
+        self._add_rows('realm', 2)
+
+        mirrored = []
+        mem_mirror = k._mem_mirror
+        def count_mirror():
+            mirrored.append(sum([ len(ks) for ks in k.mem_store.mirror_dirty.values() ]))
+            mem_mirror()
+        k._mem_mirror = count_mirror
+
+        k._mem_restore()
+
+        self.assertEqual (len(k.mem_store.dump('user')),  7)
+        self.assertEqual (len(k.mem_store.dump('realm')), 2)
+        self.assertEqual (k.mem_store.get('user', 'k6').name, 'v')
+        self.assertTrue (k.mem_store.is_loaded('user') and k.mem_store.is_loaded('realm'))
+
+        # memory/4 gets mirrored after every batch, not all at once at the end
+
+        self.assertEqual (mirrored, [3, 3, 3, 0])
+        self.assertTrue (self.commands)
+        self.assertEqual (k.mem_store.mirror_dirty, {})
+
+        # restored entries are not written back
+
+        self.assertEqual (k.mem_store.dirty, set())
+
+    def test_restore_realm(self):
+
+        k = self.kernal
+        ai_kernal.MEM_RESTORE_BATCH = 3
+
+        self._add_rows('user',  7)
+        self._add_rows('realm', 2)
+
+        k._mem_restore('user')
+
+        self.assertEqual (len(k.mem_store.dump('user')),  7)
+        self.assertEqual (k.mem_store.dump('realm'), [])
+
+    def test_restore_corrupt(self):
+
+        k = self.kernal
+
+        self._add_rows('user', 2)
+        k.session.add(model.Mem(realm='user', k='broken', v=u'{not json', score=1.0))
+        k.session.commit()
+        self._add_rows('realm', 1)
+
+        recorder = LogRecorder()
+        logging.getLogger().addHandler(recorder)
+        try:
+            k._mem_restore()
+        finally:
+            logging.getLogger().removeHandler(recorder)
+
+        self.assertEqual (sorted([ e[0] for e in k.mem_store.dump('user') ]), ['k0', 'k1'])
+        self.assertEqual (len(k.mem_store.dump('realm')), 1)
+
+        self.assertEqual (len(recorder.records), 1)
+        self.assertTrue ('broken' in recorder.records[0].getMessage())
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+
+from zamiaai.mem_store import MemStore
+
+class TestMemStore (unittest.TestCase):
+
+    def setUp(self):
+        self.ms = MemStore()
+
+    def test_set_get(self):
+
+        self.ms.set('realm', 'action', 'foo')
+        self.assertEqual (self.ms.get('realm', 'action').name, 'foo')
+
+        self.ms.set('realm', 'action', None)
+        self.assertEqual (self.ms.get('realm', 'action'), None)
+        self.assertEqual (self.ms.get('other', 'action'), None)
+
+    def test_push_decay(self):
+
+        for v in ['a', 'b', 'c', 'd', 'e']:
+            self.ms.push('user', 'f1ent', v)
+
+        entries = self.ms.get_multi('user', 'f1ent')
+
+        # most recent first, score halves with every push
+        self.assertEqual ([v.name for v, score in entries], ['e', 'd', 'c', 'b', 'a'])
+        self.assertEqual ([score for v, score in entries], [1.0, 0.5, 0.25, 0.125, 0.0625])
+        self.assertEqual (self.ms.get('user', 'f1ent').name, 'e')
+
+    def test_clear_dirty(self):
+
+        self.ms.push('user', 'f1ent', 'a')
+        self.ms.set('realm', 'action', 'foo')
+
+        self.assertEqual (self.ms.dirty, set([('user', 'f1ent'), ('realm', 'action')]))
+
+        self.ms.clear('user')
+        self.ms.push('user', 'f1ent', 'b')
+
+        self.assertEqual (self.ms.pop_dirty(), set([('user', None), ('realm', 'action')]))
+        self.assertEqual (self.ms.dirty, set())
+        self.assertEqual (self.ms.dump('user')[0][0], 'f1ent')
+
+    def test_paging(self):
+
+        self.ms.set_mirror()
+
+        for realm in ['r1', 'r2', 'r3']:
+            self.ms.access(realm)
+            self.ms.push(realm, 'f1ent', 'a')
+
+        self.ms.access('r1')
+
+        self.assertEqual (self.ms.idle_realms(600.0, 3), [])
+        self.assertEqual (self.ms.idle_realms(600.0, 1), ['r2', 'r3'])
+        self.assertEqual (self.ms.idle_realms(-1.0, 3), ['r2', 'r3', 'r1'])
+
+        self.ms.evict('r2')
+        self.assertFalse (self.ms.is_loaded('r2'))
+        self.assertEqual (self.ms.get('r2', 'f1ent'), None)
+        self.assertEqual (self.ms.mirror_dirty['r2'], set([None]))
+
+    def test_paging_no_mirror(self):
+
+        # nothing to mirror: paging many realms in and out must not leave anything behind
+
+        for i in range(10000):
+            realm = 'r%d' % i
+            self.ms.access(realm)
+            self.ms.load(realm, 'name', 'alice', 1.0)
+            self.ms.set(realm, 'action', 'foo')
+            for realm in self.ms.idle_realms(600.0, 100):
+                self.ms.pop_dirty(set([realm]))
+                self.ms.evict(realm)
+
+        self.assertEqual (len(self.ms.loaded), 100)
+        self.assertEqual (len(self.ms.realms), 100)
+        self.assertEqual (self.ms.dirty, set([ ('r%d' % i, 'action') for i in range(9900, 10000) ]))
+        self.assertEqual (self.ms.mirror_dirty, {})
+
+    def test_set_mirror(self):
+
+        self.ms.load('r1', 'name', 'alice', 1.0)
+        self.ms.set('r2', 'action', 'foo')
+        self.assertEqual (self.ms.pop_mirror_dirty(), set())
+
+        # whatever is in memory already needs mirroring
+
+        self.ms.set_mirror()
+        self.ms.set('r2', 'name', 'bob')
+        self.ms.set('r3', 'name', 'bob')
+
+        self.assertEqual (self.ms.pop_mirror_dirty(), set([('r1', None), ('r2', None), ('r3', 'name')]))
+        self.assertEqual (self.ms.mirror_dirty, {})
+
+    def test_volatile(self):
+
+        self.ms.set_volatile('test')
+        self.ms.set_mirror()
+        snapshot = self.ms.snapshot(['test'])
+
+        self.ms.access('test')
+        self.ms.push('test', 'f1ent', 'a')
+        self.ms.set('realm', 'action', 'foo')
+
+        # never persisted, never evicted
+
+        self.assertEqual (self.ms.pop_dirty(), set([('realm', 'action')]))
+        self.assertEqual (self.ms.idle_realms(-1.0, 0), [])
+
+        self.ms.pop_mirror_dirty()
+        self.ms.restore(snapshot)
+
+        self.assertEqual (self.ms.get('test', 'f1ent'), None)
+        self.assertEqual (self.ms.pop_mirror_dirty(), set([('test', None)]))
+        self.assertEqual (self.ms.dirty, set())
+
+        # unchanged since the snapshot -> nothing to do
+
+        self.ms.restore(snapshot)
+        self.assertEqual (self.ms.mirror_dirty, {})
+
+    def test_max_entries(self):
+
+        for i in range(10):
+            self.ms.load('user', 'f1ent', 'e%d' % i, 1.0 / (i+1))
+
+        self.assertEqual (len(self.ms.get_multi('user', 'f1ent')), 5)
+        self.assertEqual (self.ms.get('user', 'f1ent'), 'e0')
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
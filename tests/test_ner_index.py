@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+import random
+
+from sqlalchemy.orm       import sessionmaker
+
+from zamiaai              import model
+from zamiaai              import ner_index
+from zamiaai.data_engine  import DataEngine
+from zamiaai.ner_index    import NERIndex
+
+HUMANS = [ ('wdeDouglasAdams', u'Douglas Adams'),
+           ('wdeDanBrown',     u'Dan Brown'),
+           ('wdeBryanAdams',   u'Bryan Adams') ]
+
+def _score_reference(nd, tokens, tstart, tend):
+
+    # straightforward scoring loops NERTable.score has to agree with
+
+    max_scores = {}
+
+    for tstart in range (tstart-1, tstart+2):
+        if tstart <0:
+            continue
+        for tend in range (tend-1, tend+2):
+            if tend > len(tokens):
+                continue
+
+            scores = {}
+            for tidx in range(tstart, tend):
+                toff = tidx-tstart
+                for entity, positions in nd.get(tokens[tidx], {}).items():
+                    scores[entity] = scores.get(entity, 0.0) + sum([ max(2.0-abs(eidx-toff), 0.0) for eidx in positions ])
+
+            for entity in scores:
+                max_scores[entity] = max(scores[entity], max_scores.get(entity, 0.0))
+
+    return max_scores
+
+class TestNERIndex (unittest.TestCase):
+
+    def setUp(self):
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+        self.dte     = DataEngine(self.session)
+
+    def _compile(self, skill_name, entries, persist=True):
+
+        self.dte.prepare_compilation(skill_name)
+        for entity, label in entries:
+            self.dte.ner('en', 'human', entity, label)
+        if persist:
+            self.dte.build_ner_index()
+        self.dte.publish()
+
+    def test_build(self):
+
+        nd = ner_index.build('en', HUMANS)
+
+        self.assertEqual (nd[u'adams'], {'wdeDouglasAdams': (1, ), 'wdeBryanAdams': (1, )})
+        self.assertEqual (ner_index.decode(ner_index.encode(nd)), nd)
+
+    def test_score(self):
+
+        random.seed(42)
+
+        vocab   = [ u'w%d' % i for i in range(20) ] + [ u'the' ] * 5
+        entries = [ ('E%d' % i, u' '.join([ random.choice(vocab) for j in range(random.randint(1, 5)) ])) for i in range(200) ]
+        nd      = ner_index.build('en', entries)
+        table   = ner_index.NERTable(nd)
+
+        self.assertEqual (table.to_dict(), nd)
+
+        for i in range(500):
+
+            tokens = [ random.choice(vocab + [ u'unknown' ]) for j in range(random.randint(0, 6)) ]
+            tstart = random.randint(0, len(tokens))
+            tend   = random.randint(tstart, len(tokens)+1)
+
+            res = table.score(tokens, tstart, tend)
+            self.assertEqual (dict(res), _score_reference(nd, tokens, tstart, tend))
+
+            # best first, ties in entity order
+            self.assertEqual (res, sorted(res, key=lambda r: (-r[1], r[0])))
+            self.assertEqual (table.score(tokens, tstart, tend, 5), res[:6])
+
+    def test_persisted(self):
+
+        # one skill with a persisted index, one compiled before it existed
+
+        self._compile('humans',   HUMANS[:2])
+        self._compile('humans2',  HUMANS[2:], persist=False)
+
+        self.assertEqual (self.session.query(model.NERIndexData).count(), 1)
+
+        idx = NERIndex(self.session)
+        self.assertEqual (idx.lookup('en', 'human').to_dict(), ner_index.build('en', HUMANS))
+        self.assertEqual (len(idx.lookup('de', 'human')), 0)
+
+    def test_refresh(self):
+
+        self._compile('humans', HUMANS)
+
+        idx = NERIndex(self.session)
+        self.assertTrue (u'brown' in idx.lookup('en', 'human'))
+
+        self._compile('humans', HUMANS[:1])
+
+        self.assertTrue (u'brown' in idx.lookup('en', 'human'))
+        idx.refresh()
+        self.assertFalse (u'brown' in idx.lookup('en', 'human'))
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import logging
+import tempfile
+import shutil
+
+from sqlalchemy.orm      import sessionmaker
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine
+from zamiaai.parallel_compile import compile_parallel, transitive_deps, _merge
+
+#
+# stand-ins for skill modules and the kernal, compile_skill does what
+# AIKernal.compile_skill does minus prolog and fingerprints
+#
+
+class FakeSkill(object):
+
+    def __init__(self, depends, get_data=None):
+        self.DEPENDS  = depends
+        self.get_data = get_data
+
+class FakeKernal(object):
+
+    def __init__(self, skills):
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+        self.dte     = DataEngine(self.session)
+        self.skills  = skills
+
+    def load_skill(self, skill_name):
+        return self.skills[skill_name]
+
+    def skill_up_to_date(self, skill_name):
+        return False
+
+    def compile_skill(self, skill_name):
+
+        self.dte.prepare_compilation(skill_name)
+        self.skills[skill_name].get_data(self)
+        self.dte.commit()
+        self.dte.publish()
+
+def get_data_base(k):
+    k.dte.macro('en', 'base_names', {'W': u'alice'})
+    k.dte.macro('en', 'base_names', {'W': u'bob'})
+    k.dte.dt('en', u'hello', u'hi')
+
+def get_data_top(k):
+    k.dte.dt('en', u'do you know {base_names:W}', u'yes')
+    k.dte.dt('en', u'hello', u'hi')
+
+def get_data_extra(k):
+    k.dte.macro('en', 'base_names', {'W': u'carol'})
+
+def get_data_crash(k):
+    os._exit(3)
+
+class TestParallelCompile (unittest.TestCase):
+
+    def test_transitive_deps(self):
+
+        kernal = FakeKernal({'a': FakeSkill(['b']),
+                             'b': FakeSkill(['c', 'd']),
+                             'c': FakeSkill(['d']),
+                             'd': FakeSkill([]) })
+
+        self.assertEqual (transitive_deps(kernal, 'a'), set(['b', 'c', 'd']))
+        self.assertEqual (transitive_deps(kernal, 'c'), set(['d']))
+        self.assertEqual (transitive_deps(kernal, 'd'), set())
+
+    def test_merge(self):
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            staging_url = 'sqlite:///%s/staging.db' % tmpdir
+
+            engine  = model.data_engine_setup(staging_url, echo=False)
+            staging = sessionmaker(bind=engine)()
+            dte     = DataEngine(staging)
+
+            dte.prepare_compilation('base')
+            dte.macro('en', 'base_names', {'W': u'alice'})
+            dte.dt('en', u'hello', u'hi')
+            dte.ts('en', 't0000', [(u'hello', u'hi')])
+            dte.commit()
+            staging.merge(model.SkillFingerprint(skill='base', src_hash='s', macros='[]', macro_hash='m'))
+            dte.publish()
+            staging.close()
+            engine.dispose()
+
+            kernal = FakeKernal({})
+
+            # code already known to the main db is not copied again
+
+            kernal.dte.prepare_compilation('other')
+            kernal.dte.dt('en', u'hi there', u'hi')
+            kernal.dte.publish()
+
+            _merge(kernal, 'base', staging_url)
+
+            self.assertEqual (len(kernal.dte.lookup_data_train(u'hello', 'en')), 1)
+            self.assertEqual (len(kernal.dte.lookup_tests('base')), 1)
+            self.assertEqual (kernal.session.query(model.Code).count(), 1)
+            self.assertEqual (kernal.session.query(model.NamedMacro).filter(model.NamedMacro.skill=='base').count(), 1)
+
+            fp = kernal.session.query(model.SkillFingerprint).filter(model.SkillFingerprint.skill=='base').first()
+            self.assertEqual ((fp.src_hash, fp.macro_hash), ('s', 'm'))
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_compile_parallel(self):
+
+        kernal = FakeKernal({'base': FakeSkill([],       get_data_base),
+                             'top' : FakeSkill(['base'], get_data_top) })
+
+        compile_parallel(kernal, ['top', 'base'], 2)
+
+        # top's staging db got seeded with base's macros
+
+        self.assertEqual (len(kernal.dte.lookup_data_train(u'do you know bob', 'en')), 1)
+        self.assertEqual (len(kernal.dte.lookup_data_train(u'hello', 'en')), 2)
+
+        # recompiling replaces the published generations
+
+        compile_parallel(kernal, ['top', 'base'], 2)
+
+        self.assertEqual (len(kernal.dte.lookup_data_train(u'do you know alice', 'en')), 1)
+        self.assertEqual (len(kernal.dte.lookup_data_train(u'hello', 'en')), 2)
+
+    def test_same_as_serial(self):
+
+        # named macros resolve across all published skills, not just DEPENDS
+
+        skills = {'extra': FakeSkill([],       get_data_extra),
+                  'base' : FakeSkill([],       get_data_base),
+                  'top'  : FakeSkill(['base'], get_data_top) }
+
+        serial = FakeKernal(skills)
+        for skill_name in ['extra', 'base', 'top']:
+            serial.compile_skill(skill_name)
+
+        parallel = FakeKernal(skills)
+        parallel.compile_skill('extra')
+        compile_parallel(parallel, ['top', 'base'], 2)
+
+        def rows(kernal):
+            q = model.live(kernal.session.query(model.TrainingData), model.TrainingData)
+            return sorted([ (td.skill, td.lang, td.inp, td.md5s, td.args, td.loc_fn, td.loc_line) for td in q ])
+
+        self.assertEqual (len(parallel.dte.lookup_data_train(u'do you know carol', 'en')), 1)
+        self.assertEqual (rows(parallel), rows(serial))
+
+    def test_dead_worker(self):
+
+        kernal = FakeKernal({'base' : FakeSkill([], get_data_base),
+                             'crash': FakeSkill([], get_data_crash) })
+
+        with self.assertRaisesRegexp(Exception, 'worker process died'):
+            compile_parallel(kernal, ['base', 'crash'], 2)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
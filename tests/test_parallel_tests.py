@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import unittest
+import logging
+
+from sqlalchemy.orm         import sessionmaker
+
+from zamiaai                import model
+from zamiaai.data_engine    import DataEngine
+from zamiaai.skill_tests    import SkillTestResult
+from zamiaai.parallel_tests import run_tests_parallel
+
+#
+# stand-in for the kernal, just what the workers touch
+#
+
+class FakeComponent(object):
+
+    def set_session(self, session):
+        self.session = session
+
+class FakeKernal(object):
+
+    def __init__(self):
+
+        self.engine     = model.data_engine_setup('sqlite://', echo=False)
+        self.Session    = sessionmaker(bind=self.engine)
+        self.session    = self.Session()
+        self.dte        = DataEngine(self.session)
+        self.code_cache = FakeComponent()
+        self.ner_index  = FakeComponent()
+
+    def run_test(self, skill_name, tc):
+
+        t_name, lang, prep_code, prep_fn, rounds, loc_fn, loc_line = tc
+
+        if t_name == 'crash':
+            os._exit(3)
+        if t_name == 'hang':
+            time.sleep(60)
+        if t_name == 'fail':
+            raise Exception ('test failed')
+
+        return SkillTestResult(skill_name, t_name, lang, loc_fn, loc_line, 0.0, None, len(rounds))
+
+def _tc(name):
+    return (name, 'en', None, None, [(u'hello', u'hi')], '/skills/test/__init__.py', 42)
+
+class TestParallelTests (unittest.TestCase):
+
+    def test_results(self):
+
+        tests = [ ('test', _tc('t%04d' % i)) for i in range(10) ] + [ ('test', _tc('fail')) ]
+
+        results = run_tests_parallel(FakeKernal(), tests, 3)
+
+        self.assertEqual ([ r.name for r in results ], [ tc[0] for skill_name, tc in tests ])
+        self.assertEqual ([ r.failure for r in results[:10] ], [ None ] * 10)
+        self.assertTrue ('test failed' in results[10].failure)
+
+    def test_crash(self):
+
+        tests = [ ('test', _tc('t0000')), ('test', _tc('crash')), ('test', _tc('t0001')) ]
+
+        results = run_tests_parallel(FakeKernal(), tests, 2)
+
+        self.assertEqual ([ r.name for r in results ], ['t0000', 'crash', 't0001'])
+        self.assertEqual (results[1].failure, 'worker process died (exit code 3)')
+        self.assertEqual (results[2].failure, None)
+
+    def test_timeout(self):
+
+        tests = [ ('test', _tc('hang')), ('test', _tc('t0000')) ]
+
+        results = run_tests_parallel(FakeKernal(), tests, 2, timeout=2.0)
+
+        self.assertTrue (results[0].failure.startswith('timed out'))
+        self.assertEqual (results[1].failure, None)
+
+    def test_timeout_kills_worker(self):
+
+        # with a single worker, the hanging test must not block the ones after it
+
+        tests = [ ('test', _tc('hang')), ('test', _tc('t0000')), ('test', _tc('hang')), ('test', _tc('t0001')) ]
+
+        start_time = time.time()
+        results = run_tests_parallel(FakeKernal(), tests, 1, timeout=2.0)
+
+        self.assertTrue (results[0].failure.startswith('timed out'))
+        self.assertEqual (results[1].failure, None)
+        self.assertTrue (results[2].failure.startswith('timed out'))
+        self.assertEqual (results[3].failure, None)
+        self.assertTrue (time.time() - start_time < 30.0)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
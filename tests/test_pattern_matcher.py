@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+
+from sqlalchemy.orm          import sessionmaker
+
+from zamiaai                 import model
+from zamiaai.data_engine     import DataEngine
+from zamiaai.pattern_matcher import PatternMatcher
+
+PATTERNS = [ (u'lights {rooms:PL} {rooms:LABEL} (please|)', ['rooms_0_start', 'rooms_1_end', 'rooms_1_label', 'off']),
+             (u'(switch|turn) (on|off) the light {rooms:PL} {rooms:LABEL}', ['rooms_1_start', 'rooms_1_end']),
+             (u'hello (computer|)', None) ]
+
+def _compile(pattern_mode):
+
+    engine  = model.data_engine_setup('sqlite://', echo=False)
+    session = sessionmaker(bind=engine)()
+    dte     = DataEngine(session)
+
+    dte.prepare_compilation('test')
+    dte.set_pattern_mode(pattern_mode)
+
+    dte.macro('en', 'rooms', {'LABEL': u'living room', 'PL': u'in the'})
+    dte.macro('en', 'rooms', {'LABEL': u'kitchen',     'PL': u'in the'})
+
+    for pattern, args in PATTERNS:
+        dte.dt('en', pattern, u'ok', args)
+
+    dte.ner('en', 'human', 'wdeDouglasAdams', u'Douglas Adams')
+    dte.ner('en', 'human', 'wdeDanBrown',     u'Dan Brown')
+    dte.macro('en', 'known_humans', {'W': u'Douglas Adams'})
+    dte.ner_macro('en', 'known_humans', 'human')
+    dte.dt('en', u'(who is|) {known_humans:W}', u'ok', ['known_humans_0_start', 'known_humans_0_end'])
+
+    dte.publish()
+
+    return session, dte
+
+class TestPatternMatcher (unittest.TestCase):
+
+    def setUp(self):
+
+        self.td_session, self.td_dte = _compile(False)
+        self.pd_session, self.pd_dte = _compile(True)
+
+        self.matcher = PatternMatcher(self.pd_session)
+
+    def _result_set(self, res):
+        return sorted([ (md5s, repr(args)) for lang, inp, md5s, args, loc_fn, loc_line in res ])
+
+    def test_pattern_mode(self):
+
+        self.assertEqual (self.pd_session.query(model.TrainingData).count(), 0)
+        self.assertEqual (self.pd_session.query(model.PatternData).count(), 4)
+
+    def test_same_as_expanded(self):
+
+        # every expanded training data row is matched, with the same args
+
+        inps = set([ td.inp for td in self.td_session.query(model.TrainingData) ])
+
+        for inp in inps:
+            self.assertEqual (self._result_set(self.matcher.lookup('en', inp)),
+                              self._result_set(self.td_dte.lookup_data_train(inp, 'en')))
+
+        self.assertEqual (self.matcher.lookup('en', u'lights in the garage'), [])
+        self.assertEqual (self.matcher.lookup('en', u'lights in the kitchen kitchen'), [])
+        self.assertEqual (self.matcher.lookup('de', u'hello'), [])
+
+    def test_ner_macro(self):
+
+        # expanded: named macro only, matcher: every entity of the NER class
+
+        self.assertEqual (self.td_dte.lookup_data_train(u'who is dan brown', 'en'), [])
+
+        res = self.matcher.lookup('en', u'who is dan brown')
+        self.assertEqual (len(res), 1)
+        self.assertEqual (res[0][3], [2, 4])
+
+    def test_ner_macro_scope(self):
+
+        # the NER macro declared by skill 'test' does not apply to other skills' patterns
+
+        self.pd_dte.prepare_compilation('other')
+        self.pd_dte.set_pattern_mode(True)
+        self.pd_dte.dt('en', u'tell me about {known_humans:W}', u'ok', ['known_humans_0_start'])
+        self.pd_dte.publish()
+
+        self.matcher.refresh()
+
+        self.assertEqual (len(self.matcher.lookup('en', u'tell me about douglas adams')), 1)
+        self.assertEqual (self.matcher.lookup('en', u'tell me about dan brown'), [])
+        self.assertEqual (len(self.matcher.lookup('en', u'who is dan brown')), 1)
+
+    def test_bad_pattern(self):
+
+        # a broken stored pattern is skipped, the others still match
+
+        generation = model.published_generations(self.pd_session)['test']
+        self.pd_session.add(model.PatternData(lang='en', skill='test', pattern=u'hello {no_such_macro:W}', md5s='0' * 32,
+                                              args='null', loc_fn='test.py', loc_line=1, generation=generation))
+        self.pd_session.commit()
+
+        self.matcher.refresh()
+
+        self.assertEqual (len(self.matcher.lookup('en', u'hello computer')), 1)
+
+    def test_refresh(self):
+
+        self.pd_dte.prepare_compilation('test')
+        self.pd_dte.publish()
+
+        self.assertEqual (len(self.matcher.lookup('en', u'hello computer')), 1)
+        self.matcher.refresh()
+        self.assertEqual (self.matcher.lookup('en', u'hello computer'), [])
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
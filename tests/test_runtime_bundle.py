@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import logging
+import tempfile
+import shutil
+import json
+
+from sqlalchemy.orm         import sessionmaker
+
+from zamiaai                import model
+from zamiaai.runtime_bundle import RuntimeBundle, write_bundle
+from zamiaai.ai_kernal      import AIKernal
+from zamiaai.data_engine    import DataEngine
+from zamiaai.ner_index      import NERIndex
+
+class TestRuntimeBundle (unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmpdir   = tempfile.mkdtemp()
+        self.bundlefn = os.path.join(self.tmpdir, 'test.bundle')
+
+        engine       = model.data_engine_setup('sqlite://', echo=False)
+        self.session = sessionmaker(bind=engine)()
+
+        for i in range(3):
+            self.session.add(model.Code(md5s='%032x' % i, skill='test', fn='_resp', code=u'def _resp(c):\n    pass # %d\n' % i))
+
+        for i in range(100):
+            self.session.add(model.TrainingData(lang='en', skill='test', inp=u'hello %d' % i, md5s='%032x' % (i % 3),
+                                                args=json.dumps([i]), loc_fn='test.py', loc_line=i, generation=1))
+        self.session.add(model.TrainingData(lang='de', skill='test', inp=u'hallo übermorgen', md5s='%032x' % 1,
+                                            args=json.dumps(None), loc_fn='test.py', loc_line=200, generation=1))
+
+        self.session.add(model.NERData(lang='en', skill='test', cls='human', entity='wdeAngelaMerkel', label=u'angela merkel', generation=1))
+
+        # unpublished generation, must not end up in the bundle
+        self.session.add(model.TrainingData(lang='en', skill='test', inp=u'hello', md5s='%032x' % 0,
+                                            args=json.dumps(None), loc_fn='test.py', loc_line=300, generation=2))
+
+        self.session.add(model.SkillGeneration(skill='test', generation=1))
+        self.session.commit()
+
+        write_bundle(self.session, self.bundlefn)
+        self.bundle = RuntimeBundle(self.bundlefn)
+
+    def tearDown(self):
+        self.bundle.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup(self):
+
+        res = self.bundle.lookup('en', u'hello 42')
+        self.assertEqual (res, [('en', u'hello 42', '%032x' % 0, [42], 'test.py', 42)])
+
+        res = self.bundle.lookup('de', u'hallo übermorgen')
+        self.assertEqual (res, [('de', u'hallo übermorgen', '%032x' % 1, None, 'test.py', 200)])
+
+        self.assertEqual (self.bundle.lookup('de', u'hello 42'), [])
+        self.assertEqual (self.bundle.lookup('en', u'hello'), [])
+
+    def test_lookup_code(self):
+
+        self.assertEqual (self.bundle.lookup_code('%032x' % 2), ('_resp', u'def _resp(c):\n    pass # 2\n'))
+        self.assertEqual (self.bundle.lookup_code('f' * 32), None)
+
+    def test_lookup_ner(self):
+
+        self.assertEqual (self.bundle.lookup_ner('en', 'human'), [('wdeAngelaMerkel', u'angela merkel')])
+        self.assertEqual (self.bundle.lookup_ner('de', 'human'), [])
+
+    def test_refresh(self):
+
+        # serving kernal, no constructor needed
+
+        kernal = AIKernal.__new__(AIKernal)
+        kernal.session   = self.session
+        kernal.dte       = DataEngine(self.session)
+        kernal.dte.set_index(self.bundle)
+        kernal.ner_index = NERIndex(self.session, bundle=self.bundle)
+
+        self.assertFalse (self.bundle.changed())
+
+        kernal.refresh_index()
+        self.assertTrue (kernal.dte.index is self.bundle)
+
+        # re-compiled, new bundle written
+
+        self.session.add(model.TrainingData(lang='en', skill='test', inp=u'hello new', md5s='%032x' % 2,
+                                            args=json.dumps(None), loc_fn='test.py', loc_line=400, generation=1))
+        self.session.add(model.NERData(lang='en', skill='test', cls='human', entity=u'wdeAlanTuring', label=u'alan turing', generation=1))
+        self.session.commit()
+        write_bundle(self.session, self.bundlefn)
+
+        self.assertTrue (self.bundle.changed())
+
+        kernal.refresh_index()
+        self.bundle = kernal.dte.index
+
+        self.assertFalse (self.bundle.changed())
+        self.assertEqual (len(kernal.dte.lookup_data_train(u'hello new', 'en')), 1)
+        self.assertTrue (kernal.ner_index.bundle is self.bundle)
+        self.assertTrue (u'turing' in kernal.ner_index.lookup('en', 'human'))
+
+    def test_pattern_mode(self):
+
+        # pattern mode skills have no expanded rows, bundling them is refused
+
+        self.session.add(model.PatternData(lang='en', skill='pm', pattern=u'hello (a|b)', md5s='%032x' % 0,
+                                           args=json.dumps(None), loc_fn='pm.py', loc_line=1, generation=3))
+        self.session.add(model.SkillGeneration(skill='pm', generation=3))
+        self.session.commit()
+
+        self.assertEqual (model.pattern_mode_skills(self.session), ['pm'])
+
+        with self.assertRaises(Exception):
+            write_bundle(self.session, self.bundlefn)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
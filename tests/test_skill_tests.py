@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import logging
+import tempfile
+import shutil
+
+from xml.etree           import ElementTree
+
+from zamiaai             import skill_tests
+from zamiaai.skill_tests import SkillTestResult
+
+RESULTS = [ SkillTestResult('weather', 't0000_rain', 'en', '/skills/weather/__init__.py', 42, 0.5,  None, 2),
+            SkillTestResult('weather', 't0001_sun',  'de', '/skills/weather/__init__.py', 50, 1.25,
+                            u'no matching response found for "wie wird das wetter" (expected: "sonnig")', 1),
+            SkillTestResult('humans',  't0000_who',  'en', '/skills/humans/__init__.py',  10, 0.25, None, 1) ]
+
+class TestSkillTests (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_junit_xml(self):
+
+        fn = os.path.join(self.tmpdir, 'report.xml')
+        skill_tests.write_junit_xml(RESULTS, fn)
+
+        root = ElementTree.parse(fn).getroot()
+
+        self.assertEqual (root.get('tests'), '3')
+        self.assertEqual (root.get('failures'), '1')
+        self.assertEqual ([ s.get('name') for s in root ], ['humans', 'weather'])
+
+        tcs = root.findall('testsuite/testcase')
+        self.assertEqual ([ tc.get('time') for tc in tcs ], ['0.250', '0.500', '1.250'])
+
+        failures = root.findall('testsuite/testcase/failure')
+        self.assertEqual (len(failures), 1)
+        self.assertTrue (failures[0].text.startswith(u'/skills/weather/__init__.py:50: round 1:'))
+
+    def test_report(self):
+
+        self.assertEqual (skill_tests.count_fails(RESULTS), 1)
+        skill_tests.log_report(RESULTS, slowest=2)
+        skill_tests.log_report([])
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import logging
+
+from zamiaai             import ai_kernal
+from zamiaai             import latency
+from zamiaai.ai_kernal   import AIKernal
+from zamiaai.ai_context  import TurnCache
+from zamiaai.mem_store   import MemStore
+
+class FakeContext(object):
+
+    def __init__(self):
+        self.user  = 'user'
+        self.realm = 'realm'
+
+class TestTurnCache (unittest.TestCase):
+
+    def setUp(self):
+
+        # prolog is replaced by a stub that counts queries, no constructor needed
+
+        self.kernal = AIKernal.__new__(AIKernal)
+        self.kernal.turn       = None
+        self.kernal.turn_cache = TurnCache()
+        self.kernal.mem_store  = MemStore()
+        self.kernal.mem_store.set_mirror()
+        self.kernal.kb_writers = set(ai_kernal.KB_WRITE_PREDS)
+        self.kernal.pl_rules   = []
+
+        self.queries  = []
+        self.commands = []
+
+        self.pyxsb_query   = ai_kernal.pyxsb_query
+        self.pyxsb_command = ai_kernal.pyxsb_command
+        ai_kernal.pyxsb_query   = self._query
+        ai_kernal.pyxsb_command = self.commands.append
+
+    def tearDown(self):
+        ai_kernal.pyxsb_query   = self.pyxsb_query
+        ai_kernal.pyxsb_command = self.pyxsb_command
+
+    def _query(self, query):
+        self.queries.append(query)
+        return [ [ len(self.queries) ] ]
+
+    def test_cached(self):
+
+        res = self.kernal._pyxsb_query('foo(X).')
+        self.assertEqual (self.kernal._pyxsb_query('foo(X).'), res)
+        self.assertEqual (self.queries, ['foo(X).'])
+
+        # callers get their own copy
+
+        res.append('bar')
+        self.assertEqual (self.kernal._pyxsb_query('foo(X).'), [ [ 1 ] ])
+
+        self.kernal._pyxsb_query('bar(X).')
+        self.assertEqual (len(self.queries), 2)
+
+    def test_memory_change(self):
+
+        self.kernal._pyxsb_query('memory(realm, action, X, S).')
+
+        self.kernal.mem_store.set('realm', 'action', 'foo')
+
+        self.assertEqual (self.kernal._pyxsb_query('memory(realm, action, X, S).'), [ [ 2 ] ])
+        self.assertEqual (len(self.queries), 2)
+        self.assertEqual (len(self.commands), 1) # memory/4 mirrored before the query
+
+        self.kernal._pyxsb_query('memory(realm, action, X, S).')
+        self.assertEqual (len(self.queries), 2)
+
+    def test_prolog_time(self):
+
+        # memory/4 mirroring counts as prolog time of the turn
+
+        self.kernal.turn = latency.TurnRecord(u'user', u'realm', u'hello')
+
+        self.kernal.mem_store.set('realm', 'action', 'foo')
+        self.kernal._pyxsb_query('memory(realm, action, X, S).')
+
+        self.assertEqual (len(self.commands), 1)
+        self.assertEqual (self.kernal.turn.prolog_commands, 1)
+        self.assertEqual (self.kernal.turn.prolog_queries, 1)
+
+    def test_side_effects(self):
+
+        for i in range(2):
+            self.kernal._pyxsb_query('assertz(foo(1)).')
+            self.kernal._pyxsb_query('retract(foo(1)).')
+
+        self.assertEqual (len(self.queries), 4)
+        self.assertEqual (self.kernal.turn_cache.kb, {})
+
+    def test_kb_change(self):
+
+        # query -> assert -> same query must see the new KB
+
+        self.assertEqual (self.kernal.prolog_query('foo(X).'), [ [ 1 ] ])
+        self.kernal.prolog_query('assertz(foo(2)).')
+        self.assertEqual (self.kernal.prolog_query('foo(X).'), [ [ 3 ] ])
+        self.assertEqual (len(self.queries), 3)
+
+        # side effects may hide in the rules of consulted prolog sources
+
+        self.kernal._pl_add_rules(u"""
+            % add_foo/1 asserts through store_foo/1
+            add_foo(X) :- X > 0, store_foo(X).
+            store_foo(X) :-
+                assertz(foo(X)).
+            foo_count(N) :- findall(X, foo(X), L), length(L, N).
+            add_foo_2(X):-add_foo(X).
+            /* not a rule: assertz(foo_count(1)) :- */
+            bar(1.5).
+        """)
+
+        self.assertEqual (self.kernal.kb_writers - ai_kernal.KB_WRITE_PREDS, set(['add_foo', 'store_foo', 'add_foo_2']))
+
+        self.kernal.prolog_check('foo_count(N).')
+        self.kernal.prolog_check('foo_count(N).')
+        self.assertEqual (len(self.queries), 4)
+
+        self.kernal.prolog_check('add_foo(3).')
+        self.kernal.prolog_check('add_foo(3).')
+        self.assertEqual (self.kernal.prolog_query_one('foo(X).'), 7)
+        self.assertEqual (len(self.queries), 7)
+
+    def test_reset(self):
+
+        self.kernal._pyxsb_query('foo(X).')
+        self.kernal.turn_cache.reset()
+        self.kernal._pyxsb_query('foo(X).')
+
+        self.assertEqual (len(self.queries), 2)
+
+        # outside of a turn, nothing is cached
+
+        self.kernal.turn_cache = None
+        self.kernal._pyxsb_query('foo(X).')
+
+        self.assertEqual (len(self.queries), 3)
+
+    def test_process_input_error(self):
+
+        def fail(ctx, inp_raw, run_trace, do_eliza):
+            raise Exception ('failed')
+
+        self.kernal.check_generations = lambda: None
+        self.kernal._process_input    = fail
+
+        with self.assertRaises(Exception):
+            self.kernal.process_input(FakeContext(), u'hello')
+
+        self.assertEqual (self.kernal.turn, None)
+        self.assertEqual (self.kernal.turn_cache, None)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    unittest.main()
+
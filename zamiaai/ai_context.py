@@ -33,12 +33,23 @@ import numpy as np
 
 from tzlocal                import get_localzone # $ pip install tzlocal
 
-from nltools                import misc
 from nltools.tokenizer      import tokenize
 from zamiaai                import model
 
 MAX_NER_RESULTS    = 5
 
+class TurnCache(object):
+
+    """ analysis results that stay valid while the context's input does not change """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tokens = {} # lang -> tokens of the input
+        self.ner    = {} # (lang, cls, tstart, tend) -> ner() result
+        self.kb     = {} # prolog query -> solutions (maintained by the kernal, see AIKernal._pyxsb_query)
+
 class AIContext(object):
 
     def __init__(self, user, session, lang, realm, kernal, test_mode = False):
@@ -48,17 +59,31 @@ class AIContext(object):
         self.inp          = u''
         self.user         = user
         self.realm        = realm
-        self.ner_dict     = {} # DB cache
         self.session      = session
         self.lang         = lang
         self.kernal       = kernal
         self.test_mode    = test_mode
+        self.turn_cache   = TurnCache()
 
         tz = get_localzone()
         self.current_dt   = tz.localize(datetime.datetime.now())
 
     def set_inp(self, inp):
         self.inp = inp
+        self.turn_cache.reset()
+
+    def tokens(self, lang=None):
+
+        """ tokenized input, tokenized once per turn """
+
+        if lang is None:
+            lang = self.lang
+
+        tokens = self.turn_cache.tokens.get(lang)
+        if tokens is None:
+            tokens = tokenize(self.inp, lang=lang)
+            self.turn_cache.tokens[lang] = tokens
+        return tokens
 
     def resp(self, resp, score=0.0, action=None, action_arg=None):
         if score < self.high_score:
@@ -89,120 +114,21 @@ class AIContext(object):
         self.staged_resps = []
         self.high_score = 0.0
 
-        self.kernal.prolog_persist()
-       
-    def _ner_learn(self, lang, cls):
-
-        entities = []
-        labels   = []
-
-        for nerdata in self.session.query(model.NERData).filter(model.NERData.lang==lang).filter(model.NERData.cls==cls):
-            entities.append(nerdata.entity)
-            labels.append(nerdata.label)
-
-        if not lang in self.ner_dict:
-            self.ner_dict[lang] = {}
-
-        if not cls in self.ner_dict[lang]:
-            self.ner_dict[lang][cls] = {}
-
-        nd = self.ner_dict[lang][cls]
-
-        for i, entity in enumerate(entities):
-
-            label = labels[i]
-
-            for j, token in enumerate(tokenize(label, lang=lang)):
-
-                if not token in nd:
-                    nd[token] = {}
-
-                if not entity in nd[token]:
-                    nd[token][entity] = set([])
-
-                nd[token][entity].add(j)
-
-                # logging.debug ('ner_learn: %4d %s %s: %s -> %s %s' % (i, entity, label, token, cls, lang))
+        # test memory is never persisted
 
-        cnt = 0
-        for token in nd:
-            # import pdb; pdb.set_trace()
-            # s1 = repr(nd[token])
-            # s2 = limit_str(s1, 10)
-            logging.debug ('ner_learn: nd[%-20s]=%s' % (token, misc.limit_str(repr(nd[token]), 80)))
-            cnt += 1
-            if cnt > 10:
-                break
- 
+        if not self.test_mode:
+            self.kernal.prolog_persist()
+       
     def ner(self, lang, cls, tstart, tend):
 
-        if not lang in self.ner_dict:
-            self.ner_dict[lang] = {}
-        if not cls in self.ner_dict[lang]:
-            self._ner_learn(lang, cls)
-
-        nd     = self.ner_dict[lang][cls]
-        tokens = tokenize(self.inp, lang=lang)
-
-        #
-        # start scoring
-        #
-
-        max_scores = {}
-
-        for tstart in range (tstart-1, tstart+2):
-            if tstart <0:
-                continue
-
-            for tend in range (tend-1, tend+2):
-                if tend > len(tokens):
-                    continue
-
-                scores = {}
-
-                for tidx in range(tstart, tend):
-
-                    toff = tidx-tstart
-
-                    # logging.debug('tidx: %d, toff: %d [%d - %d]' % (tidx, toff, tstart, tend))
-
-                    token = tokens[tidx]
-                    if not token in nd:
-                        # logging.debug('token %s not in nd %s %s' % (repr(token), repr(lang), repr(cls)))
-                        continue
-
-                    for entity in nd[token]:
-
-                        if not entity in scores:
-                            scores[entity] = 0.0
-
-                        for eidx in nd[token][entity]:
-                            points = 2.0-abs(eidx-toff)
-                            if points>0:
-                                scores[entity] += points
-
-                logging.debug('scores: %s' % repr(scores))
-
-                for entity in scores:
-                    if not entity in max_scores:
-                        max_scores[entity] = scores[entity]
-                        continue
-                    if scores[entity]>max_scores[entity]:
-                        max_scores[entity] = scores[entity]
-
-        res = []
-        cnt = 0
-
-        # for entity in max_scores:
-
-        for entity, max_score in sorted(max_scores.iteritems(), key=lambda x: x[1], reverse=True):
-
-            res.append((entity, max_score))
+        """ entities of NER class cls best matching input tokens tstart..tend: [(entity, score), ...] """
 
-            cnt += 1
-            if cnt > MAX_NER_RESULTS:
-                break
+        key = (lang, cls, tstart, tend)
+        res = self.turn_cache.ner.get(key)
+        if res is None:
+            res = self.kernal.ner_index.lookup(lang, cls).score(self.tokens(lang), tstart, tend, MAX_NER_RESULTS)
+            self.turn_cache.ner[key] = res
 
-        return res
+        return list(res)
 
 
@@ -35,6 +35,9 @@ import codecs
 import datetime
 import pytz
 import json
+import re
+import atexit
+import hashlib
 import ConfigParser
 
 import numpy as np
@@ -51,7 +54,20 @@ from pyxsb                  import pyxsb_start_session, pyxsb_command, pyxsb_que
 from nltools                import misc
 from nltools.tokenizer      import tokenize
 from zamiaai.data_engine    import DataEngine
+from zamiaai.bulk_writer    import DEFAULT_BULK_BATCH_SIZE
 from zamiaai.ai_context     import AIContext
+from zamiaai.code_cache     import CodeCache, DEFAULT_CODE_CACHE_SIZE
+from zamiaai.exact_index    import ExactMatchIndex
+from zamiaai.runtime_bundle import RuntimeBundle, write_bundle
+from zamiaai.mem_store      import MemStore
+from zamiaai.parallel_compile import compile_parallel, transitive_deps
+from zamiaai.parallel_tests import run_tests_parallel
+from zamiaai.skill_tests    import SkillTestResult
+from zamiaai.pattern_matcher import PatternMatcher
+from zamiaai.ner_index      import NERIndex
+from zamiaai                import latency
+from zamiaai                import compact_schema
+from zamiaai                import skill_tests
 from zamiaai                import model
 
 USER_PREFIX                 = u'user'
@@ -59,7 +75,10 @@ DEFAULT_USER                = USER_PREFIX + u'Default'
 TEST_USER                   = USER_PREFIX + u'Test'
 TEST_TIME                   = datetime.datetime(2016,12,6,13,28,6,tzinfo=get_localzone()).isoformat()
 TEST_REALM                  = '__test__'
+TEST_REALMS                 = [TEST_REALM, TEST_USER]
 MAX_MEM_ENTRIES             = 5
+MEM_RESTORE_BATCH           = 1000 # rows fetched / facts asserted per batch when restoring memory
+
 LANGUAGES                   = ['en', 'de']
 
 DEFAULT_LANG                = 'en'
@@ -70,12 +89,60 @@ DEFAULT_SKILL_PATHS         = None
 DEFAULT_REALM               = '__realm__'
 DEFAULT_NUM_EPOCHS          = 100
 DEFAULT_NUM_EPOCHS_UTTCLASS = 10
-
-DEFAULTS             = {'db_url'      : DEFAULT_DB_URL,
-                        'xsb_arch_dir': DEFAULT_XSB_ARCH_DIR,
-                        'toplevel'    : DEFAULT_TOPLEVEL,
-                        'skill_paths' : DEFAULT_SKILL_PATHS,
-                        'lang'        : DEFAULT_LANG }
+DEFAULT_EXACT_INDEX         = False
+DEFAULT_BUNDLE              = None # no runtime bundle unless configured
+DEFAULT_SERVE_BUNDLE        = False
+DEFAULT_DT_MAX_EXPANSIONS   = 0 # cap on training samples generated per dt() call, 0: no cap
+DEFAULT_PATTERN_MODE        = False # store dt() patterns for the pattern matcher instead of expanding them
+DEFAULT_GENERATION_CHECK    = 1.0   # seconds between checks for newly published skill generations
+DEFAULT_GENERATION_GC_AGE   = 60.0  # seconds superseded generations are kept for serving processes
+DEFAULT_COMPACT_SCHEMA      = False # write training data into the compact schema
+DEFAULT_SQLITE_PRAGMAS      = model.DEFAULT_SQLITE_PRAGMAS
+
+MEMORY_PRED_RE              = re.compile(r'\bmemory\s*\(')
+
+# prolog builtins that change the KB. Queries that call them, directly or through rules
+# of consulted prolog sources, are not answered from the turn cache
+KB_WRITE_PREDS              = set(['assert', 'asserta', 'assertz', 'retract', 'retractall', 'abolish',
+                                   'erase', 'recorda', 'recordz', 'consult', 'reconsult', 'load_dyn'])
+PL_IDENT_RE                 = re.compile(r'\b[a-z]\w*')
+PL_COMMENT_RE               = re.compile(r'%[^\n]*|/\*.*?\*/', re.DOTALL)
+PL_CLAUSE_END_RE            = re.compile(r'\.(?=\s|$)')
+
+MEM_PERSIST_TURN            = 'turn'     # flush dirty memory after each turn
+MEM_PERSIST_PERIODIC        = 'periodic' # flush every mem_flush_interval seconds or mem_flush_batch keys (checked at the end of turns and in idle())
+MEM_PERSIST_SHUTDOWN        = 'shutdown' # flush on shutdown only
+DEFAULT_MEM_PERSIST         = MEM_PERSIST_TURN
+DEFAULT_MEM_FLUSH_INTERVAL  = 10.0 # seconds
+DEFAULT_MEM_FLUSH_BATCH     = 1000 # keys
+DEFAULT_MEM_PAGING          = True # load realms on demand instead of all at startup
+DEFAULT_MEM_IDLE_TTL        = 600.0 # seconds before an idle realm gets evicted
+DEFAULT_MEM_MAX_REALMS      = 10000 # max number of realms kept in memory
+DEFAULT_LATENCY_LOG         = None  # JSON lines file to append per-turn latency records to
+
+DEFAULTS             = {'db_url'             : DEFAULT_DB_URL,
+                        'xsb_arch_dir'       : DEFAULT_XSB_ARCH_DIR,
+                        'toplevel'           : DEFAULT_TOPLEVEL,
+                        'skill_paths'        : DEFAULT_SKILL_PATHS,
+                        'lang'               : DEFAULT_LANG,
+                        'code_cache_size'    : str(DEFAULT_CODE_CACHE_SIZE),
+                        'compile_batch_size' : str(DEFAULT_BULK_BATCH_SIZE),
+                        'dt_max_expansions'  : str(DEFAULT_DT_MAX_EXPANSIONS),
+                        'pattern_mode'       : str(DEFAULT_PATTERN_MODE),
+                        'generation_check'   : str(DEFAULT_GENERATION_CHECK),
+                        'generation_gc_age'  : str(DEFAULT_GENERATION_GC_AGE),
+                        'compact_schema'     : str(DEFAULT_COMPACT_SCHEMA),
+                        'sqlite_pragmas'     : DEFAULT_SQLITE_PRAGMAS,
+                        'exact_index'        : str(DEFAULT_EXACT_INDEX),
+                        'bundle'             : DEFAULT_BUNDLE,
+                        'serve_bundle'       : str(DEFAULT_SERVE_BUNDLE),
+                        'mem_persist'        : DEFAULT_MEM_PERSIST,
+                        'mem_flush_interval' : str(DEFAULT_MEM_FLUSH_INTERVAL),
+                        'mem_flush_batch'    : str(DEFAULT_MEM_FLUSH_BATCH),
+                        'mem_paging'         : str(DEFAULT_MEM_PAGING),
+                        'mem_idle_ttl'       : str(DEFAULT_MEM_IDLE_TTL),
+                        'mem_max_realms'     : str(DEFAULT_MEM_MAX_REALMS),
+                        'latency_log'        : DEFAULT_LATENCY_LOG }
 DEFAULT_NLP_MODEL_ARGS = {
                           'model_dir'       : 'model',
                           'lstm_latent_dim' : 256,
@@ -128,6 +195,27 @@ class AIKernal(object):
         skill_paths  = config.get('main', 'skill_paths')
         lang         = config.get('main', 'lang')
 
+        code_cache_size    = config.getint('main', 'code_cache_size')
+        compile_batch_size = config.getint('main', 'compile_batch_size')
+        dt_max_expansions  = config.getint('main', 'dt_max_expansions')
+        pattern_mode       = config.getboolean('main', 'pattern_mode')
+        generation_check   = config.getfloat('main', 'generation_check')
+        generation_gc_age  = config.getfloat('main', 'generation_gc_age')
+        compact_schema     = config.getboolean('main', 'compact_schema')
+        sqlite_pragmas     = config.get('main', 'sqlite_pragmas')
+        exact_index        = config.getboolean('main', 'exact_index')
+        bundle             = config.get('main', 'bundle')
+        serve_bundle       = config.getboolean('main', 'serve_bundle')
+
+        mem_persist        = config.get('main', 'mem_persist')
+        mem_flush_interval = config.getfloat('main', 'mem_flush_interval')
+        mem_flush_batch    = config.getint('main', 'mem_flush_batch')
+        mem_paging         = config.getboolean('main', 'mem_paging')
+        mem_idle_ttl       = config.getfloat('main', 'mem_idle_ttl')
+        mem_max_realms     = config.getint('main', 'mem_max_realms')
+
+        latency_log        = config.get('main', 'latency_log')
+
         nlp_model_args = {
                           'model_dir'       : config.get('nlpmodel', 'model_dir'),
                           'lstm_latent_dim' : config.getint('nlpmodel', 'lstm_latent_dim'),
@@ -150,7 +238,14 @@ class AIKernal(object):
                            }
 
         return AIKernal(db_url=db_url, xsb_arch_dir=xsb_arch_dir, toplevel=toplevel, skill_paths=skill_paths, lang=lang,
-                        nlp_model_args=nlp_model_args, skill_args=skill_args, uttclass_model_args=uttclass_model_args)
+                        nlp_model_args=nlp_model_args, skill_args=skill_args, uttclass_model_args=uttclass_model_args,
+                        code_cache_size=code_cache_size, compile_batch_size=compile_batch_size,
+                        dt_max_expansions=dt_max_expansions, pattern_mode=pattern_mode, generation_check=generation_check,
+                        generation_gc_age=generation_gc_age, compact_schema=compact_schema, sqlite_pragmas=sqlite_pragmas,
+                        exact_index=exact_index, bundle=bundle,
+                        serve_bundle=serve_bundle, mem_persist=mem_persist, mem_flush_interval=mem_flush_interval,
+                        mem_flush_batch=mem_flush_batch, mem_paging=mem_paging, mem_idle_ttl=mem_idle_ttl,
+                        mem_max_realms=mem_max_realms, latency_log=latency_log)
 
     def __init__(self, 
                  db_url              = DEFAULT_DB_URL, 
@@ -160,18 +255,75 @@ class AIKernal(object):
                  lang                = DEFAULT_LANG, 
                  nlp_model_args      = DEFAULT_NLP_MODEL_ARGS,
                  skill_args          = DEFAULT_SKILL_ARGS,
-                 uttclass_model_args = DEFAULT_UTTCLASS_MODEL_ARGS):
+                 uttclass_model_args = DEFAULT_UTTCLASS_MODEL_ARGS,
+                 code_cache_size     = DEFAULT_CODE_CACHE_SIZE,
+                 compile_batch_size  = DEFAULT_BULK_BATCH_SIZE,
+                 dt_max_expansions   = DEFAULT_DT_MAX_EXPANSIONS,
+                 pattern_mode        = DEFAULT_PATTERN_MODE,
+                 generation_check    = DEFAULT_GENERATION_CHECK,
+                 generation_gc_age   = DEFAULT_GENERATION_GC_AGE,
+                 compact_schema      = DEFAULT_COMPACT_SCHEMA,
+                 sqlite_pragmas      = DEFAULT_SQLITE_PRAGMAS,
+                 exact_index         = DEFAULT_EXACT_INDEX,
+                 bundle              = DEFAULT_BUNDLE,
+                 serve_bundle        = DEFAULT_SERVE_BUNDLE,
+                 mem_persist         = DEFAULT_MEM_PERSIST,
+                 mem_flush_interval  = DEFAULT_MEM_FLUSH_INTERVAL,
+                 mem_flush_batch     = DEFAULT_MEM_FLUSH_BATCH,
+                 mem_paging          = DEFAULT_MEM_PAGING,
+                 mem_idle_ttl        = DEFAULT_MEM_IDLE_TTL,
+                 mem_max_realms      = DEFAULT_MEM_MAX_REALMS,
+                 latency_log         = DEFAULT_LATENCY_LOG):
 
         self.lang                = lang
         self.nlp_model_args      = nlp_model_args
         self.skill_args          = skill_args
         self.uttclass_model_args = uttclass_model_args
+        self.bundle              = bundle
+        self.dt_max_expansions   = dt_max_expansions
+        self.pattern_mode        = pattern_mode
+        self.generation_check    = generation_check
+        self.generation_gc_age   = generation_gc_age
+
+        #
+        # memory persistence (write-behind)
+        #
+
+        if not mem_persist in [MEM_PERSIST_TURN, MEM_PERSIST_PERIODIC, MEM_PERSIST_SHUTDOWN]:
+            raise Exception ('unknown memory persistence policy: %s' % mem_persist)
+
+        self.mem_persist        = mem_persist
+        self.mem_flush_interval = mem_flush_interval
+        self.mem_flush_batch    = mem_flush_batch
+        self.mem_paging         = mem_paging
+        self.mem_idle_ttl       = mem_idle_ttl
+        self.mem_max_realms     = mem_max_realms
+        self.mem_store          = MemStore(max_entries=MAX_MEM_ENTRIES)
+        self.mem_last_flush     = time.time()
+
+        # test memory lives in memory only, reset to this (empty) snapshot before each test
+
+        for realm in TEST_REALMS:
+            self.mem_store.set_volatile(realm)
+        self.test_mem_snapshot  = self.mem_store.snapshot(TEST_REALMS)
+
+        #
+        # latency instrumentation
+        #
+
+        self.turn               = None # latency.TurnRecord of the turn in progress
+        self.turn_cache         = None # ai_context.TurnCache of the context whose input is being processed
+        self.last_turn          = None
+        self.latency_log        = latency_log
+        self.latency_sinks      = []
+        if latency_log:
+            self.add_latency_sink(latency.JSONLinesSink(latency_log))
 
         #
         # database connection
         #
 
-        self.engine  = model.data_engine_setup(db_url, echo=False)
+        self.engine  = model.data_engine_setup(db_url, echo=False, sqlite_pragmas=sqlite_pragmas)
         self.Session = sessionmaker(bind=self.engine)
         self.session = self.Session()
 
@@ -222,28 +374,78 @@ class AIKernal(object):
         #
 
         pyxsb_start_session(xsb_arch_dir)
-        self.dte = DataEngine(self.session)
+
+        self.kb_writers = set(KB_WRITE_PREDS) # predicates which change the KB
+        self.pl_rules   = [] # (head predicate, identifiers in body) of consulted prolog rules
+
+        self.dte = DataEngine(self.session, batch_size=compile_batch_size)
+        self.dte.set_compact_schema(compact_schema)
+
+        # skill code is compiled once, executed in this module's namespace
+
+        self.code_cache = CodeCache(self.dte, globals(), max_size=code_cache_size)
+
+        # exact match lookups can be served from memory or a read-only
+        # runtime bundle instead of the db
+
+        if serve_bundle:
+            if not bundle:
+                raise Exception ('serve_bundle requires a bundle filename')
+            pm_skills = model.pattern_mode_skills(self.session)
+            if pm_skills:
+                raise Exception ('serve_bundle: skills compiled in pattern mode cannot be served from a bundle: %s' % ', '.join(pm_skills))
+            self.dte.set_index(RuntimeBundle(bundle))
+        elif exact_index:
+            self.dte.set_index(ExactMatchIndex(self.session))
+
+        # skills compiled in pattern mode are matched against their stored patterns
+
+        if not serve_bundle:
+            self.dte.set_matcher(PatternMatcher(self.session))
+
+        # NER dicts, shared by all contexts
+
+        self.ner_index = NERIndex(self.session, bundle=self.dte.index if serve_bundle else None)
+
+        # published skill generations the in-memory index/matcher were built from
+
+        self.generations      = model.published_generations(self.session)
+        self.generation_ts    = time.time()
 
         pyxsb_command('import default_sys_error_handler/1 from error_handler.')
         pyxsb_command('assertz((default_user_error_handler(Ball):-default_sys_error_handler(Ball))).')
 
         #
-        # restore memory
+        # restore memory (with paging enabled, realms get loaded on demand instead)
         #
 
-        q = u''
-        for m in self.session.query(model.Mem):
+        if not self.mem_paging:
+            self._mem_restore()
+
+        # make sure memory/4 is defined even if nothing gets mirrored into it
+        pyxsb_command(u'assertz(memory(self, self, self, 1.0)).')
+
+        atexit.register(self.shutdown)
+
+    def shutdown (self):
+
+        """ flush pending memory changes, call before the kernal is discarded """
+
+        self.mem_flush()
+
+    def add_latency_sink (self, sink):
+
+        """ sink.record(turn_record) will be called at the end of each process_input call """
 
-            v = json_to_xsb(m.v)
+        self.latency_sinks.append(sink)
 
-            if q:
-                q += ', '
-            q += u"assertz(memory('%s', '%s', %s, %f))" % (m.realm, m.k, unicode(v), m.score)
+    def _stage_start (self, stage):
+        if self.turn:
+            self.turn.start(stage)
 
-        if not q:
-            q = u'assertz(memory(self, self, self, 1.0))'
-        q += u'.'
-        pyxsb_command(q)
+    def _stage_stop (self):
+        if self.turn:
+            self.turn.stop()
 
     # FIXME: this will work only on the first call
     def setup_nlp_model (self, restore=True):
@@ -265,6 +467,7 @@ class AIKernal(object):
             self.dte.clean(skill_name)
 
         self.session.commit()
+        self.refresh_index()
 
     def load_skill (self, skill_name):
 
@@ -334,6 +537,14 @@ class AIKernal(object):
 
                     pyxsb_command("consult('%s')."% pl_path)
 
+                    pl_src = self._pl_source(pl_path)
+
+                    if not self.mem_store.mirror and MEMORY_PRED_RE.search(pl_src):
+                        logging.debug('skill %s: %s reads memory/4, mirroring dialog memory into prolog KB.' % (skill_name, pl_path))
+                        self.mem_store.set_mirror()
+
+                    self._pl_add_rules(pl_src)
+
         except:
             logging.error('failed to load skill "%s"' % skill_name)
             logging.error(traceback.format_exc())
@@ -341,6 +552,44 @@ class AIKernal(object):
 
         return m
 
+    def _pl_source (self, pl_path):
+
+        for fn in [pl_path, pl_path + '.pl']:
+            if os.path.isfile(fn):
+                with codecs.open(fn, 'r', 'utf8') as plf:
+                    return plf.read()
+
+        return u''
+
+    def _pl_add_rules (self, pl_src):
+
+        """ find out which predicates of prolog source pl_src change the KB, see _kb_write """
+
+        for clause in PL_CLAUSE_END_RE.split(PL_COMMENT_RE.sub(u' ', pl_src)):
+
+            head, sep, body = clause.partition(u':-')
+            head = PL_IDENT_RE.search(head)
+            if not sep or not head:
+                continue
+
+            self.pl_rules.append((head.group(0), set(PL_IDENT_RE.findall(body))))
+
+        # rules calling a predicate which changes the KB change it, too
+
+        changed = True
+        while changed:
+            changed = False
+            for head, calls in self.pl_rules:
+                if not head in self.kb_writers and not calls.isdisjoint(self.kb_writers):
+                    self.kb_writers.add(head)
+                    changed = True
+
+    def _kb_write (self, query):
+
+        """ could query change the KB? (errs on the safe side: any mention of a predicate that may) """
+
+        return not self.kb_writers.isdisjoint(PL_IDENT_RE.findall(query))
+
     def compile_skill (self, skill_name):
 
         m = self.load_skill(skill_name)
@@ -353,6 +602,11 @@ class AIKernal(object):
 
         self.dte.prepare_compilation(skill_name)
 
+        # skills can override the cap on expansions per dt() call
+
+        self.dte.set_max_expansions(getattr(m, 'MAX_EXPANSIONS', self.dt_max_expansions))
+        self.dte.set_pattern_mode(getattr(m, 'PATTERN_MODE', self.pattern_mode))
+
         if hasattr(m, 'get_data'):
 
             logging.info ('skill %s data extraction...' % skill_name)
@@ -360,166 +614,573 @@ class AIKernal(object):
             get_data = getattr(m, 'get_data')
             get_data(self)
 
+        self.dte.build_ner_index()
         self.dte.commit()
 
+        # fingerprint and generation switch are committed together
+
+        self._store_fingerprint(skill_name)
+        self.dte.publish()
+
         cnt_dt, cnt_ts = self.dte.get_stats()
         logging.info ('skill %s data extraction done. %d training samples, %d tests' % (skill_name, cnt_dt, cnt_ts))
 
-    def compile_skill_multi (self, skill_names):
+    def estimate_skills (self, skill_names):
+
+        """ run data extraction of skills in estimate mode: nothing is written, returns list of
+            (count, generated count, skill, lang, pattern, loc_fn, loc_line) per pattern, biggest first """
+
+        self.dte.estimate  = True
+        self.dte.estimates = []
+
+        try:
+            for skill_name in skill_names:
+
+                skill_list = self.all_skills if skill_name == 'all' else [ skill_name ]
+
+                for sn in skill_list:
+
+                    m = self.load_skill(sn)
+                    self.consult_skill(sn)
+
+                    self.dte.prepare_compilation(sn)
+                    self.dte.set_max_expansions(getattr(m, 'MAX_EXPANSIONS', self.dt_max_expansions))
+                    self.dte.set_pattern_mode(getattr(m, 'PATTERN_MODE', self.pattern_mode))
+
+                    if hasattr(m, 'get_data'):
+                        logging.info ('skill %s: estimating...' % sn)
+                        getattr(m, 'get_data')(self)
+
+                    # named macros have to be visible to dependent skills
+
+                    self.dte.publish(commit=False)
+
+        finally:
+            # discard everything written while estimating
+            self.dte.bulk.discard()
+            self.session.rollback()
+            self.dte.invalidate_caches()
+            self.dte.estimate   = False
+            self.dte.generation = None
+
+        return sorted(self.dte.estimates, reverse=True)
+
+    #
+    # skill fingerprints for incremental compilation
+    #
+
+    def _skill_src_hash (self, skill_name):
+
+        """ md5 over the skill's python sources, PL_SOURCES files and the compile options its data depends on """
+
+        m         = self.load_skill(skill_name)
+        skill_dir = self.skill_paths[skill_name]
+        base_dir  = os.path.dirname(skill_dir)
+
+        fns = []
+        if os.path.isdir(skill_dir):
+            for dirpath, dirnames, filenames in os.walk(skill_dir):
+                for fn in filenames:
+                    if fn.endswith('.py'):
+                        fns.append(os.path.join(dirpath, fn))
+        else:
+            fns.append(skill_dir)
+
+        for inputfn in getattr(m, 'PL_SOURCES', []):
+            pl_path = "%s/%s" % (skill_dir, inputfn)
+            for fn in [pl_path, pl_path + '.pl']:
+                if os.path.isfile(fn):
+                    fns.append(fn)
+                    break
+
+        md5 = hashlib.md5()
+        for fn in sorted(set(fns)):
+            md5.update(os.path.relpath(fn, base_dir) + '\n')
+            with open(fn, 'rb') as f:
+                md5.update(f.read())
+
+        # same options compile_skill uses
+
+        options = [ getattr(m, 'MAX_EXPANSIONS', self.dt_max_expansions),
+                    getattr(m, 'PATTERN_MODE', self.pattern_mode),
+                    self.dte.compact is not None ]
+        md5.update(json.dumps(options))
+
+        return md5.hexdigest()
+
+    def _macro_hash (self, skill_name, macros):
+
+        """ md5 over the solutions other skills provide for named macros (lang, name) """
+
+        md5 = hashlib.md5()
+
+        for lang, name in sorted(macros):
+            md5.update((u'%s:%s\n' % (lang, name)).encode('utf8'))
+            q = model.live(self.session.query(model.NamedMacro), model.NamedMacro)
+            for nm in q.filter(model.NamedMacro.lang==lang) \
+                       .filter(model.NamedMacro.name==name) \
+                       .filter(model.NamedMacro.skill!=skill_name) \
+                       .order_by(model.NamedMacro.id):
+                md5.update((nm.soln + u'\n').encode('utf8'))
+
+        return md5.hexdigest()
+
+    def _store_fingerprint (self, skill_name):
 
+        macros = sorted(self.dte.used_macros)
+
+        self.session.merge(model.SkillFingerprint(skill      = skill_name,
+                                                  src_hash   = self._skill_src_hash(skill_name),
+                                                  macros     = json.dumps(macros),
+                                                  macro_hash = self._macro_hash(skill_name, macros)))
+
+    def skill_up_to_date (self, skill_name):
+
+        """ True if neither the skill's sources, its compile options nor the macros it uses from other skills changed since its last compilation """
+
+        fp = self.session.query(model.SkillFingerprint).filter(model.SkillFingerprint.skill==skill_name).first()
+        if not fp:
+            return False
+
+        if fp.src_hash != self._skill_src_hash(skill_name):
+            return False
+
+        macros = [ tuple(m) for m in json.loads(fp.macros) ]
+
+        return fp.macro_hash == self._macro_hash(skill_name, macros)
+
+    def compile_skill_multi (self, skill_names, jobs=1, force=False):
+
+        """ compile skills, jobs>1 compiles independent skills in parallel worker processes.
+            skills that are up to date are skipped unless force is set. """
+
+        todo = []
         for skill_name in skill_names:
             if skill_name == 'all':
                 for mn2 in self.all_skills:
-                    self.compile_skill (mn2)
+                    if not mn2 in todo:
+                        todo.append(mn2)
+            elif not skill_name in todo:
+                todo.append(skill_name)
 
-            else:
+        if jobs > 1 and len(todo) > 1:
+            compile_parallel(self, todo, jobs, force=force)
+        else:
+            for skill_name in todo:
+                if not force and self.skill_up_to_date(skill_name):
+                    logging.info ('skill %s is up to date.' % skill_name)
+                    continue
                 self.compile_skill (skill_name)
 
+        self.gc_generations()
+
+        self.refresh_index()
+
+    def gc_generations (self, min_age=None):
+
+        """ delete skill data superseded more than min_age (default: generation_gc_age) seconds ago """
+
+        if min_age is None:
+            min_age = self.generation_gc_age
+
+        return self.dte.gc_generations(min_age)
+
+    def refresh_index (self):
+
+        """ re-load in-memory exact match index (if enabled) and pattern matcher after skills have been (re-)compiled,
+            map the runtime bundle again if it has been re-written """
+
+        self.generations   = model.published_generations(self.session)
+        self.generation_ts = time.time()
+
+        if isinstance(self.dte.index, ExactMatchIndex):
+            self.dte.index.refresh()
+        if self._bundle_changed():
+            bundle = self.dte.index
+            logging.info ('runtime bundle %s changed, mapping the new one.' % bundle.bundlefn)
+            self.dte.set_index(RuntimeBundle(bundle.bundlefn))
+            self.ner_index.bundle = self.dte.index
+            bundle.close()
+        if self.dte.matcher:
+            self.dte.matcher.refresh()
+        self.ner_index.refresh()
+
+    def check_generations (self):
+
+        """ called at request boundaries: pick up skill generations other processes published since
+            the last check (at most every generation_check seconds) """
+
+        if self.generation_check < 0 or time.time() - self.generation_ts < self.generation_check:
+            return False
+
+        self.generation_ts = time.time()
+
+        # end our transaction so we get to see recent commits
+
+        self.session.commit()
+
+        # bundles get written after publishing, so they are checked for on their own
+
+        generations = model.published_generations(self.session)
+        if generations == self.generations and not self._bundle_changed():
+            return False
+
+        logging.info ('new skill generations or runtime bundle published, refreshing.')
+
+        self.refresh_index()
+
+        return True
+
+    def _bundle_changed (self):
+        return isinstance(self.dte.index, RuntimeBundle) and self.dte.index.changed()
+
+    def migrate_schema (self, reverse=False):
+
+        """ move published training data into the compact schema (back into training_data if reverse is set) """
+
+        cnt = compact_schema.migrate(self.session, reverse=reverse, batch_size=self.dte.bulk.batch_size)
+
+        self.dte.invalidate_caches()
+        self.refresh_index()
+
+        return cnt
+
+    def export_training_data (self, fn, lang=None, skill=None):
+
+        """ write published training data (either schema) to fn as json lines """
+
+        return compact_schema.export_jsonl(self.session, fn, lang=lang, skill=skill)
+
+    def write_bundle (self, bundlefn=None):
+
+        """ write read-only runtime bundle for serving processes """
+
+        bundlefn = bundlefn if bundlefn else self.bundle
+        if not bundlefn:
+            raise Exception ('no runtime bundle filename configured')
+
+        write_bundle(self.session, bundlefn)
+
     def create_context (self, user=DEFAULT_USER, realm=DEFAULT_REALM, test_mode=False):
+
+        self._mem_page_in(user)
+        self._mem_page_in(realm)
+
         return AIContext(user, self.session, self.lang, realm, self, test_mode=test_mode)
 
-    def test_skill (self, skill_name, run_trace=False, test_name=None):
+    def run_test (self, skill_name, tc):
+
+        """ run test case tc (as returned by DataEngine.lookup_tests), return SkillTestResult """
+
+        t_name, self.lang, prep_code, prep_fn, rounds, src_fn, self.src_line = tc
+
+        start_time = time.time()
+
+        ctx        = self.create_context(user=TEST_USER, realm=TEST_REALM, test_mode=True)
+
+        self.mem_store.restore(self.test_mem_snapshot)
+
+        # prep
+
+        if prep_code:
+            try:
+                md5s = hashlib.md5(prep_code.encode('utf8')).hexdigest()
+                fn   = self.code_cache.lookup(md5s, (prep_fn, prep_code))
+                fn(ctx)
+            except:
+                logging.error('EXCEPTION CAUGHT %s' % traceback.format_exc())
+
+        # the turn cache must not outlive the test, whatever happens
+
+        try:
+            failure, round_num = self._run_test_rounds(ctx, t_name, rounds)
+        finally:
+            self.turn_cache = None
+
+        return SkillTestResult(skill_name, t_name, self.lang, src_fn, self.src_line, time.time()-start_time, failure, round_num)
+
+    def _run_test_rounds (self, ctx, t_name, rounds):
+
+        """ run test rounds in ctx, return (failure or None, number of rounds passed) """
+
+        round_num  = 0
+        failure    = None
+
+        for test_inp, test_out, test_action, test_action_arg in rounds:
+           
+            logging.info("test_skill: %s round %d test_inp    : %s" % (t_name, round_num, repr(test_inp)) )
+            logging.info("test_skill: %s round %d test_out    : %s" % (t_name, round_num, repr(test_out)) )
+
+            # look up code in data engine
+
+            matching_resp = False
+            found_code    = False
+
+            ctx.set_inp(test_inp)
+            self.turn_cache = ctx.turn_cache
+            self.mem_set (ctx.realm, 'action', None)
+
+            for lang, d, md5s, args, code_src_fn, code_src_line, code_fn, code in self.dte.lookup_data_train_code (test_inp, self.lang):
+
+                found_code = True
+                # import pdb; pdb.set_trace()
+                try:
+                    fn = self.code_cache.lookup(md5s, (code_fn, code))
+                    fn(ctx, *(args or []))
+                except:
+                    logging.error('test_skill: %s round %d EXCEPTION CAUGHT %s' % (t_name, round_num, traceback.format_exc()))
+                    logging.error('code: %s args: %s (%s:%s)' % (md5s, repr(args), code_src_fn, code_src_line))
+
+            if not found_code:
+                failure = u'no training data for test_in "%s" found in DB' % test_inp
+                logging.error (u'Error: %s: %s!' % (t_name, failure))
+                break
+
+            resps = ctx.get_resps()
+
+            for i, resp in enumerate(resps):
+                actual_out, score, actual_action, actual_action_arg = resp
+                # logging.info("test_skill: %s round %d %s" % (clause.location, round_num, repr(abuf)) )
+
+                if len(test_out) > 0:
+                    if len(actual_out)>0:
+                        actual_out = u' '.join(tokenize(actual_out, self.lang))
+                    logging.info("test_skill: %s round %d actual_out  : %s (score: %f)" % (t_name, round_num, actual_out, score) )
+                    if actual_out != test_out:
+                        logging.info("test_skill: %s round %d UTTERANCE MISMATCH." % (t_name, round_num))
+                        continue # no match
+
+                logging.info("test_skill: %s round %d UTTERANCE MATCHED!" % (t_name, round_num))
+                matching_resp = True
+                ctx.commit_resp(i)
+
+                # check action
+
+                if test_action:
+                    fn = self.code_cache.lookup(test_action)
+                    if test_action_arg:
+                        fn(ctx, test_action_arg)
+                    else:
+                        fn(ctx)
+
+                break
+
+            if not matching_resp:
+                failure = u'no matching response found for "%s" (expected: "%s")' % (test_inp, test_out)
+                logging.error (u'test_skill: %s round %d %s' % (t_name, round_num, failure))
+                break
+
+            round_num   += 1
+
+        return failure, round_num
+
+    def _lookup_tests (self, skill_name, test_name=None):
+
+        tests = []
+        for tc in self.dte.lookup_tests(skill_name):
+            if test_name and tc[0] != test_name:
+                logging.info ('skipping test %s' % tc[0])
+                continue
+            tests.append(tc)
+        return tests
+
+    def test_skill (self, skill_name, run_trace=False, test_name=None, results=None):
+
+        """ run tests of skill_name, returns (num_tests, num_fails). SkillTestResults are appended to results if given """
 
         if run_trace:
             pyxsb_command("trace.")
         else:
             pyxsb_command("notrace.")
 
-        m = self.skills[skill_name]
-
         logging.info('running tests of skill %s ...' % (skill_name))
 
         num_tests = 0
         num_fails = 0
-        for tc in self.dte.lookup_tests(skill_name):
-            t_name, self.lang, prep_code, prep_fn, rounds, src_fn, self.src_line = tc
+        for tc in self._lookup_tests(skill_name, test_name):
 
-            if test_name:
-                if t_name != test_name:
-                    logging.info ('skipping test %s' % t_name)
-                    continue
+            r = self.run_test(skill_name, tc)
 
-            ctx        = self.create_context(user=TEST_USER, realm=TEST_REALM, test_mode=True)
-            round_num  = 0
             num_tests += 1
+            if r.failure is not None:
+                num_fails += 1
 
-            self.mem_clear(TEST_REALM)
-            self.mem_clear(TEST_USER)
+            if results is not None:
+                results.append(r)
 
-            # prep
+        return num_tests, num_fails
 
-            if prep_code:
-                pcode = '%s\n%s(ctx)\n' % (prep_code, prep_fn)
-                try:
-                    exec (pcode, globals(), locals())
-                except:
-                    logging.error('EXCEPTION CAUGHT %s' % traceback.format_exc())
+    def _current_skill_hash (self, skill_name, fp):
 
-            for test_inp, test_out, test_action, test_action_arg in rounds:
-               
-                logging.info("test_skill: %s round %d test_inp    : %s" % (t_name, round_num, repr(test_inp)) )
-                logging.info("test_skill: %s round %d test_out    : %s" % (t_name, round_num, repr(test_out)) )
-
-                # look up code in data engine
-
-                matching_resp = False
-                acode         = None
-
-                ctx.set_inp(test_inp)
-                self.mem_set (ctx.realm, 'action', None)
-
-                for lang, d, md5s, args, src_fn, src_line in self.dte.lookup_data_train (test_inp, self.lang):
-
-                    afn, acode = self.dte.lookup_code(md5s)
-                    ecode = '%s\n%s(ctx' % (acode, afn)
-                    if args:
-                        for arg in args:
-                            ecode += ',%s' % repr(arg)
-                    ecode += ')\n'
-                    # import pdb; pdb.set_trace()
-                    try:
-                        exec (ecode, globals(), locals())
-                    except:
-                        logging.error('test_skill: %s round %d EXCEPTION CAUGHT %s' % (t_name, round_num, traceback.format_exc()))
-                        logging.error(ecode)
-
-                if acode is None:
-                    logging.error (u'Error: %s: no training data for test_in "%s" found in DB!' % (t_name, test_inp))
-                    num_fails += 1
-                    break
+        """ (src hash, macro hash) of skill_name as it is now. Sources of skills that are not loaded
+            are not hashed, fingerprint fp (if any) stands in for them """
 
-                resps = ctx.get_resps()
+        if skill_name in self.skills:
+            src_hash = self._skill_src_hash(skill_name)
+        else:
+            src_hash = fp.src_hash if fp else None
 
-                for i, resp in enumerate(resps):
-                    actual_out, score, actual_action, actual_action_arg = resp
-                    # logging.info("test_skill: %s round %d %s" % (clause.location, round_num, repr(abuf)) )
+        if not fp:
+            return src_hash, None
 
-                    if len(test_out) > 0:
-                        if len(actual_out)>0:
-                            actual_out = u' '.join(tokenize(actual_out, self.lang))
-                        logging.info("test_skill: %s round %d actual_out  : %s (score: %f)" % (t_name, round_num, actual_out, score) )
-                        if actual_out != test_out:
-                            logging.info("test_skill: %s round %d UTTERANCE MISMATCH." % (t_name, round_num))
-                            continue # no match
+        return src_hash, self._macro_hash(skill_name, [ tuple(m) for m in json.loads(fp.macros) ])
 
-                    logging.info("test_skill: %s round %d UTTERANCE MATCHED!" % (t_name, round_num))
-                    matching_resp = True
-                    ctx.commit_resp(i)
+    def _test_keys (self, tests):
 
-                    # check action
+        """ md5 per (skill name, test case) over the test's rounds and prep code, the code md5s its
+            inputs resolve to and the current sources and macros of the skills involved (the test's skill,
+            the skills it DEPENDS on, the skills the matched code comes from) """
 
-                    if test_action:
-                        afn, acode = self.dte.lookup_code(test_action)
-                        ecode = '%s\n%s(ctx' % (acode, afn)
-                        if test_action_arg:
-                            ecode += ',%s' % repr(test_action_arg)
-                        ecode += ')\n'
-                        exec (ecode, globals(), locals())
+        fingerprints = {}
+        for fp in self.session.query(model.SkillFingerprint):
+            fingerprints[fp.skill] = fp
 
-                    break
+        skill_hashes = {} # skill -> current (src hash, macro hash), hashed once per call
 
-                if not matching_resp:
-                    logging.error (u'test_skill: %s round %d no matching response found.' % (t_name, round_num))
-                    num_fails += 1
-                    break
+        keys = []
+        for skill_name, tc in tests:
 
-                round_num   += 1
+            t_name, lang, prep_code, prep_fn, rounds, loc_fn, loc_line = tc
 
-        return num_tests, num_fails
+            md5s = set()
+            for test_inp, test_out, test_action, test_action_arg in rounds:
+                for m in self.dte.lookup_data_train(test_inp, lang):
+                    md5s.add(m[2])
+            md5s = sorted(md5s)
 
-    def run_tests_multi (self, skill_names, run_trace=False, test_name=None):
+            skills = transitive_deps(self, skill_name)
+            skills.add(skill_name)
+            if md5s:
+                for code_skill, in self.session.query(model.Code.skill).filter(model.Code.md5s.in_(md5s)):
+                    skills.add(code_skill)
 
-        num_tests = 0
-        num_fails = 0
+            md5 = hashlib.md5()
+            md5.update(json.dumps([lang, prep_code, prep_fn, rounds, md5s]))
+            for sn in sorted(skills):
+                if not sn in skill_hashes:
+                    skill_hashes[sn] = self._current_skill_hash(sn, fingerprints.get(sn))
+                md5.update(json.dumps([sn, skill_hashes[sn]]))
 
-        for skill_name in skill_names:
+            keys.append(md5.hexdigest())
 
-            if skill_name == 'all':
+        return keys
 
-                for mn2 in self.all_skills:
-                    self.consult_skill (mn2)
-                    n, f = self.test_skill (mn2, run_trace=run_trace, test_name=test_name)
-                    num_tests += n
-                    num_fails += f
+    def _update_test_cache (self, results, keys):
+
+        """ remember passed tests under their keys, forget failed ones """
+
+        for r, key in zip(results, keys):
 
+            if r.failure is None:
+                self.session.merge(model.CachedTestResult(skill=r.skill, lang=r.lang, name=r.name,
+                                                          key=key, duration=r.duration, ts=time.time()))
             else:
-                self.consult_skill (skill_name)
-                n, f = self.test_skill (skill_name, run_trace=run_trace, test_name=test_name)
-                num_tests += n
-                num_fails += f
+                self.session.query(model.CachedTestResult).filter(model.CachedTestResult.skill==r.skill) \
+                                                          .filter(model.CachedTestResult.lang==r.lang) \
+                                                          .filter(model.CachedTestResult.name==r.name) \
+                                                          .delete(synchronize_session=False)
 
-        return num_tests, num_fails
+        self.session.commit()
 
+    def run_tests_multi (self, skill_names, run_trace=False, test_name=None, jobs=1, junit_xml=None, changed_only=False):
 
-    def process_input (self, ctx, inp_raw, run_trace=False, do_eliza=True):
+        """ run tests of skills, jobs>1 shards test cases across worker processes.
+            changed_only: skip tests that passed before and whose inputs (see _test_keys) did not change since.
+            logs a report (failures, slowest tests), writes JUnit style XML to junit_xml if given.
+            returns (num_tests, num_fails) """
 
-        """ process user input, return score, responses, actions, solutions, context """
+        todo = []
+        for skill_name in skill_names:
+            if skill_name == 'all':
+                for mn2 in self.all_skills:
+                    if not mn2 in todo:
+                        todo.append(mn2)
+            elif not skill_name in todo:
+                todo.append(skill_name)
+
+        for skill_name in todo:
+            self.consult_skill (skill_name)
+
+        tests = []
+        for skill_name in todo:
+            for tc in self._lookup_tests(skill_name, test_name):
+                tests.append((skill_name, tc))
+
+        keys = self._test_keys(tests)
+
+        if changed_only:
+
+            cached = {}
+            for ctr in self.session.query(model.CachedTestResult):
+                cached[(ctr.skill, ctr.lang, ctr.name)] = ctr.key
+
+            changed = []
+            for test, key in zip(tests, keys):
+                skill_name, tc = test
+                if cached.get((skill_name, tc[1], tc[0])) != key:
+                    changed.append((test, key))
+
+            logging.info ('%d of %d tests unchanged since they last passed, skipped.' % (len(tests)-len(changed), len(tests)))
+
+            tests = [ c[0] for c in changed ]
+            keys  = [ c[1] for c in changed ]
 
         if run_trace:
             pyxsb_command("trace.")
         else:
             pyxsb_command("notrace.")
 
+        if jobs > 1:
+
+            results = run_tests_parallel(self, tests, jobs)
+
+        else:
+            results = []
+            for skill_name, tc in tests:
+                results.append(self.run_test(skill_name, tc))
+
+        self._update_test_cache(results, keys)
+
+        skill_tests.log_report(results)
+
+        if junit_xml:
+            skill_tests.write_junit_xml(results, junit_xml)
+
+        return len(results), skill_tests.count_fails(results)
+
+
+    def process_input (self, ctx, inp_raw, run_trace=False, do_eliza=True):
+
+        """ process user input, return score, responses, actions, solutions, context """
+
+        self.check_generations()
+
+        # turn record + cache are per turn, they must not leak into the next one on errors
+
+        self.turn = latency.TurnRecord(ctx.user, ctx.realm, inp_raw)
+
+        try:
+            out, score, action = self._process_input(ctx, inp_raw, run_trace, do_eliza)
+
+            self.turn.finish()
+            for sink in self.latency_sinks:
+                sink.record(self.turn)
+            self.last_turn  = self.turn
+
+        finally:
+            self.turn       = None
+            self.turn_cache = None
+
+        return out, score, action
+
+    def _process_input (self, ctx, inp_raw, run_trace, do_eliza):
+
+        if run_trace:
+            self._pyxsb_command("trace.")
+        else:
+            self._pyxsb_command("notrace.")
+
+        self._stage_start(latency.STAGE_TOKENIZE)
         tokens_raw  = tokenize(inp_raw, ctx.lang)
         tokens = []
         for t in tokens_raw:
@@ -527,8 +1188,10 @@ class AIKernal(object):
                 continue
             tokens.append(t)
         inp = u" ".join(tokens)
+        self._stage_stop()
 
         ctx.set_inp(inp)
+        self.turn_cache = ctx.turn_cache
         self.mem_set (ctx.realm, 'action', None)
 
         logging.debug('===============================================================================')
@@ -539,25 +1202,26 @@ class AIKernal(object):
         #
 
         found_resp = False
-        for lang, d, md5s, args, src_fn, src_line in self.dte.lookup_data_train (inp, ctx.lang):
 
-            afn, acode = self.dte.lookup_code(md5s)
-            ecode = '%s\n%s(ctx' % (acode, afn)
-            if args:
-                for arg in args:
-                    ecode += ',%s' % repr(arg)
-            ecode += ')\n'
+        self._stage_start(latency.STAGE_LOOKUP)
+        matches = self.dte.lookup_data_train_code (inp, ctx.lang)
+        self._stage_stop()
+
+        for lang, d, md5s, args, src_fn, src_line, code_fn, code in matches:
 
             logging.debug ('exact training data match found: %s:%s' % (src_fn, src_line))
-            logging.debug (ecode)
+            logging.debug ('code: %s args: %s' % (md5s, repr(args)))
 
             # import pdb; pdb.set_trace()
+            self._stage_start(latency.STAGE_CODE)
             try:
-                exec (ecode, globals(), locals())
+                fn = self.code_cache.lookup(md5s, (code_fn, code))
+                fn(ctx, *(args or []))
                 found_resp = True
             except:
                 logging.error('EXCEPTION CAUGHT %s' % traceback.format_exc())
-                logging.error(ecode)
+                logging.error('code: %s args: %s (%s:%s)' % (md5s, repr(args), src_fn, src_line))
+            self._stage_stop()
 
         if not found_resp:
             logging.debug('no exact training data match for this input found.')
@@ -573,13 +1237,14 @@ class AIKernal(object):
 
             logging.debug('trying neural net on: %s' % repr(inp))
 
+            self._stage_start(latency.STAGE_NLP)
             try:
                 # ok, exact matching has not yielded any results -> use neural network to
                 # generate response(s)
 
                 # import pdb; pdb.set_trace()
 
-                predicted_ids = self.nlp_model.predict(inp)
+                predicted_ids = self.nlp_model.predict(inp, tokens=ctx.tokens())
 
                 # x = self.nlp_model.compute_x(inp)
 
@@ -614,20 +1279,14 @@ class AIKernal(object):
 
                     if decoded == _STOP or decoded == _OR:
 
+                        self._stage_start(latency.STAGE_CODE)
                         try:
                             logging.debug('trying cmd: %s' % repr(cmd))
-                            afn, acode = self.dte.lookup_code(cmd[0])
-                            ecode = '%s\n%s(ctx' % (acode, afn)
-                            if len(cmd)>1:
-                                for arg in cmd[1:]:
-                                    ecode += ',%s' % repr(json.loads(arg))
-                            ecode += ')\n'
-
-                            logging.debug(ecode)
-
-                            exec (ecode, globals(), locals())
+                            fn = self.code_cache.lookup(cmd[0])
+                            fn(ctx, *map(json.loads, cmd[1:]))
                         except:
                             logging.debug('EXCEPTION CAUGHT %s' % traceback.format_exc())
+                        self._stage_stop()
 
                         cmd = []
                         if decoded == _STOP:
@@ -638,8 +1297,9 @@ class AIKernal(object):
             except:
                 # probably ok (prolog code generated by neural network might not always work)
                 logging.error('EXCEPTION CAUGHT %s' % traceback.format_exc())
+            self._stage_stop()
 
-        pyxsb_command("notrace.")
+        self._pyxsb_command("notrace.")
 
         #
         # extract highest-scoring responses
@@ -650,14 +1310,18 @@ class AIKernal(object):
         if not resps and do_eliza:
             logging.debug ('producing ELIZA-style response for input %s' % inp)
 
+            self._stage_start(latency.STAGE_ELIZA)
             from psychology import psychology
             psychology.do_eliza(ctx)
             resps = ctx.get_resps()
+            self._stage_stop()
 
         #
         # pick random response
         #
 
+        self._stage_start(latency.STAGE_SELECT)
+
         if len(resps)>0:
             i = random.randrange(0, len(resps))
             out, score, action, action_arg = resps[i]
@@ -680,10 +1344,22 @@ class AIKernal(object):
             logging.debug(u'No response found.')
 
         action = self.mem_get (ctx.realm, 'action')
+
+        self._stage_stop()
+
         return out, score, action
 
+    def _check_training_data (self):
+
+        """ pattern mode skills have no expanded training data, the neural models would silently miss them """
+
+        pm_skills = model.pattern_mode_skills(self.session)
+        if pm_skills:
+            raise Exception ('skills compiled in pattern mode cannot be used for training: %s' % ', '.join(pm_skills))
+
     def train (self, num_epochs=DEFAULT_NUM_EPOCHS, incremental=False):
 
+        self._check_training_data()
         self.setup_nlp_model (restore=incremental)
         self.nlp_model.train(num_epochs, incremental)
 
@@ -699,13 +1375,11 @@ class AIKernal(object):
                         continue
                     dic.add(parts[0])
 
-        req = self.dte.session.query(model.TrainingData).filter(model.TrainingData.lang==self.lang)
-
-        if skill and skill != 'all':
-            req = req.filter(model.TrainingData.skill==skill)
+        if skill == 'all':
+            skill = None
 
         req_utts = []
-        for dr in req:
+        for dr in compact_schema.iter_training_data(self.dte.session, lang=self.lang, skill=skill):
             req_utts.append(dr.inp)
 
         if not dic:
@@ -756,156 +1430,277 @@ class AIKernal(object):
         for skill_name in self.all_skills:    
             stats[skill_name] = {}
             for lang in LANGUAGES:
-                cnt = self.session.query(model.TrainingData).filter(model.TrainingData.skill==skill_name,
-                                                                    model.TrainingData.lang==lang).count()
-                stats[skill_name][lang] = cnt
+                stats[skill_name][lang] = compact_schema.count_training_data(self.session, lang=lang, skill=skill_name)
 
         return stats
 
+    def _mem_page_in(self, realm):
+
+        """ make sure realm's memory is loaded, evict idle realms """
+
+        if self.mem_store.is_loaded(realm):
+            self.mem_store.access(realm)
+            return
+
+        if self.mem_paging and not self.mem_store.is_volatile(realm):
+            self._mem_restore(realm)
+
+        self.mem_store.access(realm)
+
+        self._mem_evict_idle()
+
+    def _mem_restore(self, realm=None):
+
+        """ stream memory entries (of realm, if given, all otherwise) from the db into the memory store """
+
+        start_time = time.time()
+
+        q = self.session.query(model.Mem)
+        if realm is not None:
+            q = q.filter(model.Mem.realm==realm)
+
+        cnt    = 0
+        errors = 0
+        for m in q.yield_per(MEM_RESTORE_BATCH):
+
+            if self.mem_store.is_volatile(m.realm):
+                continue
+
+            try:
+                v = json_to_xsb(m.v)
+                self.mem_store.load(m.realm, m.k, v, float(m.score))
+            except:
+                errors += 1
+                logging.error('memory restore: skipping corrupt entry #%s (%s, %s): %s' % (m.id, m.realm, m.k, traceback.format_exc()))
+                continue
+
+            if realm is None:
+                self.mem_store.access(m.realm)
+
+            cnt += 1
+            if cnt % MEM_RESTORE_BATCH == 0:
+                self._mem_mirror()
+                if realm is None:
+                    logging.info('memory restore: %8d entries restored so far (%fs)...' % (cnt, time.time()-start_time))
+
+        self._mem_mirror()
+
+        if realm is None:
+            logging.info('memory restore: %d entries restored, %d corrupt entries skipped, took %fs' % (cnt, errors, time.time()-start_time))
+        else:
+            logging.debug('memory restore: realm %s: %d entries restored, %d corrupt entries skipped, took %fs' % (realm, cnt, errors, time.time()-start_time))
+
+    def _mem_evict_idle(self):
+
+        if not self.mem_paging:
+            return
+
+        realms = self.mem_store.idle_realms(self.mem_idle_ttl, self.mem_max_realms)
+        if not realms:
+            return
+
+        self.mem_flush(realms=set(realms))
+        for realm in realms:
+            logging.debug('evicting memory of realm %s' % realm)
+            self.mem_store.evict(realm)
+
     def mem_clear(self, realm):
         if not isinstance(realm, basestring):
             raise Exception ("mem_set: realm must be string-typed.")
-        q = u"retractall(memory('%s', _, _, _))." % realm
-        # logging.debug (q)
-        self.prolog_query(q)
+        self._mem_page_in(realm)
+        self.mem_store.clear(realm)
 
     def mem_dump(self, realm):
         if not isinstance(realm, basestring):
             raise Exception ("mem_set: realm must be string-typed.")
-
-        entries = []
-
-        q = u"memory('%s', K, V, S)." % realm
-        # logging.debug (q)
-        res = self.prolog_query(q)
-        if res:
-            for r in res:
-                k     = r[0]
-                v     = r[1]
-                score = r[2]
-                entries.append((k, v, score))
-
-        return entries
+        self._mem_page_in(realm)
+        return self.mem_store.dump(realm)
 
     def mem_set(self, realm, k, v):
-
         if not isinstance(realm, basestring) or not isinstance(k, basestring):
             raise Exception ("mem_set: realm and key must be string-typed.")
-
-        q = u"retractall(memory('%s', '%s', _, _))" % (realm, k)
-        if v:
-            q += u", assertz(memory('%s', '%s', %s, 1.0))." % (realm, k, unicode(v))
-        else:
-            q += '.' 
-        # logging.debug (q)
-
-        self.prolog_query(q)
+        self._mem_page_in(realm)
+        self.mem_store.set(realm, k, v)
 
     def mem_get(self, realm, k):
         if not isinstance(realm, basestring) or not isinstance(k, basestring):
             raise Exception ("mem_set: realm and key must be string-typed.")
-
-        q = u"memory('%s', '%s', V, S)." % (realm, k)
-        # logging.debug (q)
-        res = self.prolog_query(q)
-        if not res:
-            return None
-
-        score = 0.0
-        v = None
-        for r in res:
-            if not v or r[1] > score:
-                score = r[1]
-                v     = r[0]
-
-        return v
+        self._mem_page_in(realm)
+        return self.mem_store.get(realm, k)
 
     def mem_get_multi (self, realm, k):
         if not isinstance(realm, basestring) or not isinstance(k, basestring):
             raise Exception ("mem_set: realm and key must be string-typed.")
-
-        entries = []
-
-        q = u"memory('%s', '%s', V, S)." % (realm, k)
-        # logging.debug (q)
-        res = self.prolog_query(q)
-        if res:
-            for r in res:
-                score = r[1]
-                v     = r[0]
-                entries.append((v, score))
-
-        return entries
+        self._mem_page_in(realm)
+        return self.mem_store.get_multi(realm, k)
     
     def mem_push (self, realm, k, v):
         if not isinstance(realm, basestring) or not isinstance(k, basestring):
             raise Exception ("mem_set: realm and key must be string-typed.")
+        self._mem_page_in(realm)
+        self.mem_store.push(realm, k, v)
 
-        entries = [(1.0, v)]
+    def _mem_mirror(self):
 
-        # re-score existing entries
+        """ lazily bring memory/4 in the prolog KB up to date with the memory store """
 
-        q = u"memory('%s', '%s', V, S)." % (realm, k)
-        # logging.debug (q)
-        res = self.prolog_query(q)
-        if res:
-            for r in res:
-                score = r[1]
-                v     = r[0]
-                if score < 0.125:
-                    continue
-                entries.append((score/2, v))
+        if not self.mem_store.mirror_dirty:
+            return
 
-        # put all entries into the KB
-        q = u"retractall(memory('%s', '%s', _, _))" % (realm, k)
-        for score, v in entries:
-            if v:
-                q += u", assertz(memory('%s', '%s', %s, %f))" % (realm, k, unicode(v), score)
-        q += u'.'
-        # logging.debug (q)
+        # bounded batches of retractall/assertz goals per command
 
-        self.prolog_query(q)
+        goals = []
+        for realm, k in self.mem_store.pop_mirror_dirty():
+
+            if k is None:
+                goals.append(u"retractall(memory('%s', _, _, _))" % realm)
+                for k2, v, score in self.mem_store.dump(realm):
+                    goals.append(u"assertz(memory('%s', '%s', %s, %f))" % (realm, k2, unicode(v), score))
+            else:
+                goals.append(u"retractall(memory('%s', '%s', _, _))" % (realm, k))
+                for v, score in self.mem_store.get_multi(realm, k):
+                    goals.append(u"assertz(memory('%s', '%s', %s, %f))" % (realm, k, unicode(v), score))
+
+            if len(goals) >= MEM_RESTORE_BATCH:
+                self._pyxsb_command(u', '.join(goals) + u'.')
+                goals = []
+
+        if goals:
+            self._pyxsb_command(u', '.join(goals) + u'.')
+
+    def _pyxsb_command(self, cmd):
+
+        # commands issued during a turn count as prolog time, like queries
+
+        if not self.turn:
+            pyxsb_command(cmd)
+            return
+
+        start_time = time.time()
+        pyxsb_command(cmd)
+        self.turn.prolog_command(time.time()-start_time)
+
+    def _pyxsb_query(self, query):
+
+        # queries that may change the KB (directly or through the predicates they call)
+        # are never answered from the turn cache and drop all cached results. memory/4
+        # changes are mirrored lazily, they drop the cache, too.
+
+        cache = self.turn_cache
+        if cache is not None:
+            write = self._kb_write(query)
+            if write or self.mem_store.mirror_dirty:
+                cache.kb.clear()
+            if write:
+                cache = None
+            elif query in cache.kb:
+                return list(cache.kb[query])
+
+        self._mem_mirror()
+
+        if not self.turn:
+            res = pyxsb_query(query)
+        else:
+            start_time = time.time()
+            res = pyxsb_query(query)
+            self.turn.prolog(time.time()-start_time)
+
+        if cache is not None:
+            cache.kb[query] = res
+
+        return list(res) if cache is not None else res
 
     def prolog_query(self, query):
         logging.debug ('prolog_query: %s' % query)
-        return pyxsb_query(query)
+        return self._pyxsb_query(query)
 
     def prolog_check(self, query):
         logging.debug ('prolog_check: %s' % query)
-        res = pyxsb_query(query)
+        res = self._pyxsb_query(query)
         return len(res)>0
 
     def prolog_query_one(self, query, idx=0):
         logging.debug ('prolog_query_one: %s' % query)
-        solutions = pyxsb_query(query)
+        solutions = self._pyxsb_query(query)
         if not solutions:
             return None
         return solutions[0][idx]
 
     def prolog_persist(self):
-        """ persist all currently asserted dynamic memory predicates from the prolog KB """
 
-        # q = 'predicate_property(Head, (dynamic)), clause(Head,Bod).'
-        # for r in self.prolog_query(q):
-        #     logging.info(repr(r))
-        #     # print "%s" % repr(r)
+        """ called at the end of each turn, persists memory according to the mem_persist policy """
 
-        self.session.query(model.Mem).delete()
+        self._stage_start(latency.STAGE_PERSIST)
 
-        q = u'memory(REALM, K, V, S).'
-        for r in self.prolog_query(q):
-            # logging.info(repr(r))
+        if self.mem_persist == MEM_PERSIST_TURN:
+            self.mem_flush()
 
-            realm = r[0].name
-            k     = r[1].name
-            v     = xsb_to_json(r[2])
-            score = r[3]
+        elif self.mem_persist == MEM_PERSIST_PERIODIC:
+            self._mem_flush_periodic()
 
-            m = model.Mem(realm=realm, k=k, v=v, score=score)
-            self.session.add(m)
+        self._mem_evict_idle()
 
-        # import pdb; pdb.set_trace()
-        self.session.commit()
+        self._stage_stop()
+
+    def idle(self):
+
+        """ call regularly while waiting for input (e.g. from the audio loop): without it, the
+            periodic policy only flushes at the end of a turn, so a kernal that stays idle keeps
+            dirty memory longer than mem_flush_interval """
+
+        if self.mem_persist == MEM_PERSIST_PERIODIC:
+            self._mem_flush_periodic()
+
+        self._mem_evict_idle()
+
+    def _mem_flush_periodic(self):
+
+        if (len(self.mem_store.dirty) >= self.mem_flush_batch) or \
+           (time.time() - self.mem_last_flush >= self.mem_flush_interval):
+            self.mem_flush()
+
+    def mem_flush(self, realms=None):
+
+        """ write changed (realm, k) memory entries (of realms, if given) to the db """
+
+        start_time = time.time()
+        if realms is None:
+            self.mem_last_flush = start_time
+
+        if not self.mem_store.dirty:
+            return
+
+        dirty = list(self.mem_store.pop_dirty(realms))
+
+        for i in range(0, len(dirty), self.mem_flush_batch):
+
+            try:
+                rows = []
+
+                for realm, k in dirty[i:i+self.mem_flush_batch]:
+
+                    if k is None:
+                        self.session.query(model.Mem).filter(model.Mem.realm==realm).delete()
+                        for k2, v, score in self.mem_store.dump(realm):
+                            rows.append({'realm': realm, 'k': k2, 'v': xsb_to_json(v), 'score': score})
+
+                    else:
+                        self.session.query(model.Mem).filter(model.Mem.realm==realm, model.Mem.k==k).delete()
+                        for v, score in self.mem_store.get_multi(realm, k):
+                            rows.append({'realm': realm, 'k': k, 'v': xsb_to_json(v), 'score': score})
+
+                if rows:
+                    self.session.execute(model.Mem.__table__.insert(), rows)
+
+                self.session.commit()
+
+            except:
+                # keys not written yet stay dirty, the next flush retries them
+                self.session.rollback()
+                self.mem_store.dirty.update(dirty[i:])
+                raise
+
+        logging.debug ('mem_flush: %d keys flushed, took %fs' % (len(dirty), time.time() - start_time))
 
     # FIXME: this will work only on the first call
     def setup_uttclass_model (self, restore=True):
@@ -922,6 +1717,7 @@ class AIKernal(object):
 
     def uttclass_train (self, num_epochs=DEFAULT_NUM_EPOCHS, incremental=False):
 
+        self._check_training_data()
         self.setup_uttclass_model (restore=incremental)
         self.uttclass_model.train (num_epochs, incremental)
 
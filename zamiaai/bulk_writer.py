@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# bulk writer for skill compilation output
+#
+# skill compilation produces millions of rows. Instead of creating an ORM
+# object per row (all of which stay in the session's identity map until the
+# final commit), rows are buffered as plain tuples per table and written in
+# batches through a single Core executemany insert.
+#
+
+import logging
+
+from collections import OrderedDict
+
+DEFAULT_BULK_BATCH_SIZE = 10000
+
+class BulkWriter(object):
+
+    def __init__(self, session, batch_size=DEFAULT_BULK_BATCH_SIZE):
+
+        self.session    = session
+        self.batch_size = batch_size
+
+        self.columns    = {}            # table -> column names
+        self.pending    = OrderedDict() # table -> [row tuple, ...]
+        self.depends    = {}            # table -> tables to flush before it
+
+        self.cnt_rows   = 0
+
+    def add(self, table, columns, row):
+
+        """ buffer row (tuple of values for columns) for table, flush once batch_size rows are pending """
+
+        rows = self.pending.get(table)
+        if rows is None:
+            self.columns[table] = columns
+            rows = []
+            self.pending[table] = rows
+
+        rows.append(row)
+
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def set_dependencies(self, table, tables):
+
+        """ rows of table refer to rows of tables, those always get written first """
+
+        self.depends[table] = tables
+
+    def discard(self):
+
+        """ drop all pending rows """
+
+        self.pending = OrderedDict()
+
+    def flush(self, table=None):
+
+        """ write pending rows of table (all tables if None) """
+
+        tables = [table] if table is not None else list(self.pending)
+
+        for t in tables:
+
+            for dep in self.depends.get(t, []):
+                self.flush(dep)
+
+            rows = self.pending.pop(t, None)
+            if not rows:
+                continue
+
+            columns = self.columns[t]
+            self.session.execute(t.insert(), [ dict(zip(columns, row)) for row in rows ])
+
+            self.cnt_rows += len(rows)
+            logging.debug ('bulk writer: %d rows written to %s (%d total)' % (len(rows), t.name, self.cnt_rows))
+
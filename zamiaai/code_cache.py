@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# compiled code cache
+#
+# skill response functions live in the code table as python source, keyed
+# by the md5 sum of that source. This cache compiles each entry once into
+# a function object so executing a response becomes a plain function call.
+#
+
+from collections import OrderedDict
+
+DEFAULT_CODE_CACHE_SIZE = 1024
+
+class CodeCache(object):
+
+    def __init__(self, dte, namespace, max_size=DEFAULT_CODE_CACHE_SIZE):
+
+        self.dte       = dte
+        self.namespace = namespace # globals the compiled functions will see
+        self.max_size  = max_size
+
+        self.fns       = OrderedDict() # md5s -> function obj, LRU order
+
+        self.hits      = 0
+        self.misses    = 0
+
+    def compile(self, md5s, code_fn, code_src):
+
+        l = {}
+        exec (compile(code_src, '<code %s>' % md5s, 'exec'), self.namespace, l)
+
+        if not code_fn in l:
+            raise Exception ('Code %s does not define function %s.' % (md5s, code_fn))
+
+        return l[code_fn]
+
+    def lookup(self, md5s, code=None):
+
+        """ return callable for code md5s, compile it on first use.
+            code: (fn, source) if the caller already fetched it, saves the lookup """
+
+        fn = self.fns.pop(md5s, None)
+        if fn is not None:
+            self.hits += 1
+            self.fns[md5s] = fn
+            return fn
+
+        self.misses += 1
+
+        if code is None:
+            code = self.dte.lookup_code(md5s)
+        code_fn, code_src = code
+        fn = self.compile(md5s, code_fn, code_src)
+
+        self.fns[md5s] = fn
+        while len(self.fns) > self.max_size:
+            self.fns.popitem(last=False)
+
+        return fn
+
+    def clear(self):
+        self.fns = OrderedDict()
+
+    def get_stats(self):
+        return self.hits, self.misses, len(self.fns)
+
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# compact training data schema
+#
+# training_data repeats lang, skill, the source file path and the args json
+# in every row and indexes inp as text. compact_training_data stores integer
+# ids into td_lang, td_skill, td_location and td_args instead, lookups go
+# through a signed 64 bit hash of inp (the text is kept to verify matches).
+#
+# Both schemas can hold data at the same time, iter_training_data() reads
+# the published rows of both.
+#
+
+import struct
+import hashlib
+import json
+import codecs
+import logging
+import time
+
+from collections         import namedtuple
+
+from sqlalchemy          import select
+
+from zamiaai             import model
+from zamiaai.bulk_writer import BulkWriter, DEFAULT_BULK_BATCH_SIZE
+
+LANG_COLUMNS     = ('id', 'lang')
+SKILL_COLUMNS    = ('id', 'skill')
+LOCATION_COLUMNS = ('id', 'loc_fn', 'loc_line')
+ARGS_COLUMNS     = ('id', 'args')
+CTD_COLUMNS      = ('inp_hash', 'lang_id', 'skill_id', 'generation', 'inp', 'md5s', 'args_id', 'location_id')
+
+# training data row, same layout as data_engine.TD_COLUMNS
+
+TD_FIELDS        = ('lang', 'skill', 'inp', 'md5s', 'args', 'loc_fn', 'loc_line', 'generation')
+
+TDRow            = namedtuple('TDRow', TD_FIELDS)
+
+def inp_hash(inp):
+    return struct.unpack('<q', hashlib.md5(inp.encode('utf8')).digest()[:8])[0]
+
+class CompactWriter(object):
+
+    """ writes training data rows into the compact schema through bulk writer bulk,
+        dictionary ids are assigned here so no round trip per new entry is needed """
+
+    def __init__(self, session, bulk):
+
+        self.session = session
+        self.bulk    = bulk
+
+        # dictionary rows have to be in the db before the rows referring to them
+
+        self.bulk.set_dependencies(model.CompactTrainingData.__table__,
+                                   [ model.TDLang.__table__, model.TDSkill.__table__,
+                                     model.TDLocation.__table__, model.TDArgs.__table__ ])
+
+        self.reset()
+
+    def reset(self):
+
+        """ (re-)load dictionaries, call after changes made elsewhere / rollbacks """
+
+        self.bulk.flush()
+
+        self.dicts   = {}
+        self.next_id = {}
+
+        for cls, key in [ (model.TDLang,     lambda r: r.lang),
+                          (model.TDSkill,    lambda r: r.skill),
+                          (model.TDLocation, lambda r: (r.loc_fn, r.loc_line)),
+                          (model.TDArgs,     lambda r: r.args) ]:
+
+            d       = {}
+            next_id = 1
+            for r in self.session.query(cls):
+                d[key(r)] = r.id
+                next_id   = max(next_id, r.id + 1)
+
+            self.dicts[cls]   = d
+            self.next_id[cls] = next_id
+
+    def _id(self, cls, columns, key, row):
+
+        d = self.dicts[cls]
+        i = d.get(key)
+        if i is None:
+            i = self.next_id[cls]
+            self.next_id[cls] = i + 1
+            d[key] = i
+            self.bulk.add(cls.__table__, columns, (i, ) + row)
+
+        return i
+
+    def add(self, lang, skill, inp, md5s, args, loc_fn, loc_line, generation):
+
+        """ args: json string, like in training_data """
+
+        lang_id     = self._id(model.TDLang,     LANG_COLUMNS,     lang,              (lang, ))
+        skill_id    = self._id(model.TDSkill,    SKILL_COLUMNS,    skill,             (skill, ))
+        location_id = self._id(model.TDLocation, LOCATION_COLUMNS, (loc_fn, loc_line), (loc_fn, loc_line))
+        args_id     = self._id(model.TDArgs,     ARGS_COLUMNS,     args,              (args, ))
+
+        self.bulk.add(model.CompactTrainingData.__table__, CTD_COLUMNS,
+                      (inp_hash(inp), lang_id, skill_id, generation, inp, md5s, args_id, location_id))
+
+def _compact_query(session, generation=None, skill=None):
+
+    CTD = model.CompactTrainingData
+
+    q = session.query(model.TDLang.lang, model.TDSkill.skill, CTD.inp, CTD.md5s, model.TDArgs.args,
+                      model.TDLocation.loc_fn, model.TDLocation.loc_line, CTD.generation) \
+               .join(model.TDLang,     model.TDLang.id==CTD.lang_id) \
+               .join(model.TDSkill,    model.TDSkill.id==CTD.skill_id) \
+               .join(model.TDArgs,     model.TDArgs.id==CTD.args_id) \
+               .join(model.TDLocation, model.TDLocation.id==CTD.location_id)
+
+    return model.live(q, CTD, generation, skill)
+
+def lookup(session, lang, inp, generation=None, skill=None):
+
+    """ compact rows matching (lang, inp): list of (lang, inp, md5s, args json, loc_fn, loc_line) """
+
+    CTD = model.CompactTrainingData
+
+    res = []
+    for row in _compact_query(session, generation, skill).filter(CTD.inp_hash==inp_hash(inp)).filter(model.TDLang.lang==lang):
+        if row[2] != inp:
+            continue # hash collision
+        res.append( (lang, inp, row[3], row[4], row[5], row[6]) )
+
+    return res
+
+def lookup_code(session, lang, inp, generation=None, skill=None):
+
+    """ compact rows matching (lang, inp) joined with their code, single statement:
+        list of (md5s, args json, loc_fn, loc_line, code fn, code) """
+
+    CTD = model.CompactTrainingData
+
+    q = session.query(CTD.inp, CTD.md5s, model.TDArgs.args, model.TDLocation.loc_fn, model.TDLocation.loc_line,
+                      model.Code.fn, model.Code.code) \
+               .join(model.TDLang,     model.TDLang.id==CTD.lang_id) \
+               .join(model.TDArgs,     model.TDArgs.id==CTD.args_id) \
+               .join(model.TDLocation, model.TDLocation.id==CTD.location_id) \
+               .join(model.Code,       model.Code.md5s==CTD.md5s)
+    q = model.live(q, CTD, generation, skill).filter(CTD.inp_hash==inp_hash(inp)).filter(model.TDLang.lang==lang)
+
+    return [ tuple(row[1:]) for row in q if row[0] == inp ]
+
+def iter_training_data(session, lang=None, skill=None, grouped=False):
+
+    """ yield TDRow for every published training data row of both schemas.
+        grouped: rows of the same (lang, inp) come in a row (within each schema) """
+
+    TD  = model.TrainingData
+    CTD = model.CompactTrainingData
+
+    q = session.query(*[ getattr(TD, f) for f in TD_FIELDS ])
+    q = model.live(q, TD)
+    if lang:
+        q = q.filter(TD.lang==lang)
+    if skill:
+        q = q.filter(TD.skill==skill)
+    q = q.order_by(TD.lang, TD.inp, TD.id) if grouped else q.order_by(TD.id)
+
+    for row in q.yield_per(10000):
+        yield TDRow(*row)
+
+    q = _compact_query(session)
+    if lang:
+        q = q.filter(model.TDLang.lang==lang)
+    if skill:
+        q = q.filter(model.TDSkill.skill==skill)
+
+    # same hash + lang -> same input, apart from collisions
+    q = q.order_by(CTD.inp_hash, CTD.lang_id, CTD.id) if grouped else q.order_by(CTD.id)
+
+    for row in q.yield_per(10000):
+        yield TDRow(*row)
+
+def gc(session):
+
+    """ drop dictionary entries (args, locations, skills, langs) no compact row refers to anymore,
+        CompactWriters have to be reset afterwards """
+
+    CTD = model.CompactTrainingData
+
+    for cls, column in [ (model.TDArgs,     CTD.args_id),
+                         (model.TDLocation, CTD.location_id),
+                         (model.TDSkill,    CTD.skill_id),
+                         (model.TDLang,     CTD.lang_id) ]:
+        session.query(cls).filter(~cls.id.in_(select([column]))).delete(synchronize_session=False)
+
+def count_training_data(session, lang=None, skill=None):
+
+    """ number of published training data rows in both schemas """
+
+    TD  = model.TrainingData
+    CTD = model.CompactTrainingData
+
+    q = model.live(session.query(TD), TD)
+    if lang:
+        q = q.filter(TD.lang==lang)
+    if skill:
+        q = q.filter(TD.skill==skill)
+    cnt = q.count()
+
+    q = model.live(session.query(CTD), CTD)
+    if lang:
+        q = q.join(model.TDLang, model.TDLang.id==CTD.lang_id).filter(model.TDLang.lang==lang)
+    if skill:
+        q = q.join(model.TDSkill, model.TDSkill.id==CTD.skill_id).filter(model.TDSkill.skill==skill)
+
+    return cnt + q.count()
+
+def _live_generations():
+    return select([model.SkillGeneration.generation])
+
+def migrate(session, reverse=False, batch_size=DEFAULT_BULK_BATCH_SIZE):
+
+    """ move published training data from training_data into the compact schema (or back, if reverse is set),
+        returns number of rows moved. commits. """
+
+    start_time = time.time()
+
+    TD  = model.TrainingData
+    CTD = model.CompactTrainingData
+
+    bulk = BulkWriter(session, batch_size=batch_size)
+    cnt  = 0
+
+    if not reverse:
+
+        writer = CompactWriter(session, bulk)
+
+        q = model.live(session.query(*[ getattr(TD, f) for f in TD_FIELDS ]), TD).order_by(TD.id)
+        for row in q.yield_per(10000):
+            writer.add(*row)
+            cnt += 1
+
+        bulk.flush()
+        session.query(TD).filter(TD.generation.in_(_live_generations())).delete(synchronize_session=False)
+
+    else:
+
+        q = _compact_query(session).order_by(CTD.id)
+        for row in q.yield_per(10000):
+            bulk.add(TD.__table__, TD_FIELDS, tuple(row))
+            cnt += 1
+
+        bulk.flush()
+        session.query(CTD).filter(CTD.generation.in_(_live_generations())).delete(synchronize_session=False)
+        gc(session)
+
+    session.commit()
+
+    logging.info ('%d training data rows migrated to the %s schema, took %fs' %
+                  (cnt, 'wide' if reverse else 'compact', time.time()-start_time))
+
+    return cnt
+
+def export_jsonl(session, fn, lang=None, skill=None):
+
+    """ write published training data of both schemas to fn, one json object per line. returns row count """
+
+    cnt = 0
+
+    with codecs.open(fn, 'w', 'utf8') as f:
+        for row in iter_training_data(session, lang=lang, skill=skill):
+            d = row._asdict()
+            d['args'] = json.loads(row.args) if row.args else None
+            del d['generation']
+            f.write(json.dumps(d) + u'\n')
+            cnt += 1
+
+    logging.info ('%d training data rows exported to %s' % (cnt, fn))
+
+    return cnt
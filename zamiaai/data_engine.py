@@ -35,25 +35,86 @@ import codegen
 import hashlib
 import ast
 import inspect
+import random
+import time
 
 from copy                import copy, deepcopy
 from io                  import StringIO
 
+from sqlalchemy          import select, union, bindparam, or_, and_, String
 from nltools.tokenizer   import tokenize
 from zamiaai             import model
+from zamiaai.bulk_writer import BulkWriter, DEFAULT_BULK_BATCH_SIZE
+from zamiaai             import compact_schema
+from zamiaai             import ner_index
+
+# compiled pattern segment types
+
+SEG_LITERAL = 0
+SEG_EMPTY   = 1
+SEG_MACRO   = 2
+
+# bulk writer row layouts, generation always comes last
+
+TD_COLUMNS   = ('lang', 'skill', 'inp', 'md5s', 'args', 'loc_fn', 'loc_line', 'generation')
+TC_COLUMNS   = ('lang', 'skill', 'name', 'prep_code', 'prep_fn', 'rounds', 'loc_fn', 'loc_line', 'generation')
+NER_COLUMNS  = ('lang', 'skill', 'cls', 'entity', 'label', 'generation')
+NM_COLUMNS   = ('lang', 'skill', 'name', 'soln', 'generation')
+CODE_COLUMNS = ('md5s', 'skill', 'code', 'fn')
+PD_COLUMNS   = ('lang', 'skill', 'pattern', 'md5s', 'args', 'loc_fn', 'loc_line', 'generation')
+NERM_COLUMNS = ('lang', 'skill', 'name', 'cls', 'generation')
+NERI_COLUMNS = ('lang', 'skill', 'cls', 'data', 'generation')
+
+# tables holding per-generation skill data
+
+GENERATION_TABLES = [ model.TrainingData, model.PatternData, model.TestCase, model.NERData, model.NERMacro, model.NamedMacro,
+                      model.NERIndexData ]
 
 class DataEngine(object):
 
-    def __init__(self, session):
+    def __init__(self, session, batch_size=DEFAULT_BULK_BATCH_SIZE):
         self.session           = session
+        self.bulk              = BulkWriter(session, batch_size=batch_size)
 
         self.prefixes          = []
         self.data_skill_name  = None
+        self.generation        = None # generation being compiled, published by publish()
         self.source_location   = ('unknown', 0)
 
         self.cnt_dt            = 0
         self.cnt_ts            = 0
 
+        self.index             = None # optional in-memory exact match index
+        self.matcher           = None # optional pattern matcher
+        self.pattern_mode      = False # store dt() patterns for the matcher instead of expanding them
+        self.compact           = None  # compact_schema.CompactWriter if training data goes into the compact schema
+
+        self.pattern_cache     = {}
+        self.token_cache       = {}
+
+        self.macro_cache       = {}   # (lang, name) -> list of solutions
+        self.used_macros       = set() # (lang, name) of named macros looked up during compilation
+
+        self.max_expansions    = 0     # cap per dt() call, 0: no cap
+        self.estimate          = False # estimate mode: count expansions only, do not generate training data
+        self.estimates         = []    # (count, generated count, skill, lang, pattern, loc_fn, loc_line)
+        self.known_codes       = None # set of md5s in the code table, loaded on first store_code
+
+        self.lookup_stmt       = None  # prepared joined training data + code lookup, see lookup_data_train_code
+        self.compiled_cache    = {}    # sqlalchemy compiled statement cache for it
+
+    def set_index(self, index):
+        self.index = index
+
+    def set_matcher(self, matcher):
+        self.matcher = matcher
+
+    def set_pattern_mode(self, pattern_mode):
+        self.pattern_mode = pattern_mode
+
+    def set_compact_schema(self, compact):
+        self.compact = compact_schema.CompactWriter(self.session, self.bulk) if compact else None
+
     def get_stats(self):
         return self.cnt_dt, self.cnt_ts
 
@@ -61,8 +122,21 @@ class DataEngine(object):
         raise Exception ("%s: error in line %d: %s" % (self.source_location[0], self.source_location[1], s))
 
     def prepare_compilation (self, skill_name):
-        self.clean(skill_name)
+
+        # rows go into a new generation, the published one stays visible until publish()
+
+        self.bulk.flush()
+
         self.data_skill_name = skill_name
+        self.generation      = self.begin_generation(skill_name)
+
+        self.invalidate_caches()
+
+        self.cnt_dt = 0
+        self.cnt_ts = 0
+
+        self.pattern_cache   = {} # (lang, txt) -> compiled pattern
+        self.token_cache     = {} # (s, lang, keep_punctuation) -> tokens
 
     def compute_named_macros(self):
         self.named_macros = {}
@@ -77,18 +151,143 @@ class DataEngine(object):
 
     def clean (self, skill_name):
 
+        """ remove all generations of skill_name """
+
+        self.bulk.flush()
+
         logging.debug("Clearing %s ..." % skill_name)
-        self.session.query(model.TrainingData).filter(model.TrainingData.skill==skill_name).delete()
-        self.session.query(model.Code).filter(model.Code.skill==skill_name).delete()
-        self.session.query(model.TestCase).filter(model.TestCase.skill==skill_name).delete()
-        self.session.query(model.NERData).filter(model.NERData.skill==skill_name).delete()
-        self.session.query(model.NamedMacro).filter(model.NamedMacro.skill==skill_name).delete()
+        for cls in GENERATION_TABLES:
+            self.session.query(cls).filter(cls.skill==skill_name).delete()
+        skill_ids = select([model.TDSkill.id]).where(model.TDSkill.skill==skill_name)
+        self.session.query(model.CompactTrainingData).filter(model.CompactTrainingData.skill_id.in_(skill_ids)) \
+                                                     .delete(synchronize_session=False)
+        self.session.query(model.Generation).filter(model.Generation.skill==skill_name).delete()
+        self.session.query(model.SkillGeneration).filter(model.SkillGeneration.skill==skill_name).delete()
+        self.session.query(model.SkillFingerprint).filter(model.SkillFingerprint.skill==skill_name).delete()
+        self._gc_code()
         logging.debug("Clearing %s ... done." % skill_name)
 
+        self.invalidate_caches()
+
         self.cnt_dt = 0
         self.cnt_ts = 0
 
+    #
+    # generations: compilation writes into a new generation of the skill's rows
+    # while readers keep using the published one, publish() switches the
+    # skill_generation pointer in a single transaction.
+    #
+
+    def begin_generation (self, skill_name):
+
+        now = time.time()
+
+        # generations of earlier compilations which never got published are abandoned
+
+        published = self.session.query(model.SkillGeneration).filter(model.SkillGeneration.skill==skill_name).first()
+
+        q = self.session.query(model.Generation).filter(model.Generation.skill==skill_name) \
+                                                .filter(model.Generation.superseded==None)
+        if published:
+            q = q.filter(model.Generation.id!=published.generation)
+        q.update({'superseded': now}, synchronize_session=False)
+
+        gen = model.Generation(skill=skill_name, ts=now)
+        self.session.add(gen)
+        self.session.flush()
+
+        logging.debug('skill %s: generation %d' % (skill_name, gen.id))
+
+        return gen.id
+
+    def publish (self, commit=True):
+
+        """ make the generation compiled since prepare_compilation visible """
+
+        self.bulk.flush()
+
+        skill_name = self.data_skill_name
+        now        = time.time()
+
+        self.session.query(model.Generation).filter(model.Generation.skill==skill_name) \
+                                            .filter(model.Generation.id!=self.generation) \
+                                            .filter(model.Generation.superseded==None) \
+                                            .update({'superseded': now}, synchronize_session=False)
+
+        self.session.merge(model.SkillGeneration(skill=skill_name, generation=self.generation))
+
+        if commit:
+            self.session.commit()
+
+        logging.debug('skill %s: generation %d published' % (skill_name, self.generation))
+
+        self.generation = None
+
+    def gc_generations (self, min_age=0.0):
+
+        """ delete rows of generations superseded more than min_age seconds ago
+            (serving processes may still be reading them until their next generation check), commits """
+
+        self.bulk.flush()
+
+        gens = [ gen for gen, in self.session.query(model.Generation.id) \
+                                             .filter(model.Generation.superseded!=None) \
+                                             .filter(model.Generation.superseded<=time.time()-min_age) ]
+
+        for i in range(0, len(gens), 500):
+            chunk = gens[i:i+500]
+            for cls in GENERATION_TABLES + [ model.CompactTrainingData ]:
+                self.session.query(cls).filter(cls.generation.in_(chunk)).delete(synchronize_session=False)
+            self.session.query(model.Generation).filter(model.Generation.id.in_(chunk)).delete(synchronize_session=False)
+
+        if gens:
+            self._gc_code()
+
+        self.session.commit()
+        self.invalidate_caches()
+
+        logging.info ('%d old generations removed.' % len(gens))
+
+        return len(gens)
+
+    def _gc_code (self):
+
+        # code is shared between skills and generations, drop what nothing refers to anymore
+
+        used = union(select([model.TrainingData.md5s]), select([model.PatternData.md5s]),
+                     select([model.CompactTrainingData.md5s]))
+        unused = set([ m for m, in self.session.query(model.Code.md5s).filter(~model.Code.md5s.in_(used)) ])
+
+        # test round actions are referenced from the test_case.rounds json only
+
+        for rounds, in self.session.query(model.TestCase.rounds):
+            for r in json.loads(rounds):
+                unused.discard(r[2])
+
+        unused = list(unused)
+        for i in range(0, len(unused), 500):
+            self.session.query(model.Code).filter(model.Code.md5s.in_(unused[i:i+500])).delete(synchronize_session=False)
+
+        compact_schema.gc(self.session)
+
+        self.known_codes = None
+
+    def _live (self, q, cls):
+        return model.live(q, cls, self.generation, self.data_skill_name)
+
+    def invalidate_caches(self):
+
+        """ drop cached db contents (named macros, known codes), call after db changes made elsewhere / rollbacks """
+
+        self.macro_cache = {}
+        self.known_codes = None
+        self.used_macros = set()
+
+        if self.compact:
+            self.compact.reset()
+
     def commit(self):
+        self.bulk.flush()
         self.session.commit()
 
     def store_code(self, code_src, code_fn):
@@ -96,22 +295,103 @@ class DataEngine(object):
         md5.update (code_src)
         md5s = md5.hexdigest()
 
-        if not self.session.query(model.Code).filter(model.Code.md5s==md5s).first():
-            cd = model.Code(md5s=md5s, skill=self.data_skill_name, code=code_src, fn=code_fn)
-            self.session.add(cd)
+        if self.known_codes is None:
+            self.known_codes = set([ m for m, in self.session.query(model.Code.md5s) ])
+
+        if not md5s in self.known_codes:
+            self.bulk.add(model.Code.__table__, CODE_COLUMNS, (md5s, self.data_skill_name, code_src, code_fn))
+            self.known_codes.add(md5s)
+
         return md5s
 
     def lookup_code(self, md5s):
+        if self.index:
+            res = self.index.lookup_code(md5s)
+            if res:
+                return res
+        self.bulk.flush(model.Code.__table__)
         cd = self.session.query(model.Code).filter(model.Code.md5s==md5s).first()
         if not cd:
             raise Exception ('Code %s not found.' % md5s)
         return cd.fn, cd.code
 
     def lookup_data_train(self, inp, lang):
+
+        if self.index:
+            res = self.index.lookup(lang, inp)
+
+        else:
+            self.bulk.flush()
+
+            res = []
+
+            q = self._live(self.session.query(model.TrainingData), model.TrainingData)
+            for td in q.filter(model.TrainingData.lang==lang).filter(model.TrainingData.inp==inp):
+                res.append( (lang, inp, td.md5s, json.loads(td.args), td.loc_fn, td.loc_line) )
+
+            if self.compact:
+                for l, i, md5s, args, loc_fn, loc_line in compact_schema.lookup(self.session, lang, inp, self.generation, self.data_skill_name):
+                    res.append( (lang, inp, md5s, json.loads(args), loc_fn, loc_line) )
+
+        if self.matcher:
+            res = res + self.matcher.lookup(lang, inp)
+
+        return res
+
+    def _lookup_stmt(self):
+
+        # built once, executed with bind params only: sqlalchemy compiles it a single
+        # time (compiled_cache), the dbapi driver keeps the prepared statement around.
+        # generation is the one being compiled, if any, skill the one it belongs to
+        # (its published generation is hidden then, None while not compiling).
+
+        if self.lookup_stmt is None:
+
+            td = model.TrainingData.__table__
+            cd = model.Code.__table__
+            sg = model.SkillGeneration.__table__
+
+            self.lookup_stmt = select([ td.c.md5s, td.c.args, td.c.loc_fn, td.c.loc_line, cd.c.fn, cd.c.code ]) \
+                                 .select_from(td.join(cd, cd.c.md5s==td.c.md5s)
+                                                .outerjoin(sg, sg.c.generation==td.c.generation)) \
+                                 .where(td.c.inp==bindparam('inp')) \
+                                 .where(td.c.lang==bindparam('lang')) \
+                                 .where(or_(and_(sg.c.skill!=None,
+                                                 or_(bindparam('skill', type_=String)==None,
+                                                     sg.c.skill!=bindparam('skill', type_=String))),
+                                            td.c.generation==bindparam('generation')))
+
+        return self.lookup_stmt
+
+    def lookup_data_train_code(self, inp, lang):
+
+        """ like lookup_data_train, but each match comes with its code: (lang, inp, md5s, args, loc_fn, loc_line, code_fn, code).
+            training data + code are fetched in a single statement. """
+
         res = []
 
-        for td in self.session.query(model.TrainingData).filter(model.TrainingData.lang==lang).filter(model.TrainingData.inp==inp):
-            res.append( (lang, inp, td.md5s, json.loads(td.args), td.loc_fn, td.loc_line) )
+        if self.index:
+            for lang, inp, md5s, args, loc_fn, loc_line in self.index.lookup(lang, inp):
+                code_fn, code = self.lookup_code(md5s)
+                res.append( (lang, inp, md5s, args, loc_fn, loc_line, code_fn, code) )
+
+        else:
+            self.bulk.flush()
+
+            conn = self.session.connection().execution_options(compiled_cache=self.compiled_cache)
+            for md5s, args, loc_fn, loc_line, code_fn, code in conn.execute(self._lookup_stmt(),
+                                                                            inp=inp, lang=lang, generation=self.generation,
+                                                                            skill=self.data_skill_name if self.generation is not None else None):
+                res.append( (lang, inp, md5s, json.loads(args), loc_fn, loc_line, code_fn, code) )
+
+            if self.compact:
+                for md5s, args, loc_fn, loc_line, code_fn, code in compact_schema.lookup_code(self.session, lang, inp, self.generation, self.data_skill_name):
+                    res.append( (lang, inp, md5s, json.loads(args), loc_fn, loc_line, code_fn, code) )
+
+        if self.matcher:
+            for lang, inp, md5s, args, loc_fn, loc_line in self.matcher.lookup(lang, inp):
+                code_fn, code = self.lookup_code(md5s)
+                res.append( (lang, inp, md5s, args, loc_fn, loc_line, code_fn, code) )
 
         return res
 
@@ -119,24 +399,61 @@ class DataEngine(object):
 
         # import pdb; pdb.set_trace()
 
-        nm = model.NamedMacro(lang   = lang,
-                              skill = self.data_skill_name,
-                              name   = name,
-                              soln   = json.dumps(soln))
-        self.session.add(nm)
+        self.bulk.add(model.NamedMacro.__table__, NM_COLUMNS,
+                      (lang, self.data_skill_name, name, json.dumps(soln), self.generation))
+
+        self.macro_cache.pop((lang, name), None)
 
     def lookup_named_macro (self, lang, name):
 
+        """ list of solutions of named macro, cached until macro() adds to it. Callers must not modify them. """
+
+        # recorded even without solutions: implicit macro names are looked up here first,
+        # a named macro of that name defined later changes the expansion
+
+        key = (lang, name)
+        self.used_macros.add(key)
+
+        if key in self.macro_cache:
+            return self.macro_cache[key]
+
+        self.bulk.flush(model.NamedMacro.__table__)
+
         res = []
 
-        for nm in self.session.query(model.NamedMacro).filter(model.NamedMacro.lang==lang).filter(model.NamedMacro.name==name):
+        q = self._live(self.session.query(model.NamedMacro), model.NamedMacro)
+        for nm in q.filter(model.NamedMacro.lang==lang).filter(model.NamedMacro.name==name).order_by(model.NamedMacro.id):
             res.append(json.loads(nm.soln))
 
+        self.macro_cache[key] = res
+
         return res
 
-    def _expand_macros (self, lang, txt):
+    def _tokenize (self, s, lang, keep_punctuation=True):
 
-        logging.debug(u"expand macros  : %s" % txt)
+        """ memoized tokenize(), patterns and macro values keep coming back across dt() calls and prefixes """
+
+        key = (s, lang, keep_punctuation)
+        tokens = self.token_cache.get(key)
+        if tokens is None:
+            tokens = tokenize(s, lang=lang, keep_punctuation=keep_punctuation)
+            self.token_cache[key] = tokens
+        return tokens
+
+    def _macro_tokens (self, lang, v):
+        if isinstance (v, basestring):
+            return self._tokenize(v, lang)
+        return v
+
+    def _compile_pattern (self, lang, txt):
+
+        """ parse pattern txt into (segments, implicit macros), cached per (lang, txt) """
+
+        key = (lang, txt)
+        if key in self.pattern_cache:
+            return self.pattern_cache[key]
+
+        # implicit macros: (a|b|c) -> {MACRO_n:W}
 
         implicit_macros = {}
 
@@ -152,18 +469,12 @@ class DataEngine(object):
                     self.report_error (') missing')
                 j += i
 
-                # extract macro
-
-                macro_s = txt[i+1:j+1]
-
-                # print "macro_s: %s" % macro_s
-
+                macro_s    = txt[i+1:j+1]
                 macro_name = 'MACRO_%d' % len(implicit_macros)
 
                 implicit_macros[macro_name] = []
                 for s in macro_s.split('|'):
-                    sub_parts = tokenize(s, lang=lang, keep_punctuation=False)
-                    implicit_macros[macro_name].append({'W': sub_parts})
+                    implicit_macros[macro_name].append({'W': self._tokenize(s, lang, keep_punctuation=False)})
 
                 txt2 += '{' + macro_name + ':W}'
 
@@ -173,133 +484,278 @@ class DataEngine(object):
                 txt2 += txt[i]
                 i+=1
 
-        logging.debug ( "implicit macros: %s" % repr(implicit_macros) )
-        logging.debug ( "txt2           : %s" % txt2 )
-
         parts = []
         for p1 in txt2.split('{'):
             for p2 in p1.split('}'):
                 parts.append(p2)
 
-        done = []
+        # segments: literal tokens, 'empty' or macro calls. Every expansion
+        # passes through every segment, so invocation counts per macro name
+        # (and with them the mpos keys) are known up front.
 
-        todo = [ (parts, 0, [], {}, {}) ]
+        segments    = []
+        invocations = {} # macro name -> list of vars used so far
 
-        # import pdb; pdb.set_trace()
-        while len(todo)>0:
+        for cnt, p1 in enumerate(parts):
+
+            if cnt % 2 == 0:
+                segments.append((SEG_LITERAL, self._tokenize(p1, lang, keep_punctuation=False)))
+                continue
 
-            parts1, cnt, r, mpos, macro_rs = todo.pop()
+            sub_parts = p1.split(':')
 
-            if cnt >= len(parts1):
-                done.append((r, mpos))
+            if len(sub_parts) != 2:
+                self.report_error ('syntax error in macro call %s' % repr(p1))
+
+            name, vn = sub_parts
+
+            if name == 'empty':
+                segments.append((SEG_EMPTY, ))
                 continue
 
-            p1 = parts1[cnt]
+            vns = invocations.setdefault(name, [])
+            vns.append(vn)
 
-            if cnt % 2 == 1:
-                
-                sub_parts = p1.split(':')
+            # first invocation picks an alternative, later ones re-use it
+            segments.append((SEG_MACRO, name, vn, '%s_%d' % (name, len(vns)-1), len(vns)==1, frozenset(vns)))
 
-                if len(sub_parts) != 2:
-                    self.report_error ('syntax error in macro call %s' % repr(p1))
+        pattern = (segments, implicit_macros)
+        self.pattern_cache[key] = pattern
 
-                name = sub_parts[0]
+        return pattern
 
-                if name == 'empty':
-                    todo.append((parts, cnt+1, copy(r), mpos, copy(macro_rs)))
-                else:
+    def _resolve_macro (self, lang, name, implicit_macros):
 
-                    vn    = sub_parts[1]
+        macro = self.lookup_named_macro(lang, name)
+        if not macro:
+            macro = implicit_macros.get(name, None)
+        if not macro:
+            self.report_error ('unknown macro "%s"[%s] called' % (name, lang))
 
-                    if name in macro_rs:
-                        macro = [ macro_rs[name] ]
-                    else:
-                        macro = self.lookup_named_macro(lang, name)
-                        if not macro:
-                            macro = implicit_macros.get(name, None)
-                        if not macro:
-                            self.report_error ('unknown macro "%s"[%s] called' % (name, lang))
+        return macro
 
-                    for r3 in macro:
-                        r1        = copy(r)
-                        mpos1     = copy(mpos)
-                        macro_rs1 = copy(macro_rs)
+    def _expand_macros (self, lang, txt):
 
-                        macro_rs1[name] = r3
+        """ generator yielding (tokens, mpos) for every expansion of txt """
 
-                        # take care of multiple invocactions of the same macro
-        
-                        mpnn = 0
-                        while True:
-                            mpn = '%s_%d_start' % (name, mpnn)
-                            if not mpn in mpos1:
-                                break
-                            mpnn += 1
-
-                        mpos1['%s_%d_start' % (name, mpnn)] = len(r1)
-                        s3 = r3[vn]
-                        if isinstance (s3, basestring):
-                            s3 = tokenize (s3, lang=lang)
-                            r3[vn] = s3
-                        r1.extend(r3[vn])
-                        mpos1['%s_%d_end' % (name, mpnn)]   = len(r1)
-
-                        for vn3 in r3:
-                            mpos1['%s_%d_%s' % (name, mpnn, vn3.lower())] = r3[vn3]
-
-                        todo.append((parts, cnt+1, r1, mpos1, macro_rs1))
-                        
-                        # if name == 'home_locations':
-                        #     import pdb; pdb.set_trace()
+        logging.debug(u"expand macros  : %s" % txt)
 
-            else:
+        segments, implicit_macros = self._compile_pattern(lang, txt)
+
+        return self._expand_segments(lang, segments, implicit_macros, 0, [], {}, {})
+
+    def _count_expansions (self, lang, txt):
+
+        """ number of expansions of txt, computed without expanding it """
+
+        segments, implicit_macros = self._compile_pattern(lang, txt)
+
+        cnt = 1
+        for seg in segments:
+            if seg[0] == SEG_MACRO and seg[4]:
+                cnt *= len(self._resolve_macro(lang, seg[1], implicit_macros))
+
+        return cnt
+
+    def _sample_choices (self, lang, txt, k):
+
+        """ deterministic sample of at least k macro alternative combinations of txt (or all of them if there
+            are fewer). every alternative of every macro is covered at least once, so there may be more than k.
+            returns list of segment idx -> alternative idx dicts """
+
+        segments, implicit_macros = self._compile_pattern(lang, txt)
+
+        slots = [] # (segment idx, number of alternatives) per macro choice point
+        total = 1
+        for cnt, seg in enumerate(segments):
+            if seg[0] == SEG_MACRO and seg[4]:
+                n = len(self._resolve_macro(lang, seg[1], implicit_macros))
+                slots.append((cnt, n))
+                total *= n
+
+        choices = set()
+
+        # coverage: alternative t % n of every slot for t in 0..max(n)-1
+
+        n_cover = max([ n for cnt, n in slots ] + [1])
+        for t in range(n_cover):
+            choices.add(tuple([ t % n for cnt, n in slots ]))
+
+        # fill up with random combinations, seeded by the pattern for reproducible compiles
+
+        rnd = random.Random(int(hashlib.md5(txt.encode('utf8')).hexdigest()[:8], 16))
+        while len(choices) < min(k, total):
+            idx = rnd.randrange(total)
+            c   = []
+            for cnt, n in slots:
+                c.append(idx % n)
+                idx //= n
+            choices.add(tuple(c))
+
+        return [ dict(zip([ cnt for cnt, n in slots ], c)) for c in sorted(choices) ]
+
+    def _sample_expansions (self, lang, txt, k):
+
+        """ generator yielding (tokens, mpos) for a stratified sample of txt's expansions, see _sample_choices """
+
+        segments, implicit_macros = self._compile_pattern(lang, txt)
+
+        for choice in self._sample_choices(lang, txt, k):
+            for res in self._expand_segments(lang, segments, implicit_macros, 0, [], {}, {}, choice):
+                yield res
+
+    def _expand_segments (self, lang, segments, implicit_macros, cnt, r, mpos, macro_rs, choice=None):
+
+        # r, mpos and macro_rs are shared by all branches: tokens get truncated
+        # on backtracking, mpos/macro_rs entries are overwritten by every branch
+        # passing through the same segment. Copies are made at the leaves only.
+        #
+        # choice: segment idx -> alternative idx, restricts expansion to a single combination
+
+        if cnt >= len(segments):
+            yield list(r), dict(mpos)
+            return
+
+        seg = segments[cnt]
+
+        if seg[0] == SEG_LITERAL:
 
-                sub_parts = tokenize(p1, lang=lang, keep_punctuation=False)
+            l = len(r)
+            r.extend(seg[1])
+            for res in self._expand_segments(lang, segments, implicit_macros, cnt+1, r, mpos, macro_rs, choice):
+                yield res
+            del r[l:]
+            return
 
-                r  = copy(r)
-                r.extend(sub_parts)
+        if seg[0] == SEG_EMPTY:
+            for res in self._expand_segments(lang, segments, implicit_macros, cnt+1, r, mpos, macro_rs, choice):
+                yield res
+            return
 
-                todo.append((parts, cnt+1, r, mpos, macro_rs))
+        _, name, vn, mpn, first, tok_vars = seg
 
-        return done
+        if first:
+            macro = self._resolve_macro(lang, name, implicit_macros)
+            if choice is not None:
+                macro = [ macro[choice[cnt]] ]
+        else:
+            macro = [ macro_rs[name] ]
+
+        l = len(r)
+
+        # reversed: keeps the order the original work-list based expander produced
+
+        for r3 in reversed(macro):
+
+            macro_rs[name] = r3
+
+            mpos[mpn + '_start'] = l
+            r.extend(self._macro_tokens(lang, r3[vn]))
+            mpos[mpn + '_end']   = len(r)
+
+            for vn3 in r3:
+                v = r3[vn3]
+                if vn3 in tok_vars:
+                    v = self._macro_tokens(lang, v)
+                mpos['%s_%s' % (mpn, vn3.lower())] = v
+
+            for res in self._expand_segments(lang, segments, implicit_macros, cnt+1, r, mpos, macro_rs, choice):
+                yield res
+
+            del r[l:]
 
     def set_prefixes (self, prefixes):
         self.prefixes = prefixes
 
-    def generate_training_data (self, lang, inps, md5s, code_fn, args):
+    def set_max_expansions (self, max_expansions):
+        self.max_expansions = max_expansions
+
+    def generate_training_data (self, lang, inps, md5s, code_fn, args, max_expansions=None):
 
         prefixes = self.prefixes if self.prefixes else [u'']
 
-        for prefix in prefixes:
+        if self.pattern_mode and not self.estimate:
+
+            # store patterns as they are, the matcher binds args at lookup time
 
+            for prefix in prefixes:
+                for inp in inps:
+                    pinp = prefix + inp
+                    self._compile_pattern(lang, pinp) # syntax check
+                    self.bulk.add(model.PatternData.__table__, PD_COLUMNS,
+                                  (lang, self.data_skill_name, pinp, md5s, json.dumps(args),
+                                   self.src_location[0], self.src_location[1], self.generation))
+                    self.cnt_dt += 1
+            return
+
+        if max_expansions is None:
+            max_expansions = self.max_expansions
+
+        pinps = []
+        for prefix in prefixes:
             for inp in inps:
+                pinps.append(prefix + inp)
+
+        # capped: distribute max_expansions proportionally over all patterns of this dt() call
+
+        quotas = {}
+
+        if max_expansions or self.estimate:
 
-                pinp = prefix + inp
+            counts = [ self._count_expansions(lang, pinp) for pinp in pinps ]
+            total  = sum(counts)
 
-                for d, mpos in self._expand_macros(lang, pinp):
+            for pinp, cnt in zip(pinps, counts):
+                if max_expansions and total > max_expansions:
+                    quotas[pinp] = max(1, int(round(float(max_expansions) * cnt / total)))
 
-                    d_inps = u' '.join(d)
-                    # if d_inps == u'subtract five from eleven':
-                    #     import pdb; pdb.set_trace()
-                    # logging.info(repr(mpos))
+            if max_expansions and total > max_expansions:
+                logging.info ('%s:%d: %d expansions, capped to ~%d' % (self.src_location[0], self.src_location[1], total, max_expansions))
 
-                    if args:
-                        d_args = map(lambda x: mpos[x] if x in mpos else x, args)
+            if self.estimate:
+                for pinp, cnt in zip(pinps, counts):
+                    if pinp in quotas:
+                        n = len(self._sample_choices(lang, pinp, quotas[pinp]))
                     else:
-                        d_args = None
+                        n = cnt
+                    self.estimates.append((cnt, n, self.data_skill_name, lang, pinp, self.src_location[0], self.src_location[1]))
+                    self.cnt_dt += n
+                return
 
-                    td = model.TrainingData(lang     = lang, 
-                                            skill   = self.data_skill_name, 
-                                            inp      = d_inps, 
-                                            md5s     = md5s,
-                                            args     = json.dumps(d_args),
-                                            loc_fn   = self.src_location[0], 
-                                            loc_line = self.src_location[1])
-                    self.session.add(td)
+        for pinp in pinps:
 
-                    self.cnt_dt += 1
-                    if self.cnt_dt % 100 == 0:
-                        logging.info ('%6d training samples extracted so far...' % self.cnt_dt)
+            if pinp in quotas:
+                expansions = self._sample_expansions(lang, pinp, quotas[pinp])
+            else:
+                expansions = self._expand_macros(lang, pinp)
+
+            for d, mpos in expansions:
+
+                d_inps = u' '.join(d)
+                # if d_inps == u'subtract five from eleven':
+                #     import pdb; pdb.set_trace()
+                # logging.info(repr(mpos))
+
+                if args:
+                    d_args = map(lambda x: mpos[x] if x in mpos else x, args)
+                else:
+                    d_args = None
+
+                self.add_training_data(lang, d_inps, md5s, json.dumps(d_args), self.src_location[0], self.src_location[1])
+
+                self.cnt_dt += 1
+                if self.cnt_dt % 100 == 0:
+                    logging.info ('%6d training samples extracted so far...' % self.cnt_dt)
+
+    def add_training_data(self, lang, inp, md5s, args, loc_fn, loc_line):
+
+        """ add training data row (args: json) to the generation being compiled """
+
+        if self.compact:
+            self.compact.add(lang, self.data_skill_name, inp, md5s, args, loc_fn, loc_line, self.generation)
+        else:
+            self.bulk.add(model.TrainingData.__table__, TD_COLUMNS,
+                          (lang, self.data_skill_name, inp, md5s, args, loc_fn, loc_line, self.generation))
 
     def _unindent(self, code):
         lines = code.split('\n')
@@ -319,7 +775,7 @@ class DataEngine(object):
             new_lines.append(line)
         return u'\n'.join(new_lines)
 
-    def dt(self, lang, inps, resp, args=None):
+    def dt(self, lang, inps, resp, args=None, max_expansions=None):
 
         if isinstance (inps, basestring):
             inps = [ inps ]
@@ -361,7 +817,7 @@ class DataEngine(object):
 
         # use macro engine to generate input strings
 
-        self.generate_training_data (lang, inps, md5s, code_fn, args)
+        self.generate_training_data (lang, inps, md5s, code_fn, args, max_expansions=max_expansions)
 
         # import pdb; pdb.set_trace()
  
@@ -426,36 +882,72 @@ class DataEngine(object):
             prep_code = None 
             prep_fn   = None
 
-        tc = model.TestCase(lang      = lang,
-                            skill     = self.data_skill_name,
-                            name      = test_name,
-                            prep_code = prep_code,
-                            prep_fn   = prep_fn,
-                            rounds    = json.dumps(rs),
-                            loc_fn    = self.src_location[0], 
-                            loc_line  = self.src_location[1])
-        self.session.add(tc)
+        self.bulk.add(model.TestCase.__table__, TC_COLUMNS,
+                      (lang, self.data_skill_name, test_name, prep_code, prep_fn, json.dumps(rs),
+                       self.src_location[0], self.src_location[1], self.generation))
 
         self.cnt_ts += 1
 
     def lookup_tests (self, skill_name):
 
+        self.bulk.flush()
+
         data_ts = []
         
-        for ts in self.session.query(model.TestCase).filter(model.TestCase.skill==skill_name).order_by(model.TestCase.name).all():
+        q = self._live(self.session.query(model.TestCase), model.TestCase)
+        for ts in q.filter(model.TestCase.skill==skill_name).order_by(model.TestCase.name).all():
 
             data_ts.append( (ts.name, ts.lang, ts.prep_code, ts.prep_fn, json.loads(ts.rounds), ts.loc_fn, ts.loc_line) )
 
         return data_ts
 
+    def lookup_ner (self, lang, cls):
+
+        """ return list of (entity, label) tuples for NER class cls """
+
+        if self.index:
+            res = self.index.lookup_ner(lang, cls)
+            if res is not None:
+                return res
+
+        self.bulk.flush()
+
+        res = []
+        q = self._live(self.session.query(model.NERData), model.NERData)
+        for nerdata in q.filter(model.NERData.lang==lang).filter(model.NERData.cls==cls).order_by(model.NERData.id):
+            res.append((nerdata.entity, nerdata.label))
+
+        return res
+
+    def ner_macro (self, lang, name, cls):
+
+        """ in pattern mode, macro slots {name:VAR} in patterns of the skill being compiled
+            match the label of every entity of NER class cls """
+
+        self.bulk.add(model.NERMacro.__table__, NERM_COLUMNS, (lang, self.data_skill_name, name, cls, self.generation))
+
+    def build_ner_index (self):
+
+        """ store the NER index (see ner_index.py) of every NER class the skill being compiled defines """
+
+        self.bulk.flush(model.NERData.__table__)
+
+        entries = {}
+        q = self.session.query(model.NERData).filter(model.NERData.generation==self.generation).order_by(model.NERData.id)
+        for nerdata in q:
+            entries.setdefault((nerdata.lang, nerdata.cls), []).append((nerdata.entity, nerdata.label))
+
+        for lang, cls in sorted(entries):
+            nd = ner_index.build(lang, entries[(lang, cls)])
+            self.bulk.add(model.NERIndexData.__table__, NERI_COLUMNS,
+                          (lang, self.data_skill_name, cls, ner_index.encode(nd), self.generation))
+
+        return len(entries)
+
     def ner (self, lang, cls, entity, label):
 
         l_tok = u' '.join(tokenize(label, lang=lang))
 
-        nd = model.NERData(lang   = lang,
-                           skill  = self.data_skill_name,
-                           cls    = cls,
-                           entity = entity,
-                           label  = l_tok)
-        self.session.add(nd)
+        self.bulk.add(model.NERData.__table__, NER_COLUMNS,
+                      (lang, self.data_skill_name, cls, entity, l_tok, self.generation))
 
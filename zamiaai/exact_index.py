@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# in-memory exact match index
+#
+# maps (lang, normalized input) to pre-decoded training data entries so
+# exact matches can be answered without touching the database. Strings,
+# args tuples and entry tuples are interned since millions of expanded
+# utterances share a comparatively small number of them.
+#
+
+import logging
+import json
+import time
+
+from zamiaai                import model
+from zamiaai.compact_schema import iter_training_data
+
+class ExactMatchIndex(object):
+
+    def __init__(self, session):
+
+        self.session = session
+        self.refresh()
+
+    def set_session(self, session):
+
+        """ use session for future refreshes, e.g. in a forked worker process """
+
+        self.session = session
+
+    def _intern(self, o):
+        return self.pool.setdefault(o, o)
+
+    def _decode_args(self, args_json):
+
+        if not args_json in self.args_pool:
+            self.args_pool[args_json] = json.loads(args_json)
+        return self.args_pool[args_json]
+
+    def refresh(self):
+
+        """ (re-)build index from training data + code tables, call after compile_skill """
+
+        start_time = time.time()
+
+        self.pool      = {} # str -> str
+        self.args_pool = {} # args json -> decoded args
+        self.entries   = {} # (md5s, args json, loc_fn, loc_line) -> entry tuple
+        self.data      = {} # lang -> inp -> tuple of entries (list while building)
+        self.code      = {} # md5s -> (fn, code)
+
+        for cd in self.session.query(model.Code):
+            self.code[self._intern(cd.md5s)] = (self._intern(cd.fn), cd.code)
+
+        cnt = 0
+        for lang, skill, inp, md5s, args, loc_fn, loc_line, generation in iter_training_data(self.session):
+
+            if not lang in self.data:
+                self.data[lang] = {}
+            ld = self.data[lang]
+
+            ek = (md5s, args, loc_fn, loc_line)
+            entry = self.entries.get(ek)
+            if entry is None:
+                entry = (self._intern(md5s), self._decode_args(args), self._intern(loc_fn), loc_line)
+                self.entries[ek] = entry
+
+            entries = ld.get(inp)
+            if entries is None:
+                ld[inp] = [ entry ]
+            else:
+                entries.append(entry)
+
+            cnt += 1
+
+        # lists while building, tuples are smaller
+
+        for ld in self.data.values():
+            for inp in ld:
+                ld[inp] = tuple(ld[inp])
+
+        logging.info ('exact match index: %d training samples, %d distinct entries, %d codes, took %fs' %
+                      (cnt, len(self.entries), len(self.code), time.time()-start_time))
+
+        # interning tables are only needed while building
+
+        self.pool      = {}
+        self.args_pool = {}
+        self.entries   = {}
+
+    def lookup(self, lang, inp):
+
+        res = []
+
+        ld = self.data.get(lang)
+        if ld:
+            for md5s, args, loc_fn, loc_line in ld.get(inp, ()):
+                res.append( (lang, inp, md5s, args, loc_fn, loc_line) )
+
+        return res
+
+    def lookup_code(self, md5s):
+        return self.code.get(md5s)
+
+    def lookup_ner(self, lang, cls):
+        return None # not covered by this index
+
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# per-turn latency instrumentation
+#
+# the kernal fills in one TurnRecord per process_input call (wall time per
+# stage plus prolog query/command count and time) and hands it to all
+# registered sinks
+#
+
+import time
+import json
+import math
+import codecs
+
+STAGE_TOKENIZE = 'tokenize'
+STAGE_LOOKUP   = 'lookup'
+STAGE_CODE     = 'code'
+STAGE_NLP      = 'nlp'
+STAGE_ELIZA    = 'eliza'
+STAGE_SELECT   = 'select'
+STAGE_PERSIST  = 'persist'
+
+STAGES         = [ STAGE_TOKENIZE, STAGE_LOOKUP, STAGE_CODE, STAGE_NLP, STAGE_ELIZA, STAGE_SELECT, STAGE_PERSIST ]
+
+TOTAL          = 'total'
+PROLOG         = 'prolog'
+
+PERCENTILES    = [ 50, 90, 99 ]
+
+class TurnRecord(object):
+
+    def __init__(self, user, realm, inp):
+
+        self.ts             = time.time()
+        self.user           = user
+        self.realm          = realm
+        self.inp            = inp
+        self.stages         = {}   # stage -> seconds (exclusive of nested stages)
+        self.total          = 0.0
+        self.prolog_queries  = 0
+        self.prolog_commands = 0   # assert/retract etc. (memory/4 mirroring, tracing)
+        self.prolog_time     = 0.0 # queries + commands
+
+        self._stack         = []   # [stage, start time, time spent in nested stages]
+        self._start_time    = time.time()
+
+    def start(self, stage):
+        self._stack.append([stage, time.time(), 0.0])
+
+    def stop(self):
+
+        stage, t, nested = self._stack.pop()
+        elapsed = time.time() - t
+
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def prolog(self, elapsed):
+        self.prolog_queries += 1
+        self.prolog_time    += elapsed
+
+    def prolog_command(self, elapsed):
+        self.prolog_commands += 1
+        self.prolog_time     += elapsed
+
+    def finish(self):
+        while self._stack:
+            self.stop()
+        self.total = time.time() - self._start_time
+
+    def to_dict(self):
+        return { 'ts'             : self.ts,
+                 'user'           : self.user,
+                 'realm'          : self.realm,
+                 'inp'            : self.inp,
+                 'stages'         : self.stages,
+                 'total'          : self.total,
+                 'prolog_queries' : self.prolog_queries,
+                 'prolog_commands': self.prolog_commands,
+                 'prolog_time'    : self.prolog_time }
+
+class LatencyHistogram(object):
+
+    """ in-memory sink, log-scale histogram per stage (1us .. ~1h, ~4% resolution) """
+
+    MIN_VALUE = 1e-6
+    GROWTH    = 1.04
+
+    def __init__(self):
+        self.buckets = {} # stage -> bucket idx -> count
+        self.counts  = {} # stage -> count
+        self.maxs    = {} # stage -> max value
+
+    def add(self, stage, value):
+
+        if value < self.MIN_VALUE:
+            idx = 0
+        else:
+            idx = int(math.log(value / self.MIN_VALUE) / math.log(self.GROWTH)) + 1
+
+        b = self.buckets.setdefault(stage, {})
+        b[idx] = b.get(idx, 0) + 1
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        self.maxs[stage]   = max(self.maxs.get(stage, 0.0), value)
+
+    def add_dict(self, d):
+        for stage, v in d['stages'].items():
+            self.add(stage, v)
+        self.add(TOTAL, d['total'])
+        self.add(PROLOG, d['prolog_time'])
+
+    def record(self, rec):
+        self.add_dict(rec.to_dict())
+
+    def percentile(self, stage, p):
+
+        n = self.counts.get(stage, 0)
+        if not n:
+            return 0.0
+
+        rank = int(math.ceil(n * p / 100.0))
+        cnt  = 0
+        for idx in sorted(self.buckets[stage]):
+            cnt += self.buckets[stage][idx]
+            if cnt >= rank:
+                if idx == 0:
+                    return 0.0
+                # upper bucket boundary, capped at observed max
+                return min(self.MIN_VALUE * self.GROWTH ** idx, self.maxs[stage])
+
+        return self.maxs[stage]
+
+    def table(self):
+
+        """ percentile table (ms) as list of text lines """
+
+        lines = [ '%-10s %8s' % ('stage', 'n') + ''.join([ ' %9s' % ('p%d' % p) for p in PERCENTILES ]) + ' %9s' % 'max' ]
+
+        for stage in STAGES + [ PROLOG, TOTAL ]:
+            if not stage in self.counts:
+                continue
+            l = '%-10s %8d' % (stage, self.counts[stage])
+            for p in PERCENTILES:
+                l += ' %9.3f' % (self.percentile(stage, p) * 1000.0)
+            l += ' %9.3f' % (self.maxs[stage] * 1000.0)
+            lines.append(l)
+
+        return lines
+
+class JSONLinesSink(object):
+
+    def __init__(self, fn):
+        self.f = codecs.open(fn, 'a', 'utf8')
+
+    def record(self, rec):
+        self.f.write(json.dumps(rec.to_dict()) + u'\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class CallbackSink(object):
+
+    def __init__(self, cb):
+        self.cb = cb
+
+    def record(self, rec):
+        self.cb(rec)
+
+def load_jsonl(fn, histogram=None):
+
+    """ read TurnRecord dicts from a JSON lines file into a (new) histogram """
+
+    if histogram is None:
+        histogram = LatencyHistogram()
+
+    with codecs.open(fn, 'r', 'utf8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                histogram.add_dict(json.loads(line))
+
+    return histogram
+
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# dialog memory store
+#
+# python side implementation of the memory(REALM, K, V, S) facts, indexed
+# by (realm, k). Entries are kept ordered by descending score. Changes are
+# tracked twice: keys that need to be written to the db and keys that need
+# to be mirrored into the prolog KB. The latter only once mirroring has been
+# switched on (set_mirror(), done if prolog code reads memory/4).
+#
+# Realms can be paged in from the db on demand and evicted again when idle,
+# the store keeps track of loaded realms in LRU order for that.
+#
+# Volatile realms (used by skill tests) are never persisted nor evicted,
+# snapshot()/restore() reset them between tests.
+#
+
+import time
+
+from collections import OrderedDict
+
+from pyxsb       import XSBAtom
+
+MEM_DECAY         = 0.5   # mem_push: scores of existing entries get multiplied by this
+MEM_MIN_SCORE     = 0.125 # mem_push: entries below this score get dropped
+MEM_MAX_ENTRIES   = 5     # max number of entries per (realm, k)
+
+def mem_value(v):
+    """ values come back from the prolog KB as XSB terms, so store them that way """
+    if isinstance(v, basestring):
+        return XSBAtom(v)
+    return v
+
+class MemStore(object):
+
+    def __init__(self, max_entries=MEM_MAX_ENTRIES):
+
+        self.max_entries  = max_entries
+
+        self.realms       = {}    # realm -> k -> [(v, score), ...]
+        self.loaded       = OrderedDict() # realm -> last access time, LRU order
+        self.dirty        = set() # (realm, k) to persist, k None -> whole realm
+        self.mirror       = False # track changes to mirror into prolog?
+        self.mirror_dirty = {}    # realm -> set of k to mirror into prolog, k None -> whole realm
+        self.volatile     = set() # realms that never get persisted
+
+    def set_mirror(self):
+
+        """ start tracking changes to mirror into prolog, everything in memory so far needs mirroring """
+
+        self.mirror = True
+        for realm in self.realms:
+            self._mirror_touch(realm, None)
+
+    def set_volatile(self, realm):
+        self.volatile.add(realm)
+
+    def is_volatile(self, realm):
+        return realm in self.volatile
+
+    def _mirror_touch(self, realm, k):
+
+        if not self.mirror:
+            return
+
+        ks = self.mirror_dirty.setdefault(realm, set())
+        if k is None:
+            ks.clear()
+            ks.add(None)
+        # whole realm already dirty -> covers k as well
+        elif not None in ks:
+            ks.add(k)
+
+    def _touch(self, realm, k):
+        # whole realm already dirty -> covers k as well
+        if not realm in self.volatile and not (realm, None) in self.dirty:
+            self.dirty.add((realm, k))
+        self._mirror_touch(realm, k)
+
+    def pop_dirty(self, realms=None):
+
+        if realms is None:
+            dirty      = self.dirty
+            self.dirty = set()
+            return dirty
+
+        dirty = set(filter(lambda rk: rk[0] in realms, self.dirty))
+        self.dirty -= dirty
+        return dirty
+
+    def pop_mirror_dirty(self):
+        dirty             = set([ (realm, k) for realm, ks in self.mirror_dirty.items() for k in ks ])
+        self.mirror_dirty = {}
+        return dirty
+
+    def clear(self, realm):
+
+        if realm in self.realms:
+            del self.realms[realm]
+
+        if not realm in self.volatile:
+            for rk in list(self.dirty):
+                if rk[0] == realm:
+                    self.dirty.remove(rk)
+            self.dirty.add((realm, None))
+
+        self._mirror_touch(realm, None)
+
+    def set(self, realm, k, v):
+
+        rd = self.realms.setdefault(realm, {})
+
+        if v:
+            rd[k] = [(mem_value(v), 1.0)]
+        elif k in rd:
+            del rd[k]
+
+        self._touch(realm, k)
+
+    def push(self, realm, k, v):
+
+        rd = self.realms.setdefault(realm, {})
+
+        entries = [(mem_value(v), 1.0)] if v else []
+        for v2, score in rd.get(k, []):
+            if score < MEM_MIN_SCORE:
+                continue
+            entries.append((v2, score * MEM_DECAY))
+
+        rd[k] = entries[:self.max_entries]
+
+        self._touch(realm, k)
+
+    def load(self, realm, k, v, score):
+
+        """ add entry restored from the db, does not mark anything dirty for persistence """
+
+        entries = self.realms.setdefault(realm, {}).setdefault(k, [])
+        entries.append((v, score))
+        entries.sort(key=lambda e: e[1], reverse=True)
+        del entries[self.max_entries:]
+
+        self._mirror_touch(realm, k)
+
+    def is_loaded(self, realm):
+        return realm in self.loaded
+
+    def access(self, realm):
+
+        """ mark realm as loaded + most recently used """
+
+        self.loaded.pop(realm, None)
+        self.loaded[realm] = time.time()
+
+    def idle_realms(self, ttl, max_realms):
+
+        """ return loaded realms that have been idle longer than ttl or exceed max_realms (LRU) """
+
+        res = []
+        now = time.time()
+        n   = len(self.loaded)
+
+        for realm, t in self.loaded.items():
+            if (now - t <= ttl) and (n - len(res) <= max_realms):
+                break
+            if realm in self.volatile:
+                continue
+            res.append(realm)
+
+        return res
+
+    def evict(self, realm):
+
+        """ drop realm from memory, caller has to persist dirty entries first """
+
+        self.loaded.pop(realm, None)
+        if realm in self.realms:
+            del self.realms[realm]
+
+        self._mirror_touch(realm, None)
+
+    def snapshot(self, realms):
+
+        """ copy of the entries of realms, for restore() """
+
+        res = {}
+        for realm in realms:
+            res[realm] = dict([ (k, list(entries)) for k, entries in self.realms.get(realm, {}).items() ])
+        return res
+
+    def restore(self, snapshot):
+
+        """ reset realms to snapshot, realms that did not change in the meantime are left alone """
+
+        for realm, rd in snapshot.items():
+
+            if self.realms.get(realm, {}) == rd:
+                continue
+
+            self.clear(realm)
+            self.realms[realm] = dict([ (k, list(entries)) for k, entries in rd.items() ])
+
+    def get(self, realm, k):
+        entries = self.realms.get(realm, {}).get(k)
+        if not entries:
+            return None
+        return entries[0][0]
+
+    def get_multi(self, realm, k):
+        return list(self.realms.get(realm, {}).get(k, []))
+
+    def dump(self, realm):
+        res = []
+        for k, entries in self.realms.get(realm, {}).items():
+            for v, score in entries:
+                res.append((k, v, score))
+        return res
+
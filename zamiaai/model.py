@@ -18,10 +18,13 @@
 #
 
 import sys
+import time
+import logging
 
-from sqlalchemy                 import create_engine
-from sqlalchemy                 import Column, Integer, String, Text, Unicode, UnicodeText, Enum, DateTime, ForeignKey, Index, Float
-from sqlalchemy.orm             import relationship
+from sqlalchemy                 import create_engine, event, inspect, text
+from sqlalchemy                 import Column, Integer, BigInteger, String, Text, Unicode, UnicodeText, Enum, DateTime, ForeignKey, Index, Float, LargeBinary
+from sqlalchemy                 import or_, and_
+from sqlalchemy.orm             import relationship, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -34,17 +37,92 @@ class TrainingData(Base):
 
     lang              = Column(String(2), index=True)
     skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
 
-    inp               = Column(UnicodeText, index=True)
+    inp               = Column(UnicodeText)
     md5s              = Column(String(32))
     args              = Column(String(255))
 
     loc_fn            = Column(String(255))
     loc_line          = Column(Integer)
 
-    __table_args__    = (Index('idx_td_inp_lang', "inp", "lang"), 
+    # covering index: exact match lookups never have to touch the table itself
+
+    __table_args__    = (Index('idx_td_lookup', "inp", "lang", "generation", "md5s", "args", "loc_fn", "loc_line"),
                          Index('idx_td_mod_lang', "skill", "lang"))
 
+#
+# compact training data schema (optional, see zamiaai.compact_schema):
+# lang, skill, source location and args are stored once in dictionary
+# tables, lookups go through a 64 bit hash of the input
+#
+
+class TDLang(Base):
+
+    __tablename__ = 'td_lang'
+
+    id                = Column(Integer, primary_key=True)
+    lang              = Column(String(2), unique=True)
+
+class TDSkill(Base):
+
+    __tablename__ = 'td_skill'
+
+    id                = Column(Integer, primary_key=True)
+    skill             = Column(String(255), unique=True)
+
+class TDLocation(Base):
+
+    __tablename__ = 'td_location'
+
+    id                = Column(Integer, primary_key=True)
+    loc_fn            = Column(String(255))
+    loc_line          = Column(Integer)
+
+class TDArgs(Base):
+
+    __tablename__ = 'td_args'
+
+    id                = Column(Integer, primary_key=True)
+    args              = Column(Text)
+
+class CompactTrainingData(Base):
+
+    __tablename__ = 'compact_training_data'
+
+    id                = Column(Integer, primary_key=True)
+
+    inp_hash          = Column(BigInteger)  # signed 64 bit hash of inp
+    lang_id           = Column(Integer, ForeignKey('td_lang.id'))
+    skill_id          = Column(Integer, ForeignKey('td_skill.id'), index=True)
+    generation        = Column(Integer, index=True)
+
+    inp               = Column(UnicodeText) # not indexed, used to verify hash matches
+    md5s              = Column(String(32))
+    args_id           = Column(Integer, ForeignKey('td_args.id'))
+    location_id       = Column(Integer, ForeignKey('td_location.id'))
+
+    __table_args__    = (Index('idx_ctd_hash_lang', "inp_hash", "lang_id"), )
+
+class PatternData(Base):
+
+    # dt() patterns stored unexpanded, matched by zamiaai.pattern_matcher
+
+    __tablename__ = 'pattern_data'
+
+    id                = Column(Integer, primary_key=True)
+
+    lang              = Column(String(2), index=True)
+    skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
+
+    pattern           = Column(UnicodeText)
+    md5s              = Column(String(32))
+    args              = Column(String(255))
+
+    loc_fn            = Column(String(255))
+    loc_line          = Column(Integer)
+
 class Code(Base):
     __tablename__ = "code"
 
@@ -63,6 +141,7 @@ class TestCase(Base):
 
     lang              = Column(String(2), index=True)
     skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
 
     name              = Column(String(255), index=True)
 
@@ -84,11 +163,42 @@ class NERData(Base):
 
     lang              = Column(String(2), index=True)
     skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
 
     cls               = Column(String(255))
     entity            = Column(Unicode(255))
     label             = Column(Unicode(255))
 
+class NERIndexData(Base):
+
+    # zlib compressed json token -> entity -> label positions of a skill's NER class (see ner_index.py)
+
+    __tablename__ = 'ner_index'
+
+    id                = Column(Integer, primary_key=True)
+
+    lang              = Column(String(2), index=True)
+    skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
+
+    cls               = Column(String(255))
+    data              = Column(LargeBinary)
+
+class NERMacro(Base):
+
+    # named macro backed by all entities of a NER class (pattern matcher only)
+
+    __tablename__ = 'ner_macro'
+
+    id                = Column(Integer, primary_key=True)
+
+    lang              = Column(String(2), index=True)
+    skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
+
+    name              = Column(String(255), index=True)
+    cls               = Column(String(255))
+
 class NamedMacro(Base):
 
     __tablename__ = 'named_macro'
@@ -97,11 +207,59 @@ class NamedMacro(Base):
 
     lang              = Column(String(2), index=True)
     skill             = Column(String(255), index=True)
+    generation        = Column(Integer, index=True)
 
     name              = Column(String(255), index=True)
 
     soln              = Column(Text)
 
+class Generation(Base):
+
+    # every compilation of a skill writes its rows into a new generation
+
+    __tablename__ = 'generation'
+
+    id                = Column(Integer, primary_key=True)
+
+    skill             = Column(String(255), index=True)
+
+    ts                = Column(Float)  # creation time
+    superseded        = Column(Float)  # time another generation of the skill was published / started, None: current
+
+class SkillGeneration(Base):
+
+    # published generation per skill, switching it is what makes a compilation visible
+
+    __tablename__ = 'skill_generation'
+
+    skill             = Column(String(255), primary_key=True)
+
+    generation        = Column(Integer, index=True)
+
+class SkillFingerprint(Base):
+
+    __tablename__ = 'skill_fingerprint'
+
+    skill             = Column(String(255), primary_key=True)
+
+    src_hash          = Column(String(32)) # skill python modules + PL_SOURCES + compile options
+    macros            = Column(Text)       # json list of [lang, name] named macros used from other skills
+    macro_hash        = Column(String(32)) # solutions of those macros
+
+# passed skill tests, key covers everything the outcome depends on (see AIKernal._test_keys)
+
+class CachedTestResult(Base):
+
+    __tablename__ = 'test_result_cache'
+
+    skill             = Column(String(255), primary_key=True)
+    lang              = Column(String(2),   primary_key=True)
+    name              = Column(String(255), primary_key=True)
+
+    key               = Column(String(32))
+    duration          = Column(Float)
+    ts                = Column(Float)
+
 class Mem(Base):
 
     __tablename__ = 'mem'
@@ -116,8 +274,125 @@ class Mem(Base):
     __table_args__    = (Index('idx_mem_realm_k', "realm", "k"), )
 
 
-def data_engine_setup(db_url, echo=False):
+def live(q, cls, generation=None, skill=None):
+
+    """ restrict query q on cls to rows of the published generations of their skills
+        (plus rows of generation, if given: the one currently being compiled for skill,
+        which replaces skill's published generation).
+        generation ids are unique across skills, so joining on them is enough. """
+
+    if generation is None:
+        return q.join(SkillGeneration, SkillGeneration.generation==cls.generation)
+
+    # skill None: SkillGeneration.skill != None, i.e. every published generation
+
+    return q.outerjoin(SkillGeneration, SkillGeneration.generation==cls.generation) \
+            .filter(or_(and_(SkillGeneration.skill!=None, SkillGeneration.skill!=skill), cls.generation==generation))
+
+# tables that existed before skill generations were introduced, see migrate()
+
+GENERATION_TABLES = [TrainingData, TestCase, NERData, NamedMacro]
+
+def migrate(engine):
+
+    """ databases created before skill generations lack the generation column:
+        add it (plus its indexes), then publish one generation per skill holding
+        the skill's existing rows so they stay visible. """
+
+    insp    = inspect(engine)
+    missing = [ cls for cls in GENERATION_TABLES
+                if not 'generation' in [ c['name'] for c in insp.get_columns(cls.__tablename__) ] ]
+
+    if not missing:
+        return
+
+    logging.info ('migrating db: adding generation column to %s' % ', '.join([cls.__tablename__ for cls in missing]))
+
+    session = sessionmaker(bind=engine)()
+
+    for cls in missing:
+        session.execute(text('ALTER TABLE %s ADD COLUMN generation INTEGER' % cls.__tablename__))
+        for idx in cls.__table__.indexes:
+            if 'generation' in [ c.name for c in idx.columns ]:
+                idx.create(session.connection())
+
+    skills = set()
+    for cls in GENERATION_TABLES:
+        for skill, in session.query(cls.skill).filter(cls.generation==None).distinct():
+            skills.add(skill)
+
+    published = published_generations(session)
+    ts        = time.time()
+
+    for skill in sorted(skills):
+
+        generation = published.get(skill)
+        if generation is None:
+            g = Generation(skill=skill, ts=ts, superseded=None)
+            session.add(g)
+            session.flush()
+            generation = g.id
+            session.add(SkillGeneration(skill=skill, generation=generation))
+
+        for cls in GENERATION_TABLES:
+            session.query(cls).filter(cls.skill==skill, cls.generation==None) \
+                   .update({cls.generation: generation}, synchronize_session=False)
+
+    session.commit()
+    session.close()
+
+    logging.info ('migrating db: published %d skill generations' % len(skills))
+
+def pattern_mode_skills(session):
+
+    """ skills whose published generation was compiled in pattern mode: they have no expanded training data """
+
+    return sorted([ skill for skill, in live(session.query(PatternData.skill), PatternData).distinct() ])
+
+def published_generations(session):
+
+    """ skill -> published generation """
+
+    return dict([ (sg.skill, sg.generation) for sg in session.query(SkillGeneration) ])
+
+# connection level sqlite tuning: WAL lets serving processes read while a
+# compilation writes, mmap + a bigger page cache keep lookups off read()
+
+DEFAULT_SQLITE_PRAGMAS = 'journal_mode=WAL, mmap_size=268435456, cache_size=-65536'
+
+def parse_pragmas(pragmas):
+
+    """ 'name=value, ...' -> [(name, value), ...] """
+
+    res = []
+    for p in (pragmas or '').split(','):
+        p = p.strip()
+        if not p:
+            continue
+        parts = p.split('=')
+        if len(parts) != 2:
+            raise Exception ('invalid sqlite pragma: %s' % repr(p))
+        res.append((parts[0].strip(), parts[1].strip()))
+
+    return res
+
+def data_engine_setup(db_url, echo=False, sqlite_pragmas=DEFAULT_SQLITE_PRAGMAS):
+
     engine = create_engine(db_url, echo=echo)
+
+    if engine.dialect.name == 'sqlite':
+
+        pragmas = parse_pragmas(sqlite_pragmas)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute('PRAGMA %s=%s' % (name, value))
+            cursor.close()
+
     Base.metadata.create_all(engine)
+    migrate(engine)
+
     return engine
 
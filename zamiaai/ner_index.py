@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# NER index
+#
+# AIContext.ner() scores entities by the positions of input tokens in their
+# labels: token -> entity -> label positions, per (lang, cls). compile_skill
+# builds this dict for every NER class a skill defines and stores it zlib
+# compressed in the ner_index table. The kernal keeps one NERIndex which
+# merges the published dicts of all skills on first use of a class, all
+# contexts share it read-only.
+#
+# In memory, each class is kept as a NERTable: entities are interned, the
+# postings (entity, label position) of each token are stored CSR style in
+# NumPy arrays so scoring a span is a handful of vectorized operations,
+# no matter how many entity labels a token like "the" occurs in.
+#
+
+import json
+import zlib
+import logging
+import time
+
+import numpy as np
+
+from nltools.tokenizer import tokenize
+from zamiaai           import model
+
+def build(lang, entries):
+
+    """ entries: iterable of (entity, label) -> token -> entity -> tuple of label positions """
+
+    nd = {}
+
+    for entity, label in entries:
+        for j, token in enumerate(tokenize(label, lang=lang)):
+            nd.setdefault(token, {}).setdefault(entity, set()).add(j)
+
+    for token in nd:
+        for entity in nd[token]:
+            nd[token][entity] = tuple(sorted(nd[token][entity]))
+
+    return nd
+
+def merge(nd, nd2):
+
+    """ add nd2's entries to nd """
+
+    for token, entities in nd2.iteritems():
+
+        d = nd.get(token)
+        if d is None:
+            nd[token] = dict(entities)
+            continue
+
+        for entity, positions in entities.iteritems():
+            if entity in d:
+                d[entity] = tuple(sorted(set(d[entity]) | set(positions)))
+            else:
+                d[entity] = positions
+
+def encode(nd):
+    return zlib.compress(json.dumps(nd))
+
+def decode(data):
+
+    nd = json.loads(zlib.decompress(data))
+
+    for token in nd:
+        for entity in nd[token]:
+            nd[token][entity] = tuple(nd[token][entity])
+
+    return nd
+
+class NERTable(object):
+
+    """ compact, read-only form of a token -> entity -> label positions dict """
+
+    def __init__(self, nd):
+
+        self.entities  = sorted(set([ entity for token in nd for entity in nd[token] ]))
+        entity_ids     = dict([ (entity, i) for i, entity in enumerate(self.entities) ])
+
+        self.token_ids = {}
+        self.indptr    = np.zeros(len(nd)+1, dtype=np.int64)
+
+        post_entity    = []
+        post_pos       = []
+
+        for i, token in enumerate(sorted(nd)):
+
+            self.token_ids[token] = i
+
+            for entity, positions in nd[token].iteritems():
+                for pos in positions:
+                    post_entity.append(entity_ids[entity])
+                    post_pos.append(pos)
+
+            self.indptr[i+1] = len(post_entity)
+
+        self.post_entity = np.array(post_entity, dtype=np.int32)
+        self.post_pos    = np.array(post_pos,    dtype=np.int32)
+
+    def __len__(self):
+        return len(self.token_ids)
+
+    def __contains__(self, token):
+        return token in self.token_ids
+
+    def to_dict(self):
+
+        nd = {}
+        for token, i in self.token_ids.iteritems():
+            d = {}
+            for j in range(self.indptr[i], self.indptr[i+1]):
+                d.setdefault(self.entities[self.post_entity[j]], []).append(int(self.post_pos[j]))
+            nd[token] = dict([ (entity, tuple(sorted(positions))) for entity, positions in d.iteritems() ])
+        return nd
+
+    def score(self, tokens, tstart, tend, max_results=None):
+
+        """ score entities against tokens[tstart:tend], allowing start and end to be off by one token.
+            returns [(entity, score), ...] best first (ties: entity order), max_results+1 entries at most """
+
+        # window variants, same as the nested loops AIContext.ner used to run
+
+        windows = []
+        for tstart in range (tstart-1, tstart+2):
+            if tstart <0:
+                continue
+            for tend in range (tend-1, tend+2):
+                if tend > len(tokens):
+                    continue
+                if tend > tstart:
+                    windows.append((tstart, tend))
+
+        if not windows:
+            return []
+
+        # postings of all tokens any window covers, in token order
+
+        lo     = min([ w[0] for w in windows ])
+        hi     = max([ w[1] for w in windows ])
+
+        slices = []
+        offs   = [ 0 ] # offs[tidx-lo]: offset of token tidx's postings
+        for tidx in range(lo, hi):
+            i = self.token_ids.get(tokens[tidx])
+            if i is not None:
+                slices.append(slice(self.indptr[i], self.indptr[i+1]))
+            offs.append(offs[-1] + (self.indptr[i+1] - self.indptr[i] if i is not None else 0))
+
+        n = offs[-1]
+        if not n:
+            return []
+
+        entity = np.concatenate([ self.post_entity[s] for s in slices ])
+        pos    = np.concatenate([ self.post_pos[s]    for s in slices ])
+        tidx   = np.repeat(np.arange(lo, hi), np.diff(offs))
+
+        # candidate entities, renumbered 0..k-1 (no sorting needed)
+
+        seen         = np.zeros(len(self.entities), dtype=bool)
+        seen[entity] = True
+        cands        = np.flatnonzero(seen)
+        remap        = np.zeros(len(self.entities), dtype=np.int32)
+        remap[cands] = np.arange(len(cands), dtype=np.int32)
+        cidx         = remap[entity]
+
+        # per window: the postings it covers are contiguous, points = max(2-|label pos - token offset|, 0)
+
+        scores  = np.zeros(len(cands))
+        covered = np.zeros(n, dtype=bool)
+        for ws, we in windows:
+            a, b   = offs[ws-lo], offs[we-lo]
+            if a == b:
+                continue
+            points = np.maximum(2 - np.abs(pos[a:b] - (tidx[a:b] - ws)), 0)
+            np.maximum(scores, np.bincount(cidx[a:b], weights=points, minlength=len(cands)), out=scores)
+            covered[a:b] = True
+
+        # entities count as found if any window covers them, even if they scored no points
+
+        found = np.flatnonzero(np.bincount(cidx[covered], minlength=len(cands)))
+        if not len(found):
+            return []
+        cands  = cands[found]
+        scores = scores[found]
+
+        # best first, ties by entity order. points are integers, so a combined integer key can be used
+
+        key = (scores.max() - scores).astype(np.int64) * len(self.entities) + cands
+
+        if max_results is not None and max_results+1 < len(key):
+            top   = np.argpartition(key, max_results+1)[:max_results+1]
+            order = top[np.argsort(key[top])]
+        else:
+            order = np.argsort(key)
+
+        return [ (self.entities[cands[i]], float(scores[i])) for i in order ]
+
+class NERIndex(object):
+
+    def __init__(self, session, bundle=None):
+
+        self.session = session
+        self.bundle  = bundle  # serving from a runtime bundle: entities come from there, built on load
+
+        self.refresh()
+
+    def set_session(self, session):
+
+        """ use session to load tables from now on, e.g. in a forked worker process """
+
+        self.session = session
+
+    def refresh(self):
+
+        """ drop loaded tables, call after skills have been (re-)compiled """
+
+        self.tables = {} # (lang, cls) -> NERTable
+
+    def lookup(self, lang, cls):
+
+        """ NERTable of NER class cls """
+
+        key   = (lang, cls)
+        table = self.tables.get(key)
+        if table is None:
+            table = NERTable(self._load(lang, cls))
+            self.tables[key] = table
+        return table
+
+    def _load(self, lang, cls):
+
+        start_time = time.time()
+
+        if self.bundle:
+            nd = build(lang, self.bundle.lookup_ner(lang, cls))
+
+        else:
+            nd     = {}
+            skills = []
+
+            q = model.live(self.session.query(model.NERIndexData), model.NERIndexData)
+            for nid in q.filter(model.NERIndexData.lang==lang).filter(model.NERIndexData.cls==cls):
+                merge(nd, decode(nid.data))
+                skills.append(nid.skill)
+
+            # skills compiled before the index got persisted
+
+            q = model.live(self.session.query(model.NERData.entity, model.NERData.label), model.NERData)
+            q = q.filter(model.NERData.lang==lang).filter(model.NERData.cls==cls)
+            if skills:
+                q = q.filter(~model.NERData.skill.in_(skills))
+            merge(nd, build(lang, q.order_by(model.NERData.id)))
+
+        logging.debug ('ner index: %s %s: %d tokens, took %fs' % (lang, cls, len(nd), time.time()-start_time))
+
+        return nd
@@ -47,6 +47,8 @@ from copy              import deepcopy
 
 import model
 
+from compact_schema    import iter_training_data
+
 from nltools.tokenizer import tokenize
 from nltools.misc      import mkdirs
 
@@ -200,9 +202,11 @@ class NLPModel(object):
         self.keras_model_train.load_weights(self.weights_fn)
 
 
-    def predict (self, inp):
+    def predict (self, inp, tokens=None):
+
+        """ tokens: inp already tokenized """
 
-        td_inp  = tokenize(inp, lang=self.lang)
+        td_inp  = tokens if tokens is not None else tokenize(inp, lang=self.lang)
         num_decoder_tokens = len (self.decoder_dict)
 
         encoder_input_data  = np.zeros( (1, self.max_inp_len, self.embed_dim), dtype='float32')
@@ -322,7 +326,7 @@ class NLPModel(object):
         logging.info('load discourses from db...')
 
         drs      = {} 
-        for dr in self.session.query(model.TrainingData).filter(model.TrainingData.lang==self.lang):
+        for dr in iter_training_data(self.session, lang=self.lang):
 
             if not dr.inp in drs:
                 drs[dr.inp] = set()
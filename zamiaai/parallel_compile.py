@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# parallel skill compilation
+#
+# skills are compiled in forked worker processes (each of which ends up
+# with its own copy of the XSB session), every skill into its own sqlite
+# staging db. A skill is scheduled once all skills it DEPENDS on (directly
+# or indirectly) have been merged into the main db, its staging db gets
+# seeded with the published named macros of every other skill, so
+# cross-skill macros like self_address resolve the same way they do in a
+# serial compile (and in AIKernal._macro_hash).
+#
+
+import logging
+import traceback
+import tempfile
+import shutil
+import time
+import multiprocessing
+import Queue
+
+from sqlalchemy.orm      import sessionmaker
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine, TC_COLUMNS, NER_COLUMNS, NM_COLUMNS, CODE_COLUMNS, \
+                                PD_COLUMNS, NERM_COLUMNS, NERI_COLUMNS
+from zamiaai.compact_schema import iter_training_data
+from zamiaai.worker_pool    import pool_workers, dead_workers
+
+# set right before the worker pool is forked, workers use their copy of it
+
+_kernal = None
+
+# training data is copied separately, it may be in either schema
+
+STAGED_TABLES = [ (model.TestCase,     TC_COLUMNS),
+                  (model.NERData,      NER_COLUMNS),
+                  (model.NamedMacro,   NM_COLUMNS),
+                  (model.PatternData,  PD_COLUMNS),
+                  (model.NERMacro,     NERM_COLUMNS),
+                  (model.NERIndexData, NERI_COLUMNS) ]
+
+def _compile_staged(skill_name, staging_url, seed_macros):
+
+    """ worker: compile skill_name into staging db, return (skill_name, cnt_dt, cnt_ts, error) """
+
+    try:
+        engine  = model.data_engine_setup(staging_url, echo=False)
+        session = sessionmaker(bind=engine)()
+
+        batch_size = _kernal.dte.bulk.batch_size
+
+        dte = DataEngine(session, batch_size=batch_size)
+        dte.set_compact_schema(_kernal.dte.compact is not None)
+        for dep in sorted(seed_macros):
+            dte.prepare_compilation(dep)
+            for row in seed_macros[dep]:
+                dte.bulk.add(model.NamedMacro.__table__, NM_COLUMNS, row + (dte.generation, ))
+            dte.publish()
+
+        _kernal.session = session
+        _kernal.dte     = dte
+
+        _kernal.compile_skill(skill_name)
+
+        cnt_dt, cnt_ts = dte.get_stats()
+
+        return skill_name, cnt_dt, cnt_ts, None
+
+    except:
+        return skill_name, 0, 0, traceback.format_exc()
+
+def transitive_deps(kernal, skill_name, res=None):
+
+    if res is None:
+        res = set()
+
+    for dep in getattr(kernal.skills[skill_name], 'DEPENDS'):
+        if not dep in res:
+            res.add(dep)
+            transitive_deps(kernal, dep, res)
+
+    return res
+
+def _seed_macros(kernal, skill_name):
+
+    """ published named macros of all skills but skill_name: skill -> [(lang, skill, name, soln), ...] """
+
+    res = {}
+
+    q = model.live(kernal.session.query(model.NamedMacro), model.NamedMacro)
+    for nm in q.filter(model.NamedMacro.skill!=skill_name).order_by(model.NamedMacro.id):
+        res.setdefault(nm.skill, []).append((nm.lang, nm.skill, nm.name, nm.soln))
+    return res
+
+def _merge(kernal, skill_name, staging_url):
+
+    """ copy skill_name's output from its staging db into a new generation in the main db, publish it """
+
+    engine  = model.data_engine_setup(staging_url, echo=False)
+    staging = sessionmaker(bind=engine)()
+
+    dte = kernal.dte
+    dte.prepare_compilation(skill_name)
+
+    for cls, columns in STAGED_TABLES:
+        q = staging.query(*[ getattr(cls, c) for c in columns ])
+        q = model.live(q, cls).filter(cls.skill==skill_name).order_by(cls.id)
+        for row in q.yield_per(10000):
+            # generation is the last column
+            dte.bulk.add(cls.__table__, columns, tuple(row)[:-1] + (dte.generation, ))
+
+    for td in iter_training_data(staging, skill=skill_name):
+        dte.add_training_data(td.lang, td.inp, td.md5s, td.args, td.loc_fn, td.loc_line)
+
+    for fp in staging.query(model.SkillFingerprint).filter(model.SkillFingerprint.skill==skill_name):
+        kernal.session.merge(model.SkillFingerprint(skill=fp.skill, src_hash=fp.src_hash, macros=fp.macros, macro_hash=fp.macro_hash))
+
+    # code is de-duplicated across skills
+
+    known = set([ md5s for md5s, in kernal.session.query(model.Code.md5s) ])
+    q = staging.query(*[ getattr(model.Code, c) for c in CODE_COLUMNS ]).filter(model.Code.skill==skill_name)
+    for row in q.yield_per(10000):
+        if not row[0] in known:
+            dte.bulk.add(model.Code.__table__, CODE_COLUMNS, tuple(row))
+
+    dte.publish()
+
+    staging.close()
+    engine.dispose()
+
+def compile_parallel(kernal, skill_names, jobs, force=False):
+
+    """ compile skill_names using jobs worker processes, merge results into kernal's db.
+        skills that are up to date are skipped unless force is set. """
+
+    global _kernal
+
+    start_time = time.time()
+
+    deps = {}
+    for skill_name in skill_names:
+        kernal.load_skill(skill_name)
+        deps[skill_name] = transitive_deps(kernal, skill_name)
+
+    tmpdir = tempfile.mkdtemp(prefix='zamiaai_compile_')
+
+    _kernal = kernal
+    pool    = multiprocessing.Pool(processes=jobs)
+    results = Queue.Queue()
+    workers = set(pool_workers(pool))
+
+    todo    = list(skill_names)
+    running = set()
+    done    = set()
+
+    try:
+        while todo or running:
+
+            # schedule every skill whose in-set dependencies have been merged
+
+            for skill_name in list(todo):
+
+                if deps[skill_name] & (set(todo) | running):
+                    continue
+
+                todo.remove(skill_name)
+
+                # checked only now so changed macros of dependencies are taken into account
+
+                if not force and kernal.skill_up_to_date(skill_name):
+                    logging.info ('skill %s is up to date.' % skill_name)
+                    done.add(skill_name)
+                    continue
+
+                staging_url = 'sqlite:///%s/%s.db' % (tmpdir, skill_name)
+                seed_macros = _seed_macros(kernal, skill_name)
+
+                logging.info ('compiling skill %s (%d named macros from other skills) ...' %
+                              (skill_name, sum([ len(rows) for rows in seed_macros.values() ])))
+
+                pool.apply_async(_compile_staged, (skill_name, staging_url, seed_macros), callback=results.put)
+
+                running.add(skill_name)
+
+            if not running:
+                if not todo:
+                    break
+                raise Exception ('dependency cycle between skills %s' % ', '.join(todo))
+
+            # wait for the next worker to finish, merge its output
+            # (polling, a blocking get() would not be interruptible)
+
+            while True:
+                try:
+                    skill_name, cnt_dt, cnt_ts, error = results.get(True, 1.0)
+                    break
+                except Queue.Empty:
+                    pass
+
+                dead = dead_workers(pool, workers)
+                if dead:
+                    raise Exception ('worker process died (exit code %s) while compiling skill(s) %s' %
+                                     (', '.join([ str(w.exitcode) for w in dead ]), ', '.join(sorted(running))))
+
+            running.remove(skill_name)
+
+            if error:
+                raise Exception ('compiling skill %s failed:\n%s' % (skill_name, error))
+
+            _merge(kernal, skill_name, 'sqlite:///%s/%s.db' % (tmpdir, skill_name))
+            done.add(skill_name)
+
+            logging.info ('skill %s merged: %d training samples, %d tests [%d/%d skills done]' %
+                          (skill_name, cnt_dt, cnt_ts, len(done), len(skill_names)))
+
+    finally:
+        pool.terminate()
+        pool.join()
+        _kernal = None
+        shutil.rmtree(tmpdir)
+
+    logging.info ('parallel compilation of %d skills using %d jobs took %fs' % (len(skill_names), jobs, time.time()-start_time))
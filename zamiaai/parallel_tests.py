@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# parallel skill test runner
+#
+# test cases are sharded across forked worker processes, each of which
+# ends up with its own copy of the kernal and XSB session (skills are
+# consulted before the fork). Workers open their own db connection, test
+# memory is never persisted so tests running at the same time cannot
+# interfere with each other.
+#
+
+import os
+import signal
+import logging
+import traceback
+import time
+import multiprocessing
+
+from zamiaai.data_engine import DataEngine
+from zamiaai.skill_tests import SkillTestResult
+from zamiaai.exact_index import ExactMatchIndex
+from zamiaai.worker_pool import pool_workers, dead_workers
+
+DEFAULT_TEST_TIMEOUT = 600.0 # seconds a single test may run before it is reported as failed
+
+# set right before the worker pool is forked, workers use their copy of it
+
+_kernal = None
+
+# shared memory, test index -> pid of the worker running it / time it was started
+
+_pids   = None
+_starts = None
+
+def _init_worker():
+
+    # connections inherited from the parent must not be used in the child
+
+    _kernal.engine.dispose()
+
+    session = _kernal.Session()
+
+    # exact match index, pattern matcher and NER index were built before the fork,
+    # they keep their data but must use the worker's session from now on
+
+    index   = _kernal.dte.index
+    matcher = _kernal.dte.matcher
+
+    if isinstance(index, ExactMatchIndex):
+        index.set_session(session)
+    if matcher:
+        matcher.set_session(session)
+    _kernal.ner_index.set_session(session)
+
+    dte = DataEngine(session, batch_size=_kernal.dte.bulk.batch_size)
+    dte.set_compact_schema(_kernal.dte.compact is not None)
+    dte.set_index(index)
+    dte.set_matcher(matcher)
+
+    _kernal.session        = session
+    _kernal.dte            = dte
+    _kernal.code_cache.dte = dte
+
+def _failed(skill_name, tc, duration, failure):
+    t_name, lang, prep_code, prep_fn, rounds, loc_fn, loc_line = tc
+    return SkillTestResult(skill_name, t_name, lang, loc_fn, loc_line, duration, failure, 0)
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass # already gone
+
+def _run_test(i, skill_name, tc):
+
+    """ worker: run a single test case, return SkillTestResult """
+
+    _pids[i]   = os.getpid()
+    _starts[i] = time.time()
+
+    try:
+        return _kernal.run_test(skill_name, tc)
+    except:
+        return _failed(skill_name, tc, 0.0, traceback.format_exc())
+
+def run_tests_parallel(kernal, tests, jobs, timeout=DEFAULT_TEST_TIMEOUT):
+
+    """ tests: list of (skill name, test case) as returned by DataEngine.lookup_tests,
+        run them using jobs worker processes, return list of SkillTestResult in tests order.
+        tests that crash their worker or run longer than timeout seconds are reported as failed. """
+
+    global _kernal, _pids, _starts
+
+    start_time = time.time()
+
+    _kernal = kernal
+    _pids   = multiprocessing.Array('i', len(tests), lock=False)
+    _starts = multiprocessing.Array('d', len(tests), lock=False)
+    pool    = multiprocessing.Pool(processes=jobs, initializer=_init_worker)
+    workers = set(pool_workers(pool))
+
+    try:
+        pending = [ pool.apply_async(_run_test, (i, skill_name, tc)) for i, (skill_name, tc) in enumerate(tests) ]
+
+        results = []
+        for i, p in enumerate(pending):
+
+            # polling, a blocking get() would not be interruptible
+
+            skill_name, tc = tests[i]
+
+            while True:
+                try:
+                    r = p.get(1.0)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+
+                if not _pids[i]:
+                    continue # not started yet
+
+                duration = time.time() - _starts[i]
+
+                dead = dict([ (w.pid, w.exitcode) for w in dead_workers(pool, workers) ])
+                if _pids[i] in dead:
+                    r = _failed(skill_name, tc, duration, 'worker process died (exit code %d)' % dead[_pids[i]])
+                    break
+
+                # the worker would keep its pool slot until the test ends, if ever:
+                # kill it, the pool replaces it
+
+                if duration > timeout:
+                    _kill(_pids[i])
+                    r = _failed(skill_name, tc, duration, 'timed out after %fs' % duration)
+                    break
+
+            results.append(r)
+
+            if (i+1) % 100 == 0:
+                logging.info ('%d/%d tests done (%fs)' % (i+1, len(tests), time.time()-start_time))
+
+    finally:
+        pool.terminate()
+        pool.join()
+        _kernal = None
+        _pids   = None
+        _starts = None
+
+    logging.info ('%d tests run using %d jobs, took %fs' % (len(tests), jobs, time.time()-start_time))
+
+    return results
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# pattern matcher
+#
+# skills compiled in pattern mode store their dt() patterns unexpanded
+# (pattern_data table). Here, all patterns of a language are merged into
+# one token trie: literal tokens are plain edges, macro invocations are
+# slot edges which carry a token trie of the macro's alternatives. Macros
+# declared via dte.ner_macro() use every entity label of their NER class
+# as alternatives, in patterns of the skill that declared them only.
+#
+# Pattern mode skills have no expanded training data, so they can be
+# neither bundled nor used to train the neural models (see
+# model.pattern_mode_skills).
+#
+# Matching walks the trie along the input tokens and binds the same
+# *_start, *_end and attribute values generate_training_data computes
+# per expanded row, so skill code cannot tell the difference.
+#
+
+import logging
+import json
+import time
+import traceback
+
+from zamiaai             import model
+from zamiaai.data_engine import DataEngine, SEG_LITERAL, SEG_EMPTY
+
+class _Node(object):
+
+    __slots__ = ('tokens', 'slots', 'leaves', 'alts')
+
+    def __init__(self):
+        self.tokens = {} # token -> _Node
+        self.slots  = {} # slot key -> (segment, alternatives trie, _Node)
+        self.leaves = [] # (entry idx, md5s, args, loc_fn, loc_line)
+        self.alts   = [] # in alternatives tries: macro alternatives ending here
+
+class PatternMatcher(object):
+
+    def __init__(self, session):
+
+        self.session = session
+
+        # private data engine: pattern compilation, macro lookups, tokenization cache
+
+        self.dte     = DataEngine(session)
+
+        self.refresh()
+
+    def set_session(self, session):
+
+        """ use session for macro / NER lookups and refreshes, e.g. in a forked worker process """
+
+        self.session = session
+        self.dte     = DataEngine(session)
+
+    def refresh(self):
+
+        """ (re-)build tries from pattern_data, call after compile_skill """
+
+        start_time = time.time()
+
+        self.dte.invalidate_caches()
+        self.dte.pattern_cache = {}
+
+        self.roots      = {} # lang -> _Node
+        self.alt_tries  = {} # (lang, name, vn, NER class) -> alternatives trie
+        self.ner_macros = {} # (skill, lang, name) -> NER class
+
+        for nm in model.live(self.session.query(model.NERMacro), model.NERMacro):
+            self.ner_macros[(nm.skill, nm.lang, nm.name)] = nm.cls
+
+        cnt = 0
+        for pd in model.live(self.session.query(model.PatternData), model.PatternData).order_by(model.PatternData.id):
+
+            root = self.roots.get(pd.lang)
+            if root is None:
+                root = _Node()
+                self.roots[pd.lang] = root
+
+            # a broken pattern must not keep the kernal from starting
+
+            try:
+                self._add_pattern(root, pd.skill, pd.lang, pd.pattern, (cnt, pd.md5s, json.loads(pd.args), pd.loc_fn, pd.loc_line))
+                cnt += 1
+            except:
+                logging.error('pattern matcher: %s:%s: failed to add pattern "%s", skipped.' % (pd.loc_fn, pd.loc_line, pd.pattern))
+                logging.error(traceback.format_exc())
+
+        if cnt:
+            logging.info ('pattern matcher: %d patterns, %d macro tries, took %fs' % (cnt, len(self.alt_tries), time.time()-start_time))
+
+    def _macro_alternatives (self, lang, name, vn, cls, implicit_macros):
+
+        if cls is None:
+            return self.dte._resolve_macro(lang, name, implicit_macros)
+
+        res = []
+        for entity, label in self.dte.lookup_ner(lang, cls):
+            res.append({vn: label, 'ENTITY': entity})
+        return res
+
+    def _alt_trie (self, skill, lang, name, vn, implicit_macros):
+
+        cls = self.ner_macros.get((skill, lang, name))
+
+        key = (lang, name, vn, cls)
+        implicit = name in implicit_macros and cls is None
+        if not implicit and key in self.alt_tries:
+            return self.alt_tries[key]
+
+        root = _Node()
+        for alt in self._macro_alternatives(lang, name, vn, cls, implicit_macros):
+            node = root
+            for t in self.dte._macro_tokens(lang, alt[vn]):
+                child = node.tokens.get(t)
+                if child is None:
+                    child = _Node()
+                    node.tokens[t] = child
+                node = child
+            node.alts.append(alt)
+
+        # implicit macros are specific to their pattern
+
+        if not implicit:
+            self.alt_tries[key] = root
+
+        return root
+
+    def _add_pattern (self, root, skill, lang, pattern, entry):
+
+        segments, implicit_macros = self.dte._compile_pattern(lang, pattern)
+
+        node = root
+
+        for seg in segments:
+
+            if seg[0] == SEG_LITERAL:
+                for t in seg[1]:
+                    child = node.tokens.get(t)
+                    if child is None:
+                        child = _Node()
+                        node.tokens[t] = child
+                    node = child
+                continue
+
+            if seg[0] == SEG_EMPTY:
+                continue
+
+            _, name, vn, mpn, first, tok_vars = seg
+
+            # NER macros are scoped to their skill: same slot only if the same class applies
+
+            key = seg + (self.ner_macros.get((skill, lang, name)), )
+            if name in implicit_macros:
+                key = seg + (tuple([ tuple(alt['W']) for alt in implicit_macros[name] ]), )
+
+            slot = node.slots.get(key)
+            if slot is None:
+                alt_trie = self._alt_trie(skill, lang, name, vn, implicit_macros) if first else None
+                slot = (seg, alt_trie, _Node())
+                node.slots[key] = slot
+
+            node = slot[2]
+
+        node.leaves.append(entry)
+
+    def _match_alts (self, trie, tokens, pos):
+
+        """ yield (end pos, alternative) for all macro alternatives matching tokens starting at pos """
+
+        node = trie
+        while True:
+            for alt in node.alts:
+                yield pos, alt
+            if pos >= len(tokens):
+                break
+            node = node.tokens.get(tokens[pos])
+            if node is None:
+                break
+            pos += 1
+
+    def _bind (self, lang, seg, alt, start, end, mpos):
+
+        _, name, vn, mpn, first, tok_vars = seg
+
+        keys = [ mpn + '_start', mpn + '_end' ]
+        mpos[keys[0]] = start
+        mpos[keys[1]] = end
+
+        for vn3 in alt:
+            v = alt[vn3]
+            if vn3 in tok_vars:
+                v = self.dte._macro_tokens(lang, v)
+            k = '%s_%s' % (mpn, vn3.lower())
+            mpos[k] = v
+            keys.append(k)
+
+        return keys
+
+    def _match (self, lang, node, tokens, pos, mpos, bound, res):
+
+        if pos == len(tokens):
+            for entry in node.leaves:
+                res.setdefault(entry[0], (entry, []))[1].append(dict(mpos))
+        else:
+            child = node.tokens.get(tokens[pos])
+            if child is not None:
+                self._match(lang, child, tokens, pos+1, mpos, bound, res)
+
+        for seg, alt_trie, child in node.slots.values():
+
+            name  = seg[1]
+            vn    = seg[2]
+
+            if seg[4]:
+                matches = list(self._match_alts(alt_trie, tokens, pos))
+            else:
+                alt = bound.get(name)
+                if alt is None or not vn in alt:
+                    continue
+                vtoks = self.dte._macro_tokens(lang, alt[vn])
+                if tokens[pos:pos+len(vtoks)] != vtoks:
+                    continue
+                matches = [ (pos + len(vtoks), alt) ]
+
+            for end, alt in matches:
+
+                prev = bound.get(name)
+                bound[name] = alt
+                keys = self._bind(lang, seg, alt, pos, end, mpos)
+
+                self._match(lang, child, tokens, end, mpos, bound, res)
+
+                for k in keys:
+                    del mpos[k]
+                if prev is None:
+                    del bound[name]
+                else:
+                    bound[name] = prev
+
+    def lookup(self, lang, inp):
+
+        """ same result format as DataEngine.lookup_data_train """
+
+        root = self.roots.get(lang)
+        if root is None:
+            return []
+
+        tokens = inp.split(u' ') if inp else []
+
+        res = {} # entry idx -> (entry, [mpos, ...])
+        self._match(lang, root, tokens, 0, {}, {}, res)
+
+        # one result per distinct binding, like one training data row per expansion
+
+        matches = []
+        for idx in sorted(res):
+            entry, mposs = res[idx]
+            idx, md5s, args, loc_fn, loc_line = entry
+
+            seen = set()
+            for mpos in mposs:
+
+                if args:
+                    d_args = map(lambda x: mpos[x] if x in mpos else x, args)
+                else:
+                    d_args = None
+
+                k = json.dumps(d_args)
+                if k in seen:
+                    continue
+                seen.add(k)
+
+                matches.append( (lang, inp, md5s, d_args, loc_fn, loc_line) )
+
+        return matches
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# read-only runtime bundle
+#
+# single binary file holding everything a serving kernal needs from the db:
+# a hash table mapping normalized utterances to code + args, the deduplicated
+# code table and the NER dictionaries. The file is mmap'ed, so all processes
+# serving the same bundle share its pages through the OS page cache.
+# write_bundle replaces the file atomically, serving processes notice the new
+# file (changed()) and map it instead.
+#
+# layout (all integers little endian):
+#
+#   header   : magic, version, section offsets/sizes (HEADER_FMT)
+#   records  : per (lang, inp) key (one or more): key string, entry count,
+#              entries (code idx, args str idx, loc_fn str idx, loc_line)
+#   slots    : open addressing hash table, (hash64, record offset) per slot
+#   codes    : sorted by md5s: (md5s, offset of fn + code strings)
+#   strings  : offset table of deduplicated strings (args json, loc_fn)
+#   ner      : json directory lang -> cls -> (offset, length) of json arrays
+#
+
+import os
+import mmap
+import struct
+import json
+import hashlib
+import logging
+import time
+
+from zamiaai                import model
+from zamiaai.compact_schema import iter_training_data
+
+BUNDLE_MAGIC   = b'ZAIB'
+BUNDLE_VERSION = 1
+
+HEADER_FMT     = '<4sIIQIQIQQQ'
+HEADER_SIZE    = struct.calcsize(HEADER_FMT)
+SLOT_FMT       = '<QQ'
+SLOT_SIZE      = struct.calcsize(SLOT_FMT)
+CODE_FMT       = '<32sQ'
+CODE_SIZE      = struct.calcsize(CODE_FMT)
+ENTRY_FMT      = '<IIII'
+ENTRY_SIZE     = struct.calcsize(ENTRY_FMT)
+
+def hash64(key):
+    h = struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+    return h if h else 1 # 0 marks empty slots
+
+def _key(lang, inp):
+    return (u'%s\t%s' % (lang, inp)).encode('utf8')
+
+def _pack_str(s):
+    b = s.encode('utf8') if s is not None else b''
+    return struct.pack('<I', len(b)) + b
+
+def write_bundle(session, bundlefn):
+
+    """ write runtime bundle from db contents, atomically replaces bundlefn """
+
+    start_time = time.time()
+
+    # the bundle holds expanded training data only, pattern mode skills would be missing silently
+
+    pm_skills = model.pattern_mode_skills(session)
+    if pm_skills:
+        raise Exception ('runtime bundle: skills compiled in pattern mode cannot be bundled: %s' % ', '.join(pm_skills))
+
+    tmpfn = '%s.tmp%d' % (bundlefn, os.getpid())
+
+    strings    = {} # str -> idx
+    string_tab = []
+
+    def str_idx(s):
+        if not s in strings:
+            strings[s] = len(string_tab)
+            string_tab.append(s)
+        return strings[s]
+
+    # code table
+
+    codes = {}
+    for cd in session.query(model.Code):
+        codes[cd.md5s] = (cd.fn, cd.code)
+    code_md5s = sorted(codes)
+    code_idx  = dict((md5s, i) for i, md5s in enumerate(code_md5s))
+
+    with open(tmpfn, 'wb') as f:
+
+        f.write(b'\0' * HEADER_SIZE)
+
+        #
+        # records, grouped by (lang, inp). Both training data schemas are
+        # grouped separately, so a key can have more than one record.
+        #
+
+        keys    = [] # (hash64, record offset)
+        cur_key = None
+        entries = []
+
+        def flush_record():
+            keys.append((hash64(cur_key), f.tell()))
+            f.write(struct.pack('<I', len(cur_key)) + cur_key)
+            f.write(struct.pack('<I', len(entries)))
+            for e in entries:
+                f.write(struct.pack(ENTRY_FMT, *e))
+
+        for lang, skill, inp, md5s, args, loc_fn, loc_line, generation in iter_training_data(session, grouped=True):
+
+            key = _key(lang, inp)
+            if key != cur_key:
+                if cur_key is not None:
+                    flush_record()
+                cur_key = key
+                entries = []
+
+            if not md5s in codes:
+                logging.warn('bundle: code %s of "%s" not found, skipped.' % (md5s, inp))
+                continue
+
+            entries.append((code_idx[md5s], str_idx(args), str_idx(loc_fn), loc_line or 0))
+
+        if cur_key is not None:
+            flush_record()
+
+        #
+        # hash table, load factor <= 0.5
+        #
+
+        n_slots = 1
+        while n_slots < 2 * len(keys):
+            n_slots *= 2
+        mask = n_slots - 1
+
+        slots = [(0, 0)] * n_slots
+        for h, off in keys:
+            i = h & mask
+            while slots[i][0]:
+                i = (i + 1) & mask
+            slots[i] = (h, off)
+        keys = None
+
+        slots_off = f.tell()
+        for h, off in slots:
+            f.write(struct.pack(SLOT_FMT, h, off))
+        slots = None
+
+        #
+        # codes
+        #
+
+        code_offs = []
+        for md5s in code_md5s:
+            fn, code = codes[md5s]
+            code_offs.append(f.tell())
+            f.write(_pack_str(fn))
+            f.write(_pack_str(code))
+
+        codes_off = f.tell()
+        for i, md5s in enumerate(code_md5s):
+            f.write(struct.pack(CODE_FMT, md5s.encode('ascii'), code_offs[i]))
+
+        #
+        # strings
+        #
+
+        str_offs = []
+        for s in string_tab:
+            str_offs.append(f.tell())
+            f.write(_pack_str(s))
+
+        strings_off = f.tell()
+        for off in str_offs:
+            f.write(struct.pack('<Q', off))
+
+        #
+        # NER
+        #
+
+        ner = {}
+        for nd in model.live(session.query(model.NERData), model.NERData).order_by(model.NERData.lang, model.NERData.cls, model.NERData.id):
+            if not nd.lang in ner:
+                ner[nd.lang] = {}
+            if not nd.cls in ner[nd.lang]:
+                ner[nd.lang][nd.cls] = []
+            ner[nd.lang][nd.cls].append((nd.entity, nd.label))
+
+        ner_dir = {}
+        for lang in ner:
+            ner_dir[lang] = {}
+            for cls in ner[lang]:
+                b = json.dumps(ner[lang][cls]).encode('utf8')
+                ner_dir[lang][cls] = (f.tell(), len(b))
+                f.write(b)
+
+        ner_off = f.tell()
+        b = json.dumps(ner_dir).encode('utf8')
+        f.write(b)
+        ner_len = len(b)
+
+        f.seek(0)
+        f.write(struct.pack(HEADER_FMT, BUNDLE_MAGIC, BUNDLE_VERSION, n_slots, slots_off,
+                            len(codes), codes_off, len(string_tab), strings_off, ner_off, ner_len))
+
+    os.rename(tmpfn, bundlefn)
+
+    logging.info('runtime bundle %s written: %d slots, %d codes, %d strings, took %fs' %
+                 (bundlefn, n_slots, len(codes), len(string_tab), time.time()-start_time))
+
+class RuntimeBundle(object):
+
+    def __init__(self, bundlefn):
+
+        self.bundlefn = bundlefn
+
+        with open(bundlefn, 'rb') as f:
+            self.file_id = self._file_id(os.fstat(f.fileno()))
+            self.mm      = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n_slots, self.slots_off, self.n_codes, self.codes_off, \
+            self.n_strings, self.strings_off, ner_off, ner_len = struct.unpack_from(HEADER_FMT, self.mm, 0)
+
+        if magic != BUNDLE_MAGIC:
+            raise Exception ('%s is not a runtime bundle.' % bundlefn)
+        if version != BUNDLE_VERSION:
+            raise Exception ('%s: unsupported bundle version %d (expected %d)' % (bundlefn, version, BUNDLE_VERSION))
+
+        self.mask    = self.n_slots - 1
+        self.ner_dir = json.loads(self.mm[ner_off:ner_off+ner_len].decode('utf8'))
+
+        logging.info('runtime bundle %s mapped: %d slots, %d codes.' % (bundlefn, self.n_slots, self.n_codes))
+
+    def close(self):
+        self.mm.close()
+
+    def _file_id(self, st):
+        return (st.st_dev, st.st_ino, st.st_mtime)
+
+    def changed(self):
+
+        """ has bundlefn been replaced since it was mapped? """
+
+        try:
+            return self._file_id(os.stat(self.bundlefn)) != self.file_id
+        except OSError:
+            return False # gone: keep serving what we have
+
+    def _str_at(self, off):
+        l = struct.unpack_from('<I', self.mm, off)[0]
+        return self.mm[off+4:off+4+l].decode('utf8'), off+4+l
+
+    def _string(self, idx):
+        off = struct.unpack_from('<Q', self.mm, self.strings_off + idx * 8)[0]
+        return self._str_at(off)[0]
+
+    def _md5s(self, idx):
+        return struct.unpack_from('<32s', self.mm, self.codes_off + idx * CODE_SIZE)[0].decode('ascii')
+
+    def _code(self, idx):
+        md5s, off = struct.unpack_from(CODE_FMT, self.mm, self.codes_off + idx * CODE_SIZE)
+        fn, off   = self._str_at(off)
+        code, off = self._str_at(off)
+        return md5s.decode('ascii'), fn, code
+
+    def lookup(self, lang, inp):
+
+        key = _key(lang, inp)
+        h   = hash64(key)
+        i   = h & self.mask
+
+        # a key can have more than one record, probe up to the next empty slot
+
+        res = []
+
+        while True:
+
+            sh, off = struct.unpack_from(SLOT_FMT, self.mm, self.slots_off + i * SLOT_SIZE)
+            if not sh:
+                break
+            i = (i + 1) & self.mask
+
+            if sh != h:
+                continue
+            l = struct.unpack_from('<I', self.mm, off)[0]
+            if self.mm[off+4:off+4+l] != key:
+                continue
+
+            off += 4 + l
+            n = struct.unpack_from('<I', self.mm, off)[0]
+            off += 4
+
+            for j in range(n):
+                code_idx, args_idx, loc_fn_idx, loc_line = struct.unpack_from(ENTRY_FMT, self.mm, off + j * ENTRY_SIZE)
+                md5s = self._md5s(code_idx)
+                args = self._string(args_idx)
+                res.append((lang, inp, md5s, json.loads(args) if args else None, self._string(loc_fn_idx), loc_line))
+
+        return res
+
+    def lookup_code(self, md5s):
+
+        # binary search in sorted code table
+
+        k  = md5s.encode('ascii')
+        lo = 0
+        hi = self.n_codes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            m   = struct.unpack_from('<32s', self.mm, self.codes_off + mid * CODE_SIZE)[0]
+            if m < k:
+                lo = mid + 1
+            elif m > k:
+                hi = mid
+            else:
+                md5s, fn, code = self._code(mid)
+                return fn, code
+
+        return None
+
+    def lookup_ner(self, lang, cls):
+
+        if not lang in self.ner_dir or not cls in self.ner_dir[lang]:
+            return []
+
+        off, l = self.ner_dir[lang][cls]
+        return [ tuple(e) for e in json.loads(self.mm[off:off+l].decode('utf8')) ]
+
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# skill test results: summary report, JUnit style XML
+#
+
+import os
+import logging
+
+from collections import namedtuple
+from xml.etree   import ElementTree
+
+DEFAULT_REPORT_SLOWEST = 10
+
+# failure is None for tests that passed, fail_round the round the test failed in
+
+SkillTestResult = namedtuple('SkillTestResult', ('skill', 'name', 'lang', 'loc_fn', 'loc_line',
+                                                 'duration', 'failure', 'fail_round'))
+
+def count_fails(results):
+    return len(filter(lambda r: r.failure is not None, results))
+
+def log_report(results, slowest=DEFAULT_REPORT_SLOWEST):
+
+    """ log failed tests with their source locations and the slowest tests """
+
+    for r in results:
+        if r.failure is None:
+            continue
+        logging.error (u'FAILED %s:%s %s (%s) round %d: %s' % (r.loc_fn, r.loc_line, r.name, r.skill, r.fail_round, r.failure))
+
+    if not results or not slowest:
+        return
+
+    logging.info ('%d slowest tests:' % min(slowest, len(results)))
+    for r in sorted(results, key=lambda r: r.duration, reverse=True)[:slowest]:
+        logging.info (u'%8.3fs %-12s %s %s:%s' % (r.duration, r.skill, r.name, os.path.basename(r.loc_fn or ''), r.loc_line))
+
+def write_junit_xml(results, fn):
+
+    """ one testsuite per skill, one testcase per test, durations in seconds """
+
+    suites = {}
+    for r in results:
+        suites.setdefault(r.skill, []).append(r)
+
+    root = ElementTree.Element('testsuites', tests=str(len(results)), failures=str(count_fails(results)),
+                               time='%.3f' % sum([ r.duration for r in results ]))
+
+    for skill in sorted(suites):
+
+        rs    = suites[skill]
+        suite = ElementTree.SubElement(root, 'testsuite', name=skill, tests=str(len(rs)), failures=str(count_fails(rs)),
+                                       errors='0', time='%.3f' % sum([ r.duration for r in rs ]))
+
+        for r in rs:
+
+            tc = ElementTree.SubElement(suite, 'testcase', classname=skill, name=r.name, time='%.3f' % r.duration,
+                                        file=r.loc_fn or '', line=str(r.loc_line))
+
+            if r.failure is not None:
+                failure = ElementTree.SubElement(tc, 'failure', message=r.failure)
+                failure.text = u'%s:%s: round %d: %s' % (r.loc_fn, r.loc_line, r.fail_round, r.failure)
+
+    ElementTree.ElementTree(root).write(fn, encoding='utf-8')
+
+    logging.info ('test report written to %s' % fn)
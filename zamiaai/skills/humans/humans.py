@@ -49,6 +49,11 @@ def get_data(k):
                          'wdeRonaldReagan' ])
 
     for lang in ['en', 'de']:
+
+        # in pattern mode, {known_humans:W} in this skill's patterns matches every human, not just macro_humans
+
+        k.dte.ner_macro(lang, 'known_humans', 'human')
+
         cnt = 0
         for res in k.prolog_query("wdpdInstanceOf(HUMAN, wdeHuman), rdfsLabel(HUMAN, %s, LABEL)." % lang):
             s_human = res[0].name 
@@ -49,6 +49,8 @@ from copy              import deepcopy
 
 import model
 
+from compact_schema    import iter_training_data
+
 from nltools.tokenizer import tokenize
 from nltools.misc      import mkdirs
 
@@ -221,7 +223,7 @@ class UttClassModel(object):
 
         self.drs = {} 
         self.training_data = []
-        for dr in self.session.query(model.TrainingData).filter(model.TrainingData.lang==self.lang):
+        for dr in iter_training_data(self.session, lang=self.lang):
 
             self.drs[dr.inp] = dr.skill
             self.training_data.append((tokenize(dr.inp, lang=self.lang), dr.skill))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright 2018 Guenter Bartsch
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+#
+# multiprocessing.Pool worker tracking, shared by parallel compilation and
+# the parallel test runner
+#
+# A task picked up by a worker that dies never completes: the pool just
+# replaces the worker, AsyncResult.get() keeps waiting. multiprocessing has
+# no public API to notice this, so we look at the pool's worker processes.
+# Pool._pool (list of multiprocessing.Process) is a CPython implementation
+# detail, present in 2.7 and 3.x. This module is the only place touching it.
+#
+
+def pool_workers(pool):
+
+    """ pool's current worker processes """
+
+    return list(pool._pool)
+
+def dead_workers(pool, workers):
+
+    """ track pool's worker processes in workers (a set), return the ones that died since """
+
+    for w in pool_workers(pool):
+        workers.add(w)
+
+    return [ w for w in workers if w.exitcode is not None ]